@@ -0,0 +1,84 @@
+"""
+Local stand-in for IpStack API used by load tests. Answers every request
+GET /{ip_or_url} with an ipstack-shaped geolocation after
+FAKE_IP_STACK_LATENCY_MS milliseconds (default 50). Values starting with
+FAKE_IP_STACK_NOT_FOUND_PREFIX get an ipstack error response instead.
+Comma-separated values (bulk lookups) are answered with a list.
+
+Run: python -m uvicorn benchmarks.fake_ip_stack:app --port 8081
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import zlib
+
+LATENCY = float(os.getenv("FAKE_IP_STACK_LATENCY_MS", "50")) / 1000
+NOT_FOUND_PREFIX = os.getenv("FAKE_IP_STACK_NOT_FOUND_PREFIX", "100.127.")
+
+
+def fake_geolocation(value: str) -> dict:
+    # the same value always gets the same geolocation
+    seed = zlib.crc32(value.encode())
+    try:
+        ip = str(ipaddress.ip_address(value))
+        ip_type = "ipv6" if ":" in ip else "ipv4"
+    except ValueError:
+        ip, ip_type = "93.184.216.34", "ipv4"
+    return {
+        "ip": ip,
+        "type": ip_type,
+        "continent_code": "EU",
+        "continent_name": "Europe",
+        "country_code": "PL",
+        "country_name": "Poland",
+        "region_code": "MZ",
+        "region_name": "Mazovia",
+        "city": "Warsaw",
+        "zip": "00-025",
+        "latitude": 52.0 + (seed % 1000) / 1000,
+        "longitude": 21.0 + (seed // 1000 % 1000) / 1000,
+        "location": {
+            "geoname_id": 756135,
+            "capital": "Warsaw",
+            "languages": [{"code": "pl", "name": "Polish", "native": "Polski"}],
+            "country_flag": "https://assets.ipstack.com/flags/pl.svg",
+            "country_flag_emoji": "🇵🇱",
+            "country_flag_emoji_unicode": "U+1F1F5 U+1F1F1",
+            "calling_code": "48",
+            "is_eu": True,
+        },
+    }
+
+
+def fake_response(value: str) -> dict:
+    if value.startswith(NOT_FOUND_PREFIX):
+        # ipstack answers with 200 and error details for unknown values
+        return {"success": False, "error": {"code": 106, "type": "invalid_ip"}}
+    return fake_geolocation(value)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    values = scope["path"].lstrip("/").split(",")
+    await asyncio.sleep(LATENCY)
+    payload = [fake_response(value) for value in values]
+    if len(payload) == 1:
+        payload = payload[0]
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
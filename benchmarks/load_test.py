@@ -0,0 +1,416 @@
+"""
+Load test of GET, POST and DELETE /geolocations against a running API.
+
+Seeds Postgres (DATABASE_URL) with geolocations, locations and languages,
+starts a fake IpStack API with configurable latency and the API itself
+(both with uvicorn), replays a reproducible mix of requests and writes
+p50/p95/p99 latencies and requests per second to a JSON results file.
+Rows created by the load test use addresses from 100.64.0.0/10, locations
+with geoname_id from BENCHMARK_GEONAME_ID and languages with codes from
+BENCHMARK_LANGUAGE_CODES (never real language codes); they are removed
+before seeding.
+
+Run from repository root, e.g.:
+    python -m benchmarks.load_test --requests 20000 --concurrency 50 \\
+        --hit-ratio 0.9 --ipstack-latency-ms 80 --output results.json
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import delete, insert, select, text
+
+from src.database import engine
+from src.models import Base, IpGeolocation, Language, Location
+from src.models import location_language_association as association
+
+from .common import run_metadata, write_results
+from .fake_ip_stack import NOT_FOUND_PREFIX
+
+BENCHMARK_NETWORK = "100.64.0.0/10"
+SEEDED_IPS = ipaddress.IPv4Address("100.64.0.0")
+DELETABLE_IPS = ipaddress.IPv4Address("100.80.0.0")
+MISSING_IPS = ipaddress.IPv4Address("100.96.0.0")
+CREATED_IPS = ipaddress.IPv4Address("100.112.0.0")
+NOT_FOUND_IPS = ipaddress.IPv4Address(f"{NOT_FOUND_PREFIX}0.0")
+BENCHMARK_GEONAME_ID = 900_000_000
+# codes of seeded languages, only these exact codes are removed
+BENCHMARK_LANGUAGE_CODES = [f"q{index:04d}" for index in range(10000)]
+
+# statuses expected for each operation, others are counted as errors
+EXPECTED_STATUSES = {
+    "get_hit": {200},
+    "get_miss": {200},
+    "get_not_found": {404},
+    "post": {201},
+    "delete": {204},
+}
+
+Operation = Tuple[str, str, str, Optional[dict]]
+
+
+def geolocation_row(ip: str, location_id: int, generator: random.Random) -> dict:
+    return {
+        "ip": ip,
+        "type": "ipv4",
+        "continent_code": "EU",
+        "continent_name": "Europe",
+        "country_code": "PL",
+        "country_name": "Poland",
+        "region_code": "MZ",
+        "region_name": "Mazovia",
+        "city": "Warsaw",
+        "zip": "00-025",
+        "latitude": round(generator.uniform(-90, 90), 4),
+        "longitude": round(generator.uniform(-180, 180), 4),
+        "location_id": location_id,
+    }
+
+
+def location_row(index: int) -> dict:
+    return {
+        "geoname_id": BENCHMARK_GEONAME_ID + index,
+        "capital": f"Capital {index}",
+        "country_flag": "https://assets.ipstack.com/flags/pl.svg",
+        "country_flag_emoji": "🇵🇱",
+        "country_flag_emoji_unicode": "U+1F1F5 U+1F1F1",
+        "calling_code": str(index % 1000),
+        "is_eu": index % 2 == 0,
+    }
+
+
+def remove_benchmark_rows(connection) -> None:
+    connection.execute(
+        delete(IpGeolocation).where(
+            text("ip << CAST(:network AS inet)").bindparams(network=BENCHMARK_NETWORK)
+        )
+    )
+    benchmark_locations = select(Location.id).where(
+        Location.geoname_id >= BENCHMARK_GEONAME_ID
+    )
+    connection.execute(
+        delete(IpGeolocation).where(IpGeolocation.location_id.in_(benchmark_locations))
+    )
+    connection.execute(
+        delete(association).where(association.c.location_id.in_(benchmark_locations))
+    )
+    connection.execute(
+        delete(Location).where(Location.geoname_id >= BENCHMARK_GEONAME_ID)
+    )
+    connection.execute(
+        delete(Language).where(Language.code.in_(BENCHMARK_LANGUAGE_CODES))
+    )
+
+
+def seed_database(
+    geolocations: int, deletable: int, locations: int, languages: int, seed: int
+) -> None:
+    generator = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        remove_benchmark_rows(connection)
+
+        language_ids = connection.scalars(
+            insert(Language).returning(Language.id, sort_by_parameter_order=True),
+            [
+                {
+                    "code": code,
+                    "name": f"Language {index}",
+                    "native": f"Native {index}",
+                }
+                for index, code in enumerate(BENCHMARK_LANGUAGE_CODES[:languages])
+            ],
+        ).all()
+        location_ids = connection.scalars(
+            insert(Location).returning(Location.id, sort_by_parameter_order=True),
+            [location_row(index) for index in range(locations)],
+        ).all()
+        connection.execute(
+            insert(association),
+            [
+                {"location_id": location_id, "language_id": language_id}
+                for location_id in location_ids
+                for language_id in generator.sample(
+                    language_ids, min(len(language_ids), generator.randint(1, 3))
+                )
+            ],
+        )
+
+        rows = [
+            geolocation_row(
+                str(SEEDED_IPS + index), generator.choice(location_ids), generator
+            )
+            for index in range(geolocations)
+        ] + [
+            geolocation_row(
+                str(DELETABLE_IPS + index), generator.choice(location_ids), generator
+            )
+            for index in range(deletable)
+        ]
+        batch_size = 5000
+        for start in range(0, len(rows), batch_size):
+            end = start + batch_size
+            connection.execute(insert(IpGeolocation), rows[start:end])
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("get", "post", "delete"):
+            raise argparse.ArgumentTypeError(f"Unknown operation in mix: {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+def build_operations(args: argparse.Namespace, count: int) -> List[Operation]:
+    """
+    Builds reproducible list of (kind, method, path, body) operations.
+    Popular seeded geolocations are requested much more often than others.
+    """
+    generator = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    popularity = [1 / (rank + 1) for rank in range(args.geolocations)]
+    kinds = generator.choices(list(mix), weights=list(mix.values()), k=count)
+    operations = []
+    counters = {"miss": 0, "not_found": 0, "post": 0, "delete": 0}
+    for kind in kinds:
+        if kind == "get":
+            draw = generator.random()
+            if draw < args.hit_ratio:
+                index = generator.choices(range(args.geolocations), popularity)[0]
+                operations.append(
+                    ("get_hit", "GET", f"/geolocations/{SEEDED_IPS + index}", None)
+                )
+            elif draw < args.hit_ratio + (1 - args.hit_ratio) * args.not_found_ratio:
+                ip = NOT_FOUND_IPS + counters["not_found"]
+                counters["not_found"] += 1
+                operations.append(("get_not_found", "GET", f"/geolocations/{ip}", None))
+            else:
+                ip = MISSING_IPS + counters["miss"]
+                counters["miss"] += 1
+                operations.append(("get_miss", "GET", f"/geolocations/{ip}", None))
+        elif kind == "post":
+            ip = str(CREATED_IPS + counters["post"])
+            counters["post"] += 1
+            body = geolocation_row(ip, 0, generator)
+            del body["location_id"]
+            operations.append(("post", "POST", "/geolocations", body))
+        else:
+            ip = DELETABLE_IPS + counters["delete"]
+            counters["delete"] += 1
+            operations.append(("delete", "DELETE", f"/geolocations/{ip}", None))
+    return operations
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    # nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0,
+    }
+
+
+async def replay(
+    base_url: str, operations: List[Operation], concurrency: int
+) -> Tuple[Dict[str, List[float]], Dict[str, int], float]:
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    pending = iter(operations)
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=30,
+        limits=httpx.Limits(max_connections=concurrency),
+    ) as client:
+
+        async def worker():
+            for kind, method, path, body in pending:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                    failed = response.status_code not in EXPECTED_STATUSES[kind]
+                except httpx.HTTPError:
+                    failed = True
+                latencies.setdefault(kind, []).append(time.perf_counter() - start)
+                errors[kind] = errors.get(kind, 0) + failed
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def start_server(app: str, port: int, env: dict, workers: int = 1) -> subprocess.Popen:
+    command = [sys.executable, "-m", "uvicorn", app, "--port", str(port)]
+    command += ["--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(command, env={**os.environ, **env})
+
+
+def wait_for_server(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server for {url} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server for {url} did not start in {timeout} seconds")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--geolocations", type=int, default=10000)
+    parser.add_argument("--locations", type=int, default=200)
+    parser.add_argument(
+        "--languages",
+        type=int,
+        default=50,
+        help=f"at most {len(BENCHMARK_LANGUAGE_CODES)}",
+    )
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--mix",
+        default="get=90,post=5,delete=5",
+        help="weights of operations, e.g. get=90,post=5,delete=5",
+    )
+    parser.add_argument(
+        "--hit-ratio",
+        type=float,
+        default=0.9,
+        help="fraction of GET requests for geolocations stored in database",
+    )
+    parser.add_argument(
+        "--not-found-ratio",
+        type=float,
+        default=0.1,
+        help="fraction of missing geolocations IpStack API has no data for",
+    )
+    parser.add_argument("--ipstack-latency-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--api-port", type=int, default=8090)
+    parser.add_argument("--ipstack-port", type=int, default=8091)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--api-env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="env variable of the API under test, e.g. GEOLOCATION_CACHE_MAX_SIZE=0",
+    )
+    parser.add_argument(
+        "--base-url",
+        help="URL of an already running API (configured by the caller) "
+        "instead of starting one",
+    )
+    parser.add_argument("--no-seed", action="store_true")
+    parser.add_argument("--output", default="benchmarks/results/load_test.json")
+    args = parser.parse_args(argv)
+    if args.languages > len(BENCHMARK_LANGUAGE_CODES):
+        parser.error(f"--languages must be at most {len(BENCHMARK_LANGUAGE_CODES)}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    args = parse_args(argv)
+    operations = build_operations(args, args.warmup + args.requests)
+    deletable = sum(1 for kind, *_ in operations if kind == "delete")
+    if not args.no_seed:
+        seed_database(
+            args.geolocations, deletable, args.locations, args.languages, args.seed
+        )
+
+    processes = []
+    try:
+        base_url = args.base_url
+        if base_url is None:
+            ip_stack_url = f"http://127.0.0.1:{args.ipstack_port}"
+            processes.append(
+                start_server(
+                    "benchmarks.fake_ip_stack:app",
+                    args.ipstack_port,
+                    {"FAKE_IP_STACK_LATENCY_MS": str(args.ipstack_latency_ms)},
+                )
+            )
+            wait_for_server(ip_stack_url, processes[-1])
+            api_env = {
+                "IP_STACK_API_BASE_URL": ip_stack_url,
+                "IP_STACK_API_ACCESS_KEY": "load-test",
+                **dict(value.split("=", 1) for value in args.api_env),
+            }
+            base_url = f"http://127.0.0.1:{args.api_port}"
+            processes.append(
+                start_server("src.main:app", args.api_port, api_env, args.workers)
+            )
+            wait_for_server(base_url, processes[-1])
+
+        warmup = args.warmup
+        asyncio.run(replay(base_url, operations[:warmup], args.concurrency))
+        latencies, errors, elapsed = asyncio.run(
+            replay(base_url, operations[warmup:], args.concurrency)
+        )
+        # e.g. number of IpStack API requests made during the run
+        api_stats = httpx.get(f"{base_url}/stats", timeout=10).json()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    results = {
+        **run_metadata("load_test"),
+        "config": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("output", "no_seed")
+        },
+        "results": {
+            kind: summarize(latencies[kind], errors[kind], elapsed)
+            for kind in sorted(latencies)
+        },
+        "total": summarize(
+            [latency for values in latencies.values() for latency in values],
+            sum(errors.values()),
+            elapsed,
+        ),
+        "api_stats": api_stats,
+    }
+    write_results(args.output, results)
+
+    for kind, summary in {**results["results"], "total": results["total"]}.items():
+        print(
+            f"{kind:14} {summary['requests']:7} req  {summary['errors']:5} err  "
+            f"{summary['rps']:9.1f} rps  p50 {summary['p50_ms']:8.2f} ms  "
+            f"p95 {summary['p95_ms']:8.2f} ms  p99 {summary['p99_ms']:8.2f} ms"
+        )
+    print(f"Results written to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Microbenchmarks of code running on every request: URL and IP normalization
+(uncached, memoized on a realistic stream of repeated values, and the
+previous exception-driven implementation), IpGeolocationModel validation of
+ipstack-shaped payloads, as_dict() and direct serialization of fully loaded
+database rows versus the previous validated round trip, response encoding
+and offline geo database lookups.
+
+Results are stored as JSON per commit (benchmarks/results/microbenchmarks/
+<commit>.json by default), so that runs on different commits can be compared:
+
+    python -m benchmarks.microbenchmarks
+    git checkout other-branch
+    python -m benchmarks.microbenchmarks --compare <first commit>
+"""
+
+import argparse
+import csv
+import ipaddress
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import timeit
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, urlsplit
+
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+
+from src.api.v1.endpoints.offline_geo_db import (
+    ATTRIBUTE_FIELDS,
+    OfflineGeoDatabase,
+    build_offline_geo_database,
+)
+from src.api.v1.endpoints.serializers import (
+    encode_compact_geolocation,
+    json_response,
+    serialize_geolocation,
+)
+from src.models import IpGeolocation, Language, Location
+from src.validators import IpGeolocationModel, normalize_ip_or_url, normalize_url
+
+from .common import run_metadata, write_results
+from .fake_ip_stack import fake_geolocation
+
+RESULTS_DIRECTORY = "benchmarks/results/microbenchmarks"
+
+response_adapter = TypeAdapter(IpGeolocationModel)
+
+
+def clear_normalization_caches() -> None:
+    # urlsplit() memoizes its results too (since Python 3.11)
+    normalize_ip_or_url.cache_clear()
+    normalize_url.cache_clear()
+    getattr(urlsplit, "cache_clear", lambda: None)()
+
+
+def uncached(func: Callable[[str], object], value: str) -> Callable[[], object]:
+    def run() -> object:
+        clear_normalization_caches()
+        return func(value)
+
+    return run
+
+
+def previous_normalize_url(url: str) -> str:
+    try:
+        if not urlparse(url).scheme:
+            url = f"http://{url}"
+
+        parsed_url = urlparse(url)
+        if parsed_url.netloc and "." in parsed_url.netloc:
+            return parsed_url.netloc
+        return ""
+    except ValueError:
+        return ""
+
+
+def previous_normalize_ip_or_url(value: str) -> Optional[Tuple[str, str]]:
+    try:
+        return str(ipaddress.ip_address(value)), "ip"
+    except ValueError:
+        normalized_value = previous_normalize_url(value)
+        if not normalized_value:
+            return None
+        return normalized_value, "url"
+
+
+def build_lookup_values(distinct: int, total: int, seed: int = 0) -> List[str]:
+    """
+    Mix of IPv4, IPv6, hostname and URL lookup values, where popular values
+    are looked up much more often than others.
+    """
+    generator = random.Random(seed)
+    hosts = ["example.com", "dns.google", "api.github.com", "en.wikipedia.org"]
+    values = []
+    for index in range(distinct):
+        kind = index % 4
+        if kind == 0:
+            values.append(str(ipaddress.IPv4Address(generator.getrandbits(32))))
+        elif kind == 1:
+            values.append(str(ipaddress.IPv6Address(generator.getrandbits(128))))
+        elif kind == 2:
+            values.append(f"sub{index}.{generator.choice(hosts)}")
+        else:
+            values.append(f"https://sub{index}.{generator.choice(hosts)}/path?q=1")
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    return generator.choices(values, weights=weights, k=total)
+
+
+def cycled(func: Callable[[str], object], values: List[str]) -> Callable[[], object]:
+    next_value = itertools.cycle(values).__next__
+    return lambda: func(next_value())
+
+
+def validated_round_trip(geolocation: IpGeolocation) -> bytes:
+    # previous GET path: as_dict() + model validation + response_model handling
+    geolocation_model = IpGeolocationModel(**geolocation.as_dict())
+    content = response_adapter.dump_python(
+        response_adapter.validate_python(geolocation_model), mode="json"
+    )
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def build_loaded_geolocation(languages: int = 3) -> IpGeolocation:
+    payload = fake_geolocation("162.158.103.87")
+    location = payload.pop("location")
+    del location["languages"]
+    return IpGeolocation(
+        **payload,
+        location=Location(
+            **location,
+            languages=[
+                Language(code=f"l{index}", name=f"Language {index}", native="Native")
+                for index in range(languages)
+            ],
+        ),
+    )
+
+
+def build_offline_database(directory: str, ranges: int = 50000) -> OfflineGeoDatabase:
+    attributes = fake_geolocation("162.158.103.87")
+    csv_path = os.path.join(directory, "ranges.csv")
+    with open(csv_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(("network",) + ATTRIBUTE_FIELDS)
+        for index in range(ranges):
+            row = [attributes.get(name) for name in ATTRIBUTE_FIELDS]
+            writer.writerow([f"{index >> 8}.{index & 255}.0.0/16"] + row)
+            writer.writerow([f"2001:{index:x}::/32"] + row)
+    database_path = os.path.join(directory, "geo.db")
+    build_offline_geo_database(csv_path, database_path)
+    return OfflineGeoDatabase(database_path)
+
+
+def build_cases(directory: str) -> Dict[str, Callable[[], object]]:
+    lookup_values = build_lookup_values(distinct=2000, total=100000)
+    for value in set(lookup_values):
+        assert previous_normalize_ip_or_url(value) == normalize_ip_or_url(value)
+    ip_stack_payload = fake_geolocation("162.158.103.87")
+    ip_stack_response = json.dumps(ip_stack_payload).encode()
+    geolocation = build_loaded_geolocation()
+    payload = serialize_geolocation(geolocation)
+    assert json.loads(validated_round_trip(geolocation)) == payload
+    offline_database = build_offline_database(directory)
+
+    return {
+        # uncached cases clear all caches first, measuring first lookups
+        "clear_normalization_caches": clear_normalization_caches,
+        "normalize_url": uncached(normalize_url, "https://api.github.com/repos?page=2"),
+        "normalize_url_cached": lambda: normalize_url(
+            "https://api.github.com/repos?page=2"
+        ),
+        "normalize_ip_or_url_ipv4": uncached(normalize_ip_or_url, "162.158.103.87"),
+        "normalize_ip_or_url_ipv6": uncached(
+            normalize_ip_or_url, "2001:db8:85a3::8a2e:370:7334"
+        ),
+        "normalize_ip_or_url_hostname": uncached(
+            normalize_ip_or_url, "en.wikipedia.org"
+        ),
+        "normalize_ip_or_url_mix": cycled(normalize_ip_or_url, lookup_values),
+        "previous_normalize_ip_or_url_mix": cycled(
+            previous_normalize_ip_or_url, lookup_values
+        ),
+        "ip_geolocation_model_validate": lambda: IpGeolocationModel(**ip_stack_payload),
+        "ip_geolocation_model_validate_json": lambda: (
+            IpGeolocationModel.model_validate_json(ip_stack_response)
+        ),
+        "as_dict_loaded_graph": geolocation.as_dict,
+        "serialize_geolocation": lambda: serialize_geolocation(geolocation),
+        "serialize_and_encode": lambda: to_json(serialize_geolocation(geolocation)),
+        "validated_round_trip": lambda: validated_round_trip(geolocation),
+        "encode_response": lambda: to_json(payload),
+        "json_response": lambda: json_response(payload),
+        "encode_compact_geolocation": lambda: encode_compact_geolocation(payload),
+        "offline_find_record_ipv4": lambda: offline_database.find_record("100.1.2.3"),
+        "offline_find_record_ipv6": lambda: offline_database.find_record(
+            "2001:1f4::8a2e:370:7334"
+        ),
+        "offline_find_geolocation": lambda: offline_database.find_geolocation(
+            "100.1.2.3"
+        ),
+    }
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict:
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    timings = [timing / loops for timing in timer.repeat(repeat=repeat, number=loops)]
+    return {
+        "loops": loops,
+        "min_us": round(min(timings) * 1_000_000, 4),
+        "median_us": round(statistics.median(timings) * 1_000_000, 4),
+    }
+
+
+def load_results(reference: str) -> dict:
+    # reference is a results file or a commit with stored results
+    path = reference
+    if not os.path.exists(path):
+        path = os.path.join(RESULTS_DIRECTORY, f"{reference}.json")
+    with open(path) as file:
+        return json.load(file)
+
+
+def print_results(results: dict, previous: Optional[dict] = None) -> None:
+    header = f"{'benchmark':38} {'min us':>10} {'median us':>10}"
+    if previous:
+        header += f" {'previous':>10} {'change':>8}"
+    print(header)
+    for name, result in results["results"].items():
+        line = f"{name:38} {result['min_us']:10.3f} {result['median_us']:10.3f}"
+        previous_result = previous and previous["results"].get(name)
+        if previous_result:
+            change = result["min_us"] / previous_result["min_us"] - 1
+            line += f" {previous_result['min_us']:10.3f} {change:+8.1%}"
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--filter", help="run only benchmarks containing this text")
+    parser.add_argument(
+        "--output",
+        help=f"results file (default: {RESULTS_DIRECTORY}/<commit>.json)",
+    )
+    parser.add_argument(
+        "--compare", help="results file or commit to compare results with"
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {
+            **run_metadata("microbenchmarks"),
+            "results": {
+                name: measure(func, args.repeat)
+                for name, func in build_cases(directory).items()
+                if not args.filter or args.filter in name
+            },
+        }
+
+    output = args.output or os.path.join(
+        RESULTS_DIRECTORY, f"{results['commit'] or 'local'}.json"
+    )
+    write_results(output, results)
+
+    print_results(results, load_results(args.compare) if args.compare else None)
+    print(f"Results written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
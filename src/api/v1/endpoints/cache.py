@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with LRU eviction (bounded by max_size)
+    and per-entry expiration after ttl seconds. max_size=0 disables caching.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Stores value for ttl seconds, or cache's default ttl if not given.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def geolocation_cache_keys(ip: Optional[str], url: Optional[str]) -> List[tuple]:
+    """
+    Returns cache keys under which a geolocation with given ip and/or url
+    can be stored. Keys match (normalized_value, value_type) pairs
+    produced by normalize_ip_or_url.
+    """
+    keys = []
+    if ip:
+        keys.append((ip, "ip"))
+    if url:
+        keys.append((url, "url"))
+    return keys
+
+
+geolocation_cache = TTLCache(
+    max_size=int(os.getenv("GEOLOCATION_CACHE_MAX_SIZE", "10000")),
+    ttl=float(os.getenv("GEOLOCATION_CACHE_TTL", "300")),
+)
+
+
+# reasons why no geolocation was found for a value
+NOT_FOUND = "not_found"
+UPSTREAM_ERROR = "upstream_error"
+
+# remembers values without geolocation (keyed by normalized value), so that
+# repeated lookups skip database and external source; upstream errors are
+# remembered for a shorter time than values external source has no data for
+negative_geolocation_cache = TTLCache(
+    max_size=int(os.getenv("GEOLOCATION_NEGATIVE_CACHE_MAX_SIZE", "10000")),
+    ttl=float(os.getenv("GEOLOCATION_NOT_FOUND_TTL", "60")),
+)
+UPSTREAM_ERROR_TTL = float(os.getenv("GEOLOCATION_UPSTREAM_ERROR_TTL", "10"))
+
+
+def remember_missing_geolocation(normalized_value: str, reason: str) -> None:
+    ttl = UPSTREAM_ERROR_TTL if reason == UPSTREAM_ERROR else None
+    negative_geolocation_cache.set(normalized_value, reason, ttl=ttl)
+
+
+def invalidate_cached_geolocation(
+    ip: Optional[str], url: Optional[str], network: Optional[str] = None
+) -> None:
+    if network:
+        # any cached IP lookup may resolve to the network now
+        geolocation_cache.clear()
+        negative_geolocation_cache.clear()
+        return
+    for key in geolocation_cache_keys(ip, url):
+        geolocation_cache.delete(key)
+        negative_geolocation_cache.delete(key[0])
@@ -0,0 +1,118 @@
+import time
+from typing import Awaitable, Callable, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenException(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency. After failure_threshold consecutive
+    failures the circuit opens and calls fail immediately with
+    CircuitOpenException for open_duration seconds. Then up to
+    half_open_probes calls are let through: the circuit closes when all
+    of them succeed and opens again on the first failure.
+    Exceptions listed in ignored_exceptions are not counted as failures.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        open_duration: float,
+        half_open_probes: int = 1,
+        ignored_exceptions: Tuple[Type[BaseException], ...] = (),
+    ):
+        self.failure_threshold = failure_threshold
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self.ignored_exceptions = ignored_exceptions
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.rejected = 0
+        self.transitions = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        is_probe = self._before_call()
+        finished = False
+        try:
+            result = await func()
+            finished = True
+        except self.ignored_exceptions:
+            finished = True
+            self._record_success(is_probe)
+            raise
+        except Exception:
+            finished = True
+            self._record_failure(is_probe)
+            raise
+        finally:
+            # cancelled probe frees its slot for another one
+            if is_probe and not finished and self.state == HALF_OPEN:
+                self._probes_started -= 1
+
+        self._record_success(is_probe)
+        return result
+
+    def _before_call(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_duration:
+                self.rejected += 1
+                raise CircuitOpenException("Circuit is open")
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes_started >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenException("Circuit is half-open")
+            self._probes_started += 1
+            return True
+        return False
+
+    def _record_success(self, is_probe: bool) -> None:
+        if is_probe and self.state == HALF_OPEN:
+            self._probes_succeeded += 1
+            if self._probes_succeeded >= self.half_open_probes:
+                self._transition(CLOSED)
+        elif self.state == CLOSED:
+            self.consecutive_failures = 0
+
+    def _record_failure(self, is_probe: bool) -> None:
+        if is_probe and self.state == HALF_OPEN:
+            self._transition(OPEN)
+        elif self.state == CLOSED:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        self.transitions[state] += 1
+        self.consecutive_failures = 0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+
+    def reset(self) -> None:
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions),
+        }
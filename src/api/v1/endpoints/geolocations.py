@@ -1,138 +1,674 @@
-import ipaddress
-from typing import Tuple
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database import SessionLocal
-from src.models import IpGeolocation, Language, Location
-from src.validators import IpGeolocationModel, normalize_url
+from src.database import AsyncSessionLocal
+from src.metrics import geolocation_lookups, geolocation_stage_duration
+from src.models import IpGeolocation
+from src.server_timing import StageTimer, set_response_source
+from src.validators import (
+    BulkIngestReject,
+    BulkIngestResult,
+    GeolocationLookupRequest,
+    GeolocationLookupResult,
+    IpGeolocationModel,
+    normalize_ip_or_url,
+)
 
-from .ipstack_api import fetch_geolocation_from_external_source
-from .services import check_geolocation_exists_in_db, get_geolocation_from_db
+from .cache import (
+    NOT_FOUND,
+    UPSTREAM_ERROR,
+    geolocation_cache,
+    invalidate_cached_geolocation,
+    negative_geolocation_cache,
+    remember_missing_geolocation,
+)
+from .ipstack_api import (
+    IpStackCircuitOpenException,
+    IpStackUnavailableException,
+    fetch_geolocation_from_external_source,
+)
+from .offline_geo_db import offline_geo_database
+from .serializers import json_response, serialize_geolocation
+from .services import (
+    DUPLICATE_ENTRY_ERROR,
+    DuplicateGeolocationException,
+    bulk_save_geolocations_in_db,
+    get_geolocation_from_db,
+    get_geolocations_from_db,
+    get_network_geolocations_from_db,
+    refresh_geolocation_in_db,
+    save_geolocation_in_db,
+)
+from .shared_cache import (
+    get_shared_cached_geolocation,
+    invalidate_shared_cached_geolocation,
+    invalidate_shared_cached_geolocations,
+    set_shared_cached_geolocation,
+)
 
 router = APIRouter()
 
+# upper bound of GEOLOCATION_BULK_BATCH_SIZE, keeping each batch's duplicate
+# lookups within the bind parameter limit of a statement
+GEOLOCATION_BULK_MAX_BATCH_SIZE = 10000
+# longer NDJSON rows (e.g. a JSON array posted by mistake) are rejected
+GEOLOCATION_BULK_MAX_LINE_LENGTH = 65536
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def time_stage(endpoint: str, stage: str) -> StageTimer:
+    return StageTimer(geolocation_stage_duration, stage, endpoint=endpoint)
+
+
+# sources which answered lookups with given outcomes
+LOOKUP_OUTCOME_SOURCES = {
+    "cache_hit": "cache",
+    "shared_cache_hit": "shared_cache",
+    "negative_cache_hit": "negative_cache",
+    "db_hit": "db",
+    "offline_hit": "offline",
+    "offline_miss": "offline",
+    "ipstack_fallback": "ipstack",
+    "not_found": "ipstack",
+    "db_error_fallback": "ipstack",
+    "db_error": "db",
+    "circuit_open": "circuit_breaker",
+}
+# all outcomes are exported from start, also before they happen
+for outcome in LOOKUP_OUTCOME_SOURCES:
+    geolocation_lookups.inc(0, outcome=outcome)
+
+
+def record_lookup_outcome(outcome: str) -> None:
+    geolocation_lookups.inc(outcome=outcome)
+    set_response_source(LOOKUP_OUTCOME_SOURCES.get(outcome), outcome)
 
 
 def validate_and_normalize_ip_or_url(ip_or_url_value: str) -> Tuple[str, str]:
+    normalized = normalize_ip_or_url(ip_or_url_value)
+    if normalized is None:
+        raise HTTPException(
+            status_code=400, detail="Parameter must be Ipv4, Ipv6 or URL value"
+        )
+    return normalized
+
+
+async def read_geolocations_from_db(
+    keys: List[Tuple[str, str]], db: AsyncSession
+) -> Dict[Tuple[str, str], dict]:
+    geolocations = {}
+    for value_type in ("ip", "url"):
+        values = [value for value, key_type in keys if key_type == value_type]
+        if not values:
+            continue
+        for geolocation in await get_geolocations_from_db(values, value_type, db):
+            key = (getattr(geolocation, value_type), value_type)
+            geolocations[key] = serialize_geolocation(geolocation)
+
+    # IPs without their own entries may be contained in stored networks
+    missing_ips = [
+        value
+        for value, value_type in keys
+        if value_type == "ip" and (value, value_type) not in geolocations
+    ]
+    if missing_ips:
+        network_geolocations = await get_network_geolocations_from_db(missing_ips, db)
+        for ip, geolocation in network_geolocations.items():
+            geolocations[(ip, "ip")] = serialize_geolocation(geolocation)
+    return geolocations
+
+
+def is_offline_only() -> bool:
+    # OFFLINE_GEO_DB_MODE is "before" (IpStack API asked for values missing
+    # in offline database) or "instead" (IpStack API is never asked)
+    return (
+        offline_geo_database is not None
+        and os.getenv("OFFLINE_GEO_DB_MODE", "before").lower() == "instead"
+    )
+
+
+def find_offline_geolocation(
+    normalized_value: str, value_type: str, endpoint: str
+) -> Optional[IpGeolocationModel]:
+    if offline_geo_database is None or value_type != "ip":
+        return None
+    with time_stage(endpoint, "offline_lookup"):
+        return offline_geo_database.find_geolocation(normalized_value)
+
+
+def is_read_through_enabled() -> bool:
+    return os.getenv("GEOLOCATION_READ_THROUGH", "false").lower() == "true"
+
+
+async def persist_fetched_geolocation(geolocation: IpGeolocationModel) -> None:
+    """
+    Stores geolocation fetched from external source, unless an entry with
+    the same IP or URL was stored in the meantime. Geolocation of a searched
+    URL whose IP is already stored (e.g. looked up before, or shared with
+    another hostname) is stored for the URL alone. Runs after the response
+    is sent, in its own database session.
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            try:
+                await save_geolocation_in_db(
+                    geolocation, db, fetched_at=datetime.now(timezone.utc)
+                )
+            except DuplicateGeolocationException:
+                if not (geolocation.url and geolocation.ip):
+                    raise
+                await save_geolocation_in_db(
+                    geolocation.model_copy(update={"ip": None}),
+                    db,
+                    fetched_at=datetime.now(timezone.utc),
+                )
+        except DuplicateGeolocationException:
+            pass
+        except Exception as e:
+            print(f"Error storing geolocation fetched from ip stack: {e}")
+            await db.rollback()
+
+
+def schedule_read_through(
+    background_tasks: BackgroundTasks,
+    geolocation: IpGeolocationModel,
+    normalized_value: str,
+    value_type: str,
+) -> None:
+    if not is_read_through_enabled():
+        return
+    # store searched URL too, so that next lookups are served locally
+    if value_type == "url":
+        geolocation = geolocation.model_copy(update={"url": normalized_value})
+    background_tasks.add_task(persist_fetched_geolocation, geolocation)
+
+
+def is_geolocation_stale(geolocation: IpGeolocation) -> bool:
+    """
+    Geolocation fetched from external source is stale after GEOLOCATION_MAX_AGE
+    seconds (0 disables refreshing). Entries stored by users never become stale.
+    """
+    max_age = float(os.getenv("GEOLOCATION_MAX_AGE", str(30 * 24 * 60 * 60)))
+    if max_age <= 0 or geolocation.fetched_at is None:
+        return False
+    return datetime.now(timezone.utc) - geolocation.fetched_at > timedelta(
+        seconds=max_age
+    )
+
+
+# keys of geolocations being refreshed, with refresh start time
+pending_geolocation_refreshes: Dict[Tuple[str, str], float] = {}
+# after this many seconds refresh of the same key can be scheduled again,
+# even if previous one did not finish
+GEOLOCATION_REFRESH_TIMEOUT = 60
+
+
+async def refresh_stale_geolocation(
+    geolocation_id: int,
+    ip: Optional[str],
+    url: Optional[str],
+    normalized_value: str,
+    value_type: str,
+) -> None:
+    """
+    Fetches stale geolocation again from external source and stores it.
+    Runs after the response is sent, in its own database session.
+    """
     try:
-        normalized_value = ipaddress.ip_address(ip_or_url_value)
-        return str(normalized_value), "ip"
-    except ValueError:
-        normalized_value = normalize_url(ip_or_url_value)
-        if not normalized_value:
-            raise HTTPException(
-                status_code=400, detail="Parameter must be Ipv4, Ipv6 or URL value"
+        geolocation_model = await fetch_geolocation_from_external_source(
+            normalized_value
+        )
+        if geolocation_model is None:
+            return
+        async with AsyncSessionLocal() as db:
+            await refresh_geolocation_in_db(
+                geolocation_id,
+                geolocation_model,
+                db,
+                fetched_at=datetime.now(timezone.utc),
             )
-        return normalized_value, "url"
+        invalidate_cached_geolocation(ip, url)
+        await invalidate_shared_cached_geolocation(ip, url)
+    except Exception as e:
+        print(f"Error refreshing geolocation from ip stack: {e}")
+    finally:
+        pending_geolocation_refreshes.pop((normalized_value, value_type), None)
 
 
-@router.get("/{ip_or_url_value}", response_model=IpGeolocationModel)
-def get_geolocation(ip_or_url_value: str, db: Session = Depends(get_db)):
-    normalized_value, value_type = validate_and_normalize_ip_or_url(ip_or_url_value)
+def schedule_stale_refresh(
+    background_tasks: BackgroundTasks,
+    geolocation: IpGeolocation,
+    normalized_value: str,
+    value_type: str,
+) -> None:
+    if is_offline_only():
+        return
+    key = (normalized_value, value_type)
+    started_at = pending_geolocation_refreshes.get(key)
+    if started_at and time.monotonic() - started_at < GEOLOCATION_REFRESH_TIMEOUT:
+        # refresh of the same geolocation is already scheduled
+        return
+    pending_geolocation_refreshes[key] = time.monotonic()
+    background_tasks.add_task(
+        refresh_stale_geolocation,
+        geolocation.id,
+        geolocation.ip,
+        geolocation.url,
+        normalized_value,
+        value_type,
+    )
+
 
+async def fetch_missing_geolocation(
+    normalized_value: str, remember_missing: bool = True
+) -> Optional[IpGeolocationModel]:
+    """
+    Fetches geolocation missing in database from external source. Unless
+    remember_missing is False, values without geolocation are remembered
+    in negative cache, so that repeated lookups are answered immediately.
+    IpStackCircuitOpenException is passed on, as it costs no request.
+    """
     try:
-        geolocation = get_geolocation_from_db(
-            ip_or_url_value=normalized_value, value_type=value_type, db=db
+        geolocation_model = await fetch_geolocation_from_external_source(
+            normalized_value
         )
+    except IpStackCircuitOpenException:
+        raise
+    except IpStackUnavailableException:
+        if remember_missing:
+            remember_missing_geolocation(normalized_value, UPSTREAM_ERROR)
+        return None
+    if geolocation_model is None and remember_missing:
+        remember_missing_geolocation(normalized_value, NOT_FOUND)
+    return geolocation_model
+
+
+def circuit_open_error() -> HTTPException:
+    # IP_STACK_CIRCUIT_OPEN_STATUS_CODE is 404 (as if not found) or 503
+    status_code = int(os.getenv("IP_STACK_CIRCUIT_OPEN_STATUS_CODE", "404"))
+    if status_code == 503:
+        return HTTPException(
+            status_code=503, detail="Geolocation external source unavailable"
+        )
+    return HTTPException(status_code=404, detail="Geolocation not found")
+
+
+@router.get("/{ip_or_url_value}", response_model=IpGeolocationModel)
+async def get_geolocation(
+    ip_or_url_value: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+):
+    with time_stage("get", "validation"):
+        normalized_value, value_type = validate_and_normalize_ip_or_url(ip_or_url_value)
+
+    cached_geolocation = geolocation_cache.get((normalized_value, value_type))
+    if cached_geolocation:
+        record_lookup_outcome("cache_hit")
+        return json_response(cached_geolocation)
+    if negative_geolocation_cache.get(normalized_value):
+        record_lookup_outcome("negative_cache_hit")
+        raise HTTPException(status_code=404, detail="Geolocation not found")
+    # geolocation cached by another worker or host
+    shared_geolocation = await get_shared_cached_geolocation(
+        normalized_value, value_type
+    )
+    if shared_geolocation:
+        record_lookup_outcome("shared_cache_hit")
+        geolocation_cache.set((normalized_value, value_type), shared_geolocation)
+        return json_response(shared_geolocation)
+
+    try:
+        with time_stage("get", "db_query"):
+            geolocation = await get_geolocation_from_db(
+                ip_or_url_value=normalized_value, value_type=value_type, db=db
+            )
         if geolocation:
-            return IpGeolocationModel(**geolocation.as_dict())
+            record_lookup_outcome("db_hit")
+            with time_stage("get", "serialization"):
+                payload = serialize_geolocation(geolocation)
+            geolocation_cache.set((normalized_value, value_type), payload)
+            await set_shared_cached_geolocation(normalized_value, value_type, payload)
+            # stale geolocation is served, while a fresh one is fetched
+            if is_geolocation_stale(geolocation):
+                schedule_stale_refresh(
+                    background_tasks, geolocation, normalized_value, value_type
+                )
+            return json_response(payload)
+
+        offline_geolocation = find_offline_geolocation(
+            normalized_value, value_type, "get"
+        )
+        if offline_geolocation:
+            record_lookup_outcome("offline_hit")
+            return json_response(offline_geolocation)
+        if is_offline_only():
+            remember_missing_geolocation(normalized_value, NOT_FOUND)
+            record_lookup_outcome("offline_miss")
+            raise HTTPException(status_code=404, detail="Geolocation not found")
 
-        geolocation_model = fetch_geolocation_from_external_source(normalized_value)
+        try:
+            with time_stage("get", "ipstack"):
+                geolocation_model = await fetch_missing_geolocation(normalized_value)
+        except IpStackCircuitOpenException:
+            record_lookup_outcome("circuit_open")
+            raise circuit_open_error()
         if geolocation_model:
-            return geolocation_model
+            record_lookup_outcome("ipstack_fallback")
+            schedule_read_through(
+                background_tasks, geolocation_model, normalized_value, value_type
+            )
+            return json_response(geolocation_model)
 
+        record_lookup_outcome("not_found")
         raise HTTPException(status_code=404, detail="Geolocation not found")
 
     except RuntimeError:
-        geolocation_model = fetch_geolocation_from_external_source(normalized_value)
+        offline_geolocation = find_offline_geolocation(
+            normalized_value, value_type, "get"
+        )
+        if offline_geolocation:
+            record_lookup_outcome("offline_hit")
+            return json_response(offline_geolocation)
+
+        # database could not be checked, so missing geolocation is not remembered
+        geolocation_model = None
+        if not is_offline_only():
+            try:
+                with time_stage("get", "ipstack"):
+                    geolocation_model = await fetch_missing_geolocation(
+                        normalized_value, remember_missing=False
+                    )
+            except IpStackCircuitOpenException:
+                pass
         if geolocation_model:
-            return geolocation_model
+            record_lookup_outcome("db_error_fallback")
+            return json_response(geolocation_model)
+        record_lookup_outcome("db_error")
         raise HTTPException(status_code=500, detail="Database connection error")
 
 
 @router.post("", response_model=IpGeolocationModel, status_code=201)
-def create_geolocation(geolocation: IpGeolocationModel, db: Session = Depends(get_db)):
-    entry_exists = check_geolocation_exists_in_db(geolocation, db)
-    if entry_exists:
+async def create_geolocation(
+    geolocation: IpGeolocationModel, db: AsyncSession = Depends(get_db)
+):
+    try:
+        with time_stage("create", "db_query"):
+            new_ip_geolocation = await save_geolocation_in_db(geolocation, db)
+        set_response_source("db")
+
+        invalidate_cached_geolocation(
+            geolocation.ip, geolocation.url, geolocation.network
+        )
+        await invalidate_shared_cached_geolocation(
+            geolocation.ip, geolocation.url, geolocation.network
+        )
+
+        with time_stage("create", "serialization"):
+            return new_ip_geolocation.as_dict()
+
+    except DuplicateGeolocationException:
         raise HTTPException(
             status_code=400,
-            detail="An entry with the same IP or URL already exists.",
+            detail=DUPLICATE_ENTRY_ERROR,
         )
+    except Exception as e:
+        print(f"Error creating geolocation: {e}")
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Error creating geolocation")
+
+
+async def read_ndjson_lines(
+    request: Request,
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    Yields numbered lines of streamed body. Lines longer than
+    GEOLOCATION_BULK_MAX_LINE_LENGTH bytes are yielded as None, without
+    keeping their content.
+    """
+    buffer = bytearray()
+    oversized = False
+    line_number = 0
+    async for chunk in request.stream():
+        # only the new chunk is searched for line ends
+        start = 0
+        end = chunk.find(b"\n")
+        while end != -1:
+            line_number += 1
+            if (
+                oversized
+                or len(buffer) + end - start > GEOLOCATION_BULK_MAX_LINE_LENGTH
+            ):
+                yield line_number, None
+            else:
+                buffer += chunk[start:end]
+                yield line_number, bytes(buffer)
+            buffer.clear()
+            oversized = False
+            start = end + 1
+            end = chunk.find(b"\n", start)
+
+        if len(buffer) + len(chunk) - start > GEOLOCATION_BULK_MAX_LINE_LENGTH:
+            buffer.clear()
+            oversized = True
+        elif not oversized:
+            buffer += chunk[start:]
+    if oversized or buffer:
+        yield line_number + 1, None if oversized else bytes(buffer)
+
+
+def format_validation_error(e: ValidationError) -> str:
+    messages = []
+    for error in e.errors():
+        location = ".".join(str(loc) for loc in error["loc"])
+        messages.append(f"{location}: {error['msg']}" if location else error["msg"])
+    return "; ".join(messages)
+
+
+def parse_bulk_row(line: bytes) -> IpGeolocationModel:
     try:
-        # create or find Location and its related Languages
-        location_data = geolocation.location
-        if location_data:
-            languages = []
-            for lang_data in location_data.languages:
-                language = db.query(Language).filter_by(code=lang_data.code).first()
-                if not language:
-                    language = Language(**lang_data.model_dump())
-                    db.add(language)
-                languages.append(language)
-
-            location = (
-                db.query(Location)
-                .filter_by(geoname_id=location_data.geoname_id)
-                .first()
-            )
-            if not location:
-                location = Location(
-                    **{
-                        key: value
-                        for key, value in location_data.model_dump().items()
-                        if key != "languages"
-                    }
-                )
-                location.languages = languages
-                db.add(location)
-        else:
-            location = None
-
-        # create IpGeolocation record
-        new_ip_geolocation = IpGeolocation(
-            **{
-                key: value
-                for key, value in geolocation.model_dump().items()
-                if key != "location"
-            }
+        data = json.loads(line)
+    except ValueError:
+        raise ValueError("Row is not a valid JSON")
+    if not isinstance(data, dict):
+        raise ValueError("Row must be a JSON object")
+    try:
+        return IpGeolocationModel(**data)
+    except ValidationError as e:
+        raise ValueError(format_validation_error(e))
+
+
+async def store_bulk_batch(
+    batch: List[Tuple[int, IpGeolocationModel]], db: AsyncSession
+) -> List[BulkIngestReject]:
+    try:
+        rejected = await bulk_save_geolocations_in_db(
+            [geolocation for _, geolocation in batch], db
         )
-        new_ip_geolocation.location = location
+    except Exception as e:
+        print(f"Error storing geolocations batch: {e}")
+        await db.rollback()
+        rejected = {index: "Error storing geolocation" for index in range(len(batch))}
 
-        db.add(new_ip_geolocation)
-        db.commit()
-        db.refresh(new_ip_geolocation)
+    stored_geolocations = [
+        (geolocation.ip, geolocation.url, geolocation.network)
+        for index, (_, geolocation) in enumerate(batch)
+        if index not in rejected
+    ]
+    for ip, url, network in stored_geolocations:
+        invalidate_cached_geolocation(ip, url, network)
+    await invalidate_shared_cached_geolocations(stored_geolocations)
 
-        return new_ip_geolocation.as_dict()
+    return [
+        BulkIngestReject(line=batch[index][0], error=error)
+        for index, error in sorted(rejected.items())
+    ]
 
-    except Exception as e:
-        print(f"Error creating geolocation: {e}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Error creating geolocation")
+
+@router.post("/bulk", response_model=BulkIngestResult)
+async def bulk_create_geolocations(
+    request: Request, db: AsyncSession = Depends(get_db)
+):
+    """
+    Ingests geolocations streamed as NDJSON (one JSON object per line).
+    Rows are validated as they arrive and stored in batches of
+    GEOLOCATION_BULK_BATCH_SIZE rows, so the upload is never held in memory.
+    """
+    batch_size = min(
+        max(int(os.getenv("GEOLOCATION_BULK_BATCH_SIZE", "500")), 1),
+        GEOLOCATION_BULK_MAX_BATCH_SIZE,
+    )
+    result = BulkIngestResult(inserted=0, rejected=[])
+    batch: List[Tuple[int, IpGeolocationModel]] = []
+
+    async def flush_batch():
+        rejected = await store_bulk_batch(batch, db)
+        result.inserted += len(batch) - len(rejected)
+        result.rejected.extend(rejected)
+        batch.clear()
+
+    async for line_number, line in read_ndjson_lines(request):
+        if line is None:
+            error = f"Row is longer than {GEOLOCATION_BULK_MAX_LINE_LENGTH} bytes"
+            result.rejected.append(BulkIngestReject(line=line_number, error=error))
+            continue
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_number, parse_bulk_row(line)))
+        except ValueError as e:
+            result.rejected.append(BulkIngestReject(line=line_number, error=str(e)))
+        if len(batch) >= batch_size:
+            await flush_batch()
+    if batch:
+        await flush_batch()
+
+    result.rejected.sort(key=lambda reject: reject.line)
+    return result
+
+
+@router.post("/lookup", response_model=List[GeolocationLookupResult])
+async def lookup_geolocations(
+    lookup: GeolocationLookupRequest,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+):
+    keys: List[Optional[Tuple[str, str]]] = []
+    errors: Dict[int, str] = {}
+    for index, value in enumerate(lookup.values):
+        try:
+            keys.append(validate_and_normalize_ip_or_url(value))
+        except HTTPException as e:
+            keys.append(None)
+            errors[index] = e.detail
+
+    # geolocations read from cache or database are serialized payloads
+    geolocations: Dict[Tuple[str, str], dict | IpGeolocationModel] = {}
+    pending_keys = []
+    known_missing_keys = set()
+    for key in dict.fromkeys(key for key in keys if key):
+        cached_geolocation = geolocation_cache.get(key)
+        if cached_geolocation:
+            geolocations[key] = cached_geolocation
+        elif negative_geolocation_cache.get(key[0]):
+            known_missing_keys.add(key)
+        else:
+            pending_keys.append(key)
+
+    database_error = False
+    if pending_keys:
+        try:
+            found_geolocations = await read_geolocations_from_db(pending_keys, db)
+            for key, geolocation in found_geolocations.items():
+                geolocation_cache.set(key, geolocation)
+            geolocations.update(found_geolocations)
+        except RuntimeError:
+            database_error = True
+
+    missing_keys = []
+    for key in pending_keys:
+        if key in geolocations:
+            continue
+        offline_geolocation = find_offline_geolocation(*key, "lookup")
+        if offline_geolocation:
+            geolocations[key] = offline_geolocation
+        else:
+            missing_keys.append(key)
+    if is_offline_only():
+        if not database_error:
+            for normalized_value, _ in missing_keys:
+                remember_missing_geolocation(normalized_value, NOT_FOUND)
+        missing_keys = []
+    semaphore = asyncio.Semaphore(int(os.getenv("IP_STACK_LOOKUP_CONCURRENCY", "20")))
+
+    async def fetch(normalized_value: str) -> Optional[IpGeolocationModel]:
+        async with semaphore:
+            try:
+                return await fetch_missing_geolocation(
+                    normalized_value, remember_missing=not database_error
+                )
+            except IpStackCircuitOpenException:
+                return None
+
+    fetched_geolocations = await asyncio.gather(
+        *[fetch(normalized_value) for normalized_value, _ in missing_keys]
+    )
+    for key, geolocation_model in zip(missing_keys, fetched_geolocations):
+        if geolocation_model:
+            geolocations[key] = geolocation_model
+            if not database_error:
+                schedule_read_through(background_tasks, geolocation_model, *key)
+
+    results = []
+    for index, (value, key) in enumerate(zip(lookup.values, keys)):
+        if key is None:
+            error = errors[index]
+        elif key in geolocations:
+            error = None
+        elif database_error and key not in known_missing_keys:
+            error = "Database connection error"
+        else:
+            error = "Geolocation not found"
+        results.append(
+            {"value": value, "geolocation": geolocations.get(key), "error": error}
+        )
+    return json_response(results)
 
 
 @router.delete("/{ip_or_url_value}", status_code=204)
-def delete_geolocation(ip_or_url_value: str, db: Session = Depends(get_db)):
+async def delete_geolocation(ip_or_url_value: str, db: AsyncSession = Depends(get_db)):
     normalized_value, value_type = validate_and_normalize_ip_or_url(ip_or_url_value)
 
     try:
-        geolocation = get_geolocation_from_db(
-            ip_or_url_value=normalized_value, value_type=value_type, db=db
+        geolocation = await get_geolocation_from_db(
+            ip_or_url_value=normalized_value,
+            value_type=value_type,
+            db=db,
+            match_networks=False,
         )
         if not geolocation:
             raise HTTPException(status_code=404, detail="Geolocation not found")
     except RuntimeError:
         raise HTTPException(status_code=500, detail="Database connection error")
 
-    db.delete(geolocation)
-    db.commit()
+    await db.delete(geolocation)
+    await db.commit()
+
+    invalidate_cached_geolocation(geolocation.ip, geolocation.url, geolocation.network)
+    await invalidate_shared_cached_geolocation(
+        geolocation.ip, geolocation.url, geolocation.network
+    )
 
     return {"detail": "Geolocation deleted successfully"}
@@ -1,43 +1,228 @@
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 
-import requests
+import httpx
+from pydantic import ValidationError
 
-from src.validators import IpGeolocationModel
+from src.validators import IpGeolocationModel, normalize_ip_or_url
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenException
+from .micro_batcher import MicroBatcher
+from .single_flight import SingleFlight
 
 
 class NoIpStackAccessKeyException(Exception):
     pass
 
 
-IP_STACK_API_URL = "http://api.ipstack.com/{search_value}"
+class IpStackUnavailableException(Exception):
+    pass
 
 
-def fetch_geolocation_from_external_source(
-    normalized_value: str,
-) -> Optional[IpGeolocationModel]:
+class IpStackCircuitOpenException(IpStackUnavailableException):
+    pass
+
+
+class IpStackErrorException(IpStackUnavailableException):
+    pass
+
+
+# ipstack answers errors with HTTP 200 and error details; only these codes
+# (invalid IP address) mean there is no geolocation for the value, others
+# (e.g. 101 invalid access key, 104 monthly quota reached) that the API
+# cannot be used
+IP_STACK_NOT_FOUND_ERROR_CODES = (106,)
+
+
+# base URL can point e.g. to a local fake server used by load tests
+IP_STACK_API_URL = (
+    os.getenv("IP_STACK_API_BASE_URL", "http://api.ipstack.com").rstrip("/")
+    + "/{search_value}"
+)
+
+
+def create_ip_stack_http_client(
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> httpx.AsyncClient:
+    timeout = float(os.getenv("IP_STACK_TIMEOUT", "5"))
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            timeout,
+            connect=float(os.getenv("IP_STACK_CONNECT_TIMEOUT", str(timeout))),
+        ),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("IP_STACK_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(
+                os.getenv("IP_STACK_MAX_KEEPALIVE_CONNECTIONS", "20")
+            ),
+            keepalive_expiry=float(os.getenv("IP_STACK_KEEPALIVE_EXPIRY", "30")),
+        ),
+        transport=transport,
+    )
+
+
+class IpStackClient:
     """
-    Fetches geolocation data from an external API (ipstack.com)
-    and converts it into IpGeolocation.
+    Owns a long-lived, connection-pooled HTTP client shared by all requests
+    to ipstack API. It is started and closed together with the application.
     """
+
+    def __init__(self):
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        # fallback for usage outside of application lifespan (e.g. scripts)
+        if self._http_client is None:
+            self._http_client = create_ip_stack_http_client()
+        return self._http_client
+
+    async def start(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        if self._http_client is None:
+            self._http_client = create_ip_stack_http_client(transport)
+
+    async def close(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+
+ip_stack_client = IpStackClient()
+
+
+ip_stack_single_flight = SingleFlight()
+
+# responses without geolocation data (invalid IP) mean the API itself is
+# working, while ipstack error responses (e.g. quota reached) are failures
+ip_stack_circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("IP_STACK_CIRCUIT_FAILURE_THRESHOLD", "5")),
+    open_duration=float(os.getenv("IP_STACK_CIRCUIT_OPEN_DURATION", "30")),
+    half_open_probes=int(os.getenv("IP_STACK_CIRCUIT_HALF_OPEN_PROBES", "1")),
+    ignored_exceptions=(ValidationError,),
+)
+
+
+async def get_from_ip_stack(search_value: str):
     ip_stack_access_key = os.getenv("IP_STACK_API_ACCESS_KEY")
+    if not ip_stack_access_key:
+        raise NoIpStackAccessKeyException(
+            "No env variable IP_STACK_API_ACCESS_KEY to connect with ipstack API"
+        )
+    response = await ip_stack_client.http_client.get(
+        IP_STACK_API_URL.format(search_value=search_value),
+        params={"access_key": ip_stack_access_key, "output": "json"},
+    )
+    response.raise_for_status()
+    data = response.json()
+    raise_for_ip_stack_error(data)
+    return data
 
-    try:
-        if not ip_stack_access_key:
-            raise NoIpStackAccessKeyException(
-                "No env variable IP_STACK_API_ACCESS_KEY to connect with ipstack API"
-            )
-        response = requests.get(
-            IP_STACK_API_URL.format(search_value=normalized_value),
-            timeout=5,
-            params={"access_key": ip_stack_access_key, "output": "json"},
+
+def raise_for_ip_stack_error(data) -> None:
+    if not isinstance(data, dict) or data.get("success") is not False:
+        return
+    error = data.get("error") or {}
+    if error.get("code") not in IP_STACK_NOT_FOUND_ERROR_CODES:
+        raise IpStackErrorException(
+            f"ipstack API error {error.get('code')}: "
+            f"{error.get('info') or error.get('type')}"
         )
-        response.raise_for_status()
 
-        data = response.json()
-        geolocation = IpGeolocationModel(**data)
-        return geolocation
 
+async def request_geolocation_from_ip_stack(
+    normalized_value: str,
+) -> IpGeolocationModel:
+    data = await get_from_ip_stack(normalized_value)
+    return IpGeolocationModel(**data)
+
+
+def validate_ip_stack_geolocation(data) -> Optional[IpGeolocationModel]:
+    raise_for_ip_stack_error(data)
+    try:
+        return IpGeolocationModel(**data)
+    except (TypeError, ValidationError) as e:
+        print(f"No geolocation data in ip stack response: {e}")
+        return None
+
+
+async def request_geolocations_from_ip_stack(
+    normalized_values: List[str],
+) -> Dict[str, Optional[IpGeolocationModel]]:
+    """
+    Asks ipstack API about many IPs with one bulk (comma-separated) request.
+    Returns geolocation of each value answered by the API, or None if the API
+    has none for it.
+    """
+    data = await get_from_ip_stack(",".join(normalized_values))
+    if len(normalized_values) == 1:
+        # single value is answered with an object instead of a list
+        data = [data]
+    if not isinstance(data, list):
+        raise IpStackUnavailableException(f"Unexpected bulk response: {data}")
+    # results are matched by their IP, not by position in the response
+    results = {}
+    for item in data:
+        geolocation = validate_ip_stack_geolocation(item)
+        ip = item.get("ip") if isinstance(item, dict) else None
+        normalized = normalize_ip_or_url(ip) if isinstance(ip, str) else None
+        if normalized and normalized[0] in normalized_values:
+            results[normalized[0]] = geolocation
+    return results
+
+
+# maximum number of IPs of a bulk request accepted by ipstack API
+IP_STACK_MAX_BATCH_SIZE = 50
+
+
+def ip_stack_batch_size() -> int:
+    batch_size = int(os.getenv("IP_STACK_BATCH_SIZE", "1"))
+    return min(max(batch_size, 1), IP_STACK_MAX_BATCH_SIZE)
+
+
+# concurrent lookups of IPs are sent together in bulk requests (on ipstack
+# plans supporting it), batch size 1 disables batching
+ip_stack_batcher = MicroBatcher(
+    lambda normalized_values: ip_stack_circuit_breaker.call(
+        lambda: request_geolocations_from_ip_stack(normalized_values)
+    ),
+    max_batch_size=ip_stack_batch_size(),
+    flush_interval=float(os.getenv("IP_STACK_BATCH_FLUSH_INTERVAL_MS", "5")) / 1000,
+)
+
+
+async def request_geolocation(normalized_value: str) -> Optional[IpGeolocationModel]:
+    normalized = normalize_ip_or_url(normalized_value)
+    if ip_stack_batcher.max_batch_size > 1 and normalized and normalized[1] == "ip":
+        return await ip_stack_batcher.submit(normalized_value)
+    return await ip_stack_circuit_breaker.call(
+        lambda: request_geolocation_from_ip_stack(normalized_value)
+    )
+
+
+async def fetch_geolocation_from_external_source(
+    normalized_value: str,
+) -> Optional[IpGeolocationModel]:
+    """
+    Fetches geolocation data from an external API (ipstack.com) and converts
+    it into IpGeolocation. Concurrent calls for the same value share a single
+    request to the API, and concurrent lookups of different IPs are sent in
+    bulk requests when IP_STACK_BATCH_SIZE is set. Returns None if the API has
+    no geolocation for the value and raises IpStackUnavailableException if
+    the API could not be asked (missing access key, timeout, HTTP error) or
+    answered with an error other than invalid IP (e.g. quota reached).
+    While the API keeps failing, requests are not sent at all and
+    IpStackCircuitOpenException is raised immediately.
+    """
+    try:
+        return await ip_stack_single_flight.run(
+            normalized_value, lambda: request_geolocation(normalized_value)
+        )
+
+    except CircuitOpenException as e:
+        raise IpStackCircuitOpenException(str(e)) from e
+    except ValidationError as e:
+        print(f"No geolocation data in ip stack response: {e}")
+        return None
     except Exception as e:
         print(f"Error fetching geolocation data from ip stack: {e}")
-        return None
+        raise IpStackUnavailableException(str(e)) from e
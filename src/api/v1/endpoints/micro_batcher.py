@@ -0,0 +1,93 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class MicroBatcher(Generic[K, T]):
+    """
+    Collects keys submitted concurrently for up to flush_interval seconds, or
+    until max_batch_size distinct keys are pending, and resolves all of them
+    with one call of func. func returns a result for every key of the batch;
+    its exception is raised to every caller waiting for the batch.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[List[K]], Awaitable[Dict[K, T]]],
+        max_batch_size: int,
+        flush_interval: float,
+    ):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.batches = 0
+        self.keys = 0
+        self._pending: Dict[K, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._running = set()
+
+    async def submit(self, key: K) -> T:
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(self._mark_retrieved)
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch_size:
+                self.flush()
+            elif self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(
+                    self.flush_interval, self.flush
+                )
+
+        # shield keeps the batch result for other callers when one is cancelled
+        return await asyncio.shield(future)
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._run(batch))
+        # running batches are referenced, so they are not garbage collected
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: Dict[K, asyncio.Future]) -> None:
+        self.batches += 1
+        self.keys += len(batch)
+        try:
+            results = await self.func(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in batch.items():
+            if future.done():
+                continue
+            if key in results:
+                future.set_result(results[key])
+            else:
+                future.set_exception(KeyError(f"No result for {key} in batch"))
+
+    @staticmethod
+    def _mark_retrieved(future: asyncio.Future) -> None:
+        # mark exception as retrieved when all callers were cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "keys": self.keys,
+        }
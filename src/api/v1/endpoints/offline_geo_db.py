@@ -0,0 +1,271 @@
+"""
+Offline geolocation database: IP ranges with geolocation attributes imported
+from CSV into a compact binary file, which is memory-mapped read-only, so all
+application workers share the same pages. Lookups binary search fixed-width
+range starts, without network requests or quota.
+
+File layout (integers are little-endian uint32, IPv6 addresses big-endian):
+    header: magic, IPv4 range count, IPv6 range count, record count
+    IPv4 ranges: starts (uint32 each), ends (uint32), record indexes (uint32)
+    IPv6 ranges: starts (16 bytes each), ends (16 bytes), record indexes
+    record offsets (record count + 1), records (compact JSON objects)
+
+Import a CSV with network (CIDR) or start_ip and end_ip columns:
+    python -m src.api.v1.endpoints.offline_geo_db ranges.csv geo.db
+"""
+
+import argparse
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+from pydantic_core import from_json, to_json
+
+from src.validators import IpGeolocationModel
+
+MAGIC = b"GEODB\x00\x00\x01"
+HEADER = struct.Struct("<8sIII4x")
+UINT32 = struct.Struct("<I")
+
+# geolocation attributes stored for each range
+ATTRIBUTE_FIELDS = (
+    "continent_code",
+    "continent_name",
+    "country_code",
+    "country_name",
+    "region_code",
+    "region_name",
+    "city",
+    "zip",
+    "latitude",
+    "longitude",
+    "msa",
+    "dma",
+    "radius",
+    "ip_routing_type",
+    "connection_type",
+)
+FLOAT_FIELDS = ("latitude", "longitude")
+
+
+class OfflineGeoDatabaseException(Exception):
+    pass
+
+
+class BigEndianIntegers:
+    """
+    Read-only sequence of big-endian unsigned integers of given width stored
+    in buffer (IPv6 addresses), usable with bisect.
+    """
+
+    __slots__ = ("buffer", "width", "length")
+
+    def __init__(self, buffer: memoryview, width: int):
+        self.buffer = buffer
+        self.width = width
+        self.length = len(buffer) // width
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> int:
+        start = index * self.width
+        end = start + self.width
+        return int.from_bytes(self.buffer[start:end], "big")
+
+
+def uint32_array(buffer: memoryview) -> Sequence[int]:
+    # native array view keeps binary search in C, on little-endian machines
+    if sys.byteorder == "little":
+        return buffer.cast("I")
+    return [value for (value,) in UINT32.iter_unpack(buffer)]
+
+
+class IpRanges:
+    def __init__(self, buffer: memoryview, offset: int, width: int, length: int):
+        ends_offset = offset + width * length
+        indexes_offset = ends_offset + width * length
+        end_offset = indexes_offset + 4 * length
+        starts = buffer[offset:ends_offset]
+        ends = buffer[ends_offset:indexes_offset]
+        indexes = buffer[indexes_offset:end_offset]
+        self.end_offset = end_offset
+        if width == 4:
+            self.starts, self.ends = uint32_array(starts), uint32_array(ends)
+        else:
+            self.starts = BigEndianIntegers(starts, width)
+            self.ends = BigEndianIntegers(ends, width)
+        self.record_indexes = uint32_array(indexes)
+
+    def find(self, address: int) -> Optional[int]:
+        index = bisect_right(self.starts, address) - 1
+        if index < 0 or self.ends[index] < address:
+            return None
+        return self.record_indexes[index]
+
+
+class OfflineGeoDatabase:
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._mmap[: HEADER.size]
+        if len(header) < HEADER.size or not header.startswith(MAGIC):
+            self._mmap.close()
+            raise OfflineGeoDatabaseException(f"{path} is not an offline geo database")
+        _, ipv4_count, ipv6_count, record_count = HEADER.unpack(header)
+
+        self.path = path
+        self._buffer = memoryview(self._mmap)
+        self._ipv4 = IpRanges(self._buffer, HEADER.size, 4, ipv4_count)
+        self._ipv6 = IpRanges(self._buffer, self._ipv4.end_offset, 16, ipv6_count)
+        offsets_start = self._ipv6.end_offset
+        offsets_end = offsets_start + 4 * (record_count + 1)
+        self._record_offsets = uint32_array(self._buffer[offsets_start:offsets_end])
+        self.ranges = ipv4_count + ipv6_count
+        self.records = record_count
+
+    def find_record(self, ip: str) -> Optional[dict]:
+        """
+        Returns geolocation attributes of the range containing ip, if any.
+        """
+        address = ipaddress.ip_address(ip)
+        ranges = self._ipv4 if address.version == 4 else self._ipv6
+        record_index = ranges.find(int(address))
+        if record_index is None:
+            return None
+        start = self._record_offsets[record_index]
+        end = self._record_offsets[record_index + 1]
+        return from_json(self._mmap[start:end])
+
+    def find_geolocation(self, ip: str) -> Optional[IpGeolocationModel]:
+        record = self.find_record(ip)
+        if record is None:
+            return None
+        ip_type = "ipv6" if ":" in ip else "ipv4"
+        return IpGeolocationModel(ip=ip, type=ip_type, **record)
+
+    def close(self) -> None:
+        # views of the memory map must be released before it is closed
+        self._ipv4 = self._ipv6 = self._record_offsets = None
+        self._buffer.release()
+        self._mmap.close()
+
+
+def format_address(version: int, address: int) -> str:
+    address_class = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    return str(address_class(address))
+
+
+def parse_range(row: Dict[str, str]) -> Tuple[int, int, int]:
+    if row.get("network"):
+        network = ipaddress.ip_network(row["network"], strict=False)
+        first, last = network.network_address, network.broadcast_address
+    else:
+        first = ipaddress.ip_address(row["start_ip"])
+        last = ipaddress.ip_address(row["end_ip"])
+    if first.version != last.version or int(first) > int(last):
+        raise ValueError("Range must start before its end, within one IP version")
+    return first.version, int(first), int(last)
+
+
+def parse_record(row: Dict[str, str]) -> dict:
+    record = {}
+    for name in ATTRIBUTE_FIELDS:
+        value = (row.get(name) or "").strip()
+        if value:
+            record[name] = float(value) if name in FLOAT_FIELDS else value
+    return record
+
+
+def validate_record(record: dict, ip: str) -> None:
+    try:
+        # attributes must make a valid geolocation
+        IpGeolocationModel(ip=ip, **record)
+    except ValidationError as e:
+        raise ValueError(str(e))
+
+
+def build_offline_geo_database(csv_path: str, output_path: str) -> dict:
+    """
+    Imports CSV of IP ranges into offline geo database file. The file is
+    replaced atomically, so running workers keep using the previous one.
+    """
+    ranges: Dict[int, List[Tuple[int, int, int]]] = {4: [], 6: []}
+    record_indexes: Dict[bytes, int] = {}
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        for line_number, row in enumerate(csv.DictReader(file), start=2):
+            try:
+                version, first, last = parse_range(row)
+                record = parse_record(row)
+                encoded_record = to_json(record)
+                # ranges with the same attributes share one record
+                if encoded_record not in record_indexes:
+                    validate_record(record, format_address(version, first))
+                    record_indexes[encoded_record] = len(record_indexes)
+            except (KeyError, TypeError, ValueError) as e:
+                raise OfflineGeoDatabaseException(f"Line {line_number}: {e}")
+            ranges[version].append((first, last, record_indexes[encoded_record]))
+
+    for version, version_ranges in ranges.items():
+        version_ranges.sort()
+        for previous, current in zip(version_ranges, version_ranges[1:]):
+            if current[0] <= previous[1]:
+                raise OfflineGeoDatabaseException(
+                    f"Overlapping IPv{version} ranges starting at "
+                    f"{format_address(version, previous[0])} and "
+                    f"{format_address(version, current[0])}"
+                )
+
+    records = list(record_indexes)
+    sections = [HEADER.pack(MAGIC, len(ranges[4]), len(ranges[6]), len(records))]
+    for version, width in ((4, 4), (6, 16)):
+        starts, ends, indexes = bytearray(), bytearray(), bytearray()
+        for first, last, record_index in ranges[version]:
+            if width == 4:
+                starts += UINT32.pack(first)
+                ends += UINT32.pack(last)
+            else:
+                starts += first.to_bytes(width, "big")
+                ends += last.to_bytes(width, "big")
+            indexes += UINT32.pack(record_index)
+        sections.extend((bytes(starts), bytes(ends), bytes(indexes)))
+
+    records_offset = sum(map(len, sections)) + UINT32.size * (len(records) + 1)
+    offsets = [records_offset]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    sections.append(b"".join(UINT32.pack(offset) for offset in offsets))
+    sections.extend(records)
+
+    temporary_path = f"{output_path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.writelines(sections)
+    os.replace(temporary_path, output_path)
+    return {
+        "ipv4_ranges": len(ranges[4]),
+        "ipv6_ranges": len(ranges[6]),
+        "records": len(records),
+    }
+
+
+def open_offline_geo_database(path: Optional[str]) -> Optional[OfflineGeoDatabase]:
+    return OfflineGeoDatabase(path) if path else None
+
+
+offline_geo_database = open_offline_geo_database(os.getenv("OFFLINE_GEO_DB_PATH"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Imports CSV of IP ranges into offline geo database file."
+    )
+    parser.add_argument("csv_path")
+    parser.add_argument("output_path")
+    args = parser.parse_args()
+    print(build_offline_geo_database(args.csv_path, args.output_path))
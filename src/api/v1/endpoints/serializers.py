@@ -0,0 +1,100 @@
+from typing import Any
+
+from fastapi.responses import Response
+from pydantic_core import from_json, to_json
+
+from src.models import IpGeolocation, Language, Location
+from src.validators import IpGeolocationModel, LanguageModel, LocationModel
+
+# attributes copied from database rows, in order of response model fields
+LANGUAGE_FIELDS = tuple(name for name in LanguageModel.model_fields if name != "id")
+LOCATION_FIELDS = tuple(
+    name for name in LocationModel.model_fields if name not in ("id", "languages")
+)
+IP_GEOLOCATION_FIELDS = tuple(
+    name for name in IpGeolocationModel.model_fields if name not in ("id", "location")
+)
+
+
+def serialize_language(language: Language) -> dict:
+    payload = {"id": None}
+    for name in LANGUAGE_FIELDS:
+        payload[name] = getattr(language, name)
+    return payload
+
+
+def serialize_location(location: Location) -> dict:
+    payload = {"id": None}
+    for name in LOCATION_FIELDS:
+        payload[name] = getattr(location, name)
+    payload["languages"] = [
+        serialize_language(language) for language in location.languages
+    ]
+    return payload
+
+
+def serialize_geolocation(geolocation: IpGeolocation) -> dict:
+    """
+    Builds IpGeolocationModel-shaped payload straight from a database row.
+    Stored rows were validated on the way in, so validators are not run again.
+    """
+    payload = {"id": None}
+    for name in IP_GEOLOCATION_FIELDS:
+        payload[name] = getattr(geolocation, name)
+    location = geolocation.location
+    payload["location"] = serialize_location(location) if location else None
+    return payload
+
+
+def json_response(content: Any) -> Response:
+    """
+    Encodes payloads (dicts, lists or pydantic models) to JSON in one pass,
+    bypassing re-validation against endpoint's response_model.
+    """
+    return Response(content=to_json(content), media_type="application/json")
+
+
+def encode_compact_geolocation(payload: dict) -> bytes:
+    """
+    Encodes serialized geolocation payload for external caches, without
+    empty fields, which are restored by decode_compact_geolocation.
+    """
+    compact = {
+        name: value
+        for name, value in payload.items()
+        if value is not None and name != "location"
+    }
+    location = payload["location"]
+    if location:
+        compact["location"] = {
+            name: value
+            for name, value in location.items()
+            if value is not None and name != "languages"
+        }
+        compact["location"]["languages"] = [
+            {name: value for name, value in language.items() if value is not None}
+            for language in location["languages"]
+        ]
+    return to_json(compact)
+
+
+def decode_compact_geolocation(data: bytes) -> dict:
+    compact = from_json(data)
+    payload = {"id": compact.get("id")}
+    for name in IP_GEOLOCATION_FIELDS:
+        payload[name] = compact.get(name)
+    location = compact.get("location")
+    if location:
+        payload["location"] = {"id": location.get("id")}
+        for name in LOCATION_FIELDS:
+            payload["location"][name] = location.get(name)
+        payload["location"]["languages"] = [
+            {
+                "id": language.get("id"),
+                **{name: language.get(name) for name in LANGUAGE_FIELDS},
+            }
+            for language in location["languages"]
+        ]
+    else:
+        payload["location"] = None
+    return payload
@@ -1,40 +1,396 @@
+import ipaddress
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from sqlalchemy import cast, false, func, insert, select, true, update
+from sqlalchemy.dialects.postgresql import ARRAY, INET
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import DBAPIError, SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from src.models import (
+    Base,
+    IpGeolocation,
+    Language,
+    Location,
+    location_language_association,
+)
+from src.validators import IpGeolocationModel, LanguageModel, LocationModel
+
+DUPLICATE_ENTRY_ERROR = "An entry with the same IP or URL already exists."
+
+# maximum number of bind parameters of a single statement (PostgreSQL protocol)
+MAX_BIND_PARAMETERS = 32767
+
+
+class DuplicateGeolocationException(Exception):
+    pass
 
-from src.models import IpGeolocation
-from src.validators import IpGeolocationModel
 
+def geolocation_loader_options() -> list:
+    """
+    Loader options of the relationships read by IpGeolocation.as_dict(),
+    set by GEOLOCATION_LOADING_STRATEGY env variable:
+    - "joined": location and languages loaded in the same statement,
+    - "selectin": location joined, languages loaded by one extra statement.
+    Relationships must be loaded up front, as AsyncSession cannot lazy load them.
+    """
+    strategy = os.getenv("GEOLOCATION_LOADING_STRATEGY", "joined")
+    location = joinedload(IpGeolocation.location)
+    if strategy == "selectin":
+        return [location.selectinload(Location.languages)]
+    return [location.joinedload(Location.languages)]
 
-def get_geolocation_from_db(
-    ip_or_url_value: str, value_type: str, db: Session
+
+async def get_geolocation_from_db(
+    ip_or_url_value: str,
+    value_type: str,
+    db: AsyncSession,
+    match_networks: bool = True,
 ) -> IpGeolocation | None:
+    """
+    Finds geolocation of IP or URL value. Unless match_networks is False,
+    IP without its own entry resolves to the most specific network containing it.
+    """
+    query = select(IpGeolocation).options(*geolocation_loader_options()).limit(1)
     try:
         if value_type == "ip":
+            geolocation = (
+                await db.scalars(query.where(IpGeolocation.ip == ip_or_url_value))
+            ).first()
+            if geolocation or not match_networks:
+                return geolocation
             return (
-                db.query(IpGeolocation)
-                .filter((IpGeolocation.ip == ip_or_url_value))
-                .first()
-            )
+                await db.scalars(
+                    query.where(
+                        IpGeolocation.network.op(">>=")(cast(ip_or_url_value, INET))
+                    ).order_by(func.masklen(IpGeolocation.network).desc())
+                )
+            ).first()
         else:
             return (
-                db.query(IpGeolocation)
-                .filter((IpGeolocation.url == ip_or_url_value))
-                .first()
+                await db.scalars(query.where(IpGeolocation.url == ip_or_url_value))
+            ).first()
+    except (SQLAlchemyError, DBAPIError) as e:
+        print(f"Database query failed: {e}")
+        raise RuntimeError("Database query failed") from e
+
+
+async def get_geolocations_from_db(
+    ip_or_url_values: List[str], value_type: str, db: AsyncSession
+) -> List[IpGeolocation]:
+    column = IpGeolocation.ip if value_type == "ip" else IpGeolocation.url
+    try:
+        return (
+            (
+                await db.scalars(
+                    select(IpGeolocation)
+                    .options(*geolocation_loader_options())
+                    .where(column.in_(ip_or_url_values))
+                )
+            )
+            .unique()
+            .all()
+        )
+    except (SQLAlchemyError, DBAPIError) as e:
+        print(f"Database query failed: {e}")
+        raise RuntimeError("Database query failed") from e
+
+
+async def get_network_geolocations_from_db(
+    ips: List[str], db: AsyncSession
+) -> Dict[str, IpGeolocation]:
+    """
+    Resolves each of IPs to the most specific network containing it,
+    with a single query. IPs not contained in any network are omitted.
+    """
+    searched = (
+        func.unnest(cast(ips, ARRAY(INET)))
+        .table_valued("ip")
+        .render_derived(name="searched")
+    )
+    try:
+        rows = (
+            (
+                await db.execute(
+                    select(searched.c.ip, IpGeolocation)
+                    .join(IpGeolocation, IpGeolocation.network.op(">>=")(searched.c.ip))
+                    .order_by(searched.c.ip, func.masklen(IpGeolocation.network).desc())
+                    .distinct(searched.c.ip)
+                    .options(*geolocation_loader_options())
+                )
             )
+            .unique()
+            .all()
+        )
     except (SQLAlchemyError, DBAPIError) as e:
         print(f"Database query failed: {e}")
         raise RuntimeError("Database query failed") from e
+    return {str(ipaddress.ip_address(ip)): geolocation for ip, geolocation in rows}
+
+
+async def resolve_geolocation_location_id(
+    geolocation: IpGeolocationModel, db: AsyncSession
+) -> Optional[int]:
+    # find or create Location and its related Languages, with one upsert each
+    location_data = geolocation.location
+    if not location_data:
+        return None
+    language_ids = await resolve_language_ids(
+        {language.code: language for language in location_data.languages}, db
+    )
+    location_ids = await resolve_location_ids(
+        {location_data.geoname_id: location_data}, language_ids, db
+    )
+    return location_ids[location_data.geoname_id]
+
+
+async def save_geolocation_in_db(
+    geolocation: IpGeolocationModel,
+    db: AsyncSession,
+    fetched_at: Optional[datetime] = None,
+) -> IpGeolocation:
+    """
+    Stores geolocation with a single insert. Uniqueness of IP, URL and network
+    is enforced by the database, so concurrent requests cannot store duplicates;
+    DuplicateGeolocationException is raised when an entry already exists.
+    fetched_at is set for geolocations fetched from external source.
+    """
+    location_id = await resolve_geolocation_location_id(geolocation, db)
+
+    # create IpGeolocation record
+    geolocation_id = await db.scalar(
+        pg_insert(IpGeolocation)
+        .values(
+            **geolocation.model_dump(exclude={"id", "location"}),
+            location_id=location_id,
+            fetched_at=fetched_at,
+        )
+        .on_conflict_do_nothing()
+        .returning(IpGeolocation.id)
+    )
+    if geolocation_id is None:
+        await db.rollback()
+        raise DuplicateGeolocationException(DUPLICATE_ENTRY_ERROR)
+    await db.commit()
+
+    return (
+        await db.scalars(
+            select(IpGeolocation)
+            .options(*geolocation_loader_options())
+            .where(IpGeolocation.id == geolocation_id)
+        )
+    ).first()
+
+
+async def refresh_geolocation_in_db(
+    geolocation_id: int,
+    geolocation: IpGeolocationModel,
+    db: AsyncSession,
+    fetched_at: datetime,
+) -> None:
+    """
+    Replaces data of stored geolocation with data fetched again from external
+    source. IP, URL and network of the entry are kept.
+    """
+    location_id = await resolve_geolocation_location_id(geolocation, db)
+    await db.execute(
+        update(IpGeolocation)
+        .where(IpGeolocation.id == geolocation_id)
+        .values(
+            **geolocation.model_dump(
+                exclude={"id", "ip", "url", "network", "location"}
+            ),
+            location_id=location_id,
+            fetched_at=fetched_at,
+        )
+    )
+    await db.commit()
+
+
+async def insert_missing_rows(
+    model: Type[Base], key: str, rows: List[dict], db: AsyncSession
+) -> Dict[Any, Tuple[int, bool]]:
+    """
+    Inserts rows whose unique key is not stored yet and returns (id, inserted)
+    of all rows by key, with INSERT ... ON CONFLICT DO NOTHING statements of
+    as many rows as fit in the bind parameter limit. Existing rows are read in
+    the same statements, without updating (and bloating) them. Rows stored by
+    concurrent transactions after a statement started are read by an extra query.
+    """
+    key_column = getattr(model, key)
+    # rows are inserted in the same order by all transactions, to avoid deadlocks
+    rows = sorted(rows, key=lambda row: row[key])
+    # each row takes a parameter per column and one more for its key lookup
+    chunk_size = MAX_BIND_PARAMETERS // (len(rows[0]) + 1)
+    ids = {}
+    for start in range(0, len(rows), chunk_size):
+        end = start + chunk_size
+        chunk = rows[start:end]
+        keys = [row[key] for row in chunk]
+        inserted_rows = (
+            pg_insert(model)
+            .values(chunk)
+            .on_conflict_do_nothing(index_elements=[key])
+            .returning(key_column, model.id)
+            .cte("inserted_rows")
+        )
+        for row_key, row_id, inserted in await db.execute(
+            select(inserted_rows.c[key], inserted_rows.c.id, true()).union_all(
+                select(key_column, model.id, false()).where(key_column.in_(keys))
+            )
+        ):
+            ids[row_key] = (row_id, inserted)
+
+        missing_keys = [row_key for row_key in keys if row_key not in ids]
+        if missing_keys:
+            for row_key, row_id in await db.execute(
+                select(key_column, model.id).where(key_column.in_(missing_keys))
+            ):
+                ids[row_key] = (row_id, False)
+    return ids
+
+
+async def resolve_language_ids(
+    languages: Dict[str, LanguageModel], db: AsyncSession
+) -> Dict[str, int]:
+    if not languages:
+        return {}
+    language_ids = await insert_missing_rows(
+        Language,
+        "code",
+        [language.model_dump(exclude={"id"}) for language in languages.values()],
+        db,
+    )
+    return {code: language_id for code, (language_id, _) in language_ids.items()}
+
+
+async def resolve_location_ids(
+    locations: Dict[int, LocationModel],
+    language_ids: Dict[str, int],
+    db: AsyncSession,
+) -> Dict[int, int]:
+    if not locations:
+        return {}
+    location_ids = await insert_missing_rows(
+        Location,
+        "geoname_id",
+        [
+            location.model_dump(exclude={"id", "languages"})
+            for location in locations.values()
+        ],
+        db,
+    )
+    # languages are assigned to locations only when they are created
+    associations = [
+        {"location_id": location_id, "language_id": language_ids[language_code]}
+        for geoname_id, (location_id, inserted) in location_ids.items()
+        if inserted
+        for language_code in dict.fromkeys(
+            language.code for language in locations[geoname_id].languages
+        )
+    ]
+    if associations:
+        await db.execute(insert(location_language_association), associations)
+    return {
+        geoname_id: location_id for geoname_id, (location_id, _) in location_ids.items()
+    }
+
+
+async def bulk_save_geolocations_in_db(
+    geolocations: List[IpGeolocationModel], db: AsyncSession
+) -> Dict[int, str]:
+    """
+    Stores a batch of geolocations using multi-row inserts (paged by
+    SQLAlchemy to stay within the bind parameter limit), with Languages
+    and Locations deduplicated within the batch. Returns rejection reasons
+    of rows that were not stored, keyed by their position in the batch.
+    """
+    ips = {geolocation.ip for geolocation in geolocations if geolocation.ip}
+    urls = {geolocation.url for geolocation in geolocations if geolocation.url}
+    taken_ips = (
+        set(await db.scalars(select(IpGeolocation.ip).where(IpGeolocation.ip.in_(ips))))
+        if ips
+        else set()
+    )
+    taken_urls = (
+        set(
+            await db.scalars(
+                select(IpGeolocation.url).where(IpGeolocation.url.in_(urls))
+            )
+        )
+        if urls
+        else set()
+    )
+    networks = {
+        geolocation.network for geolocation in geolocations if geolocation.network
+    }
+    taken_networks = (
+        set(
+            await db.scalars(
+                select(IpGeolocation.network).where(IpGeolocation.network.in_(networks))
+            )
+        )
+        if networks
+        else set()
+    )
+
+    rejected = {}
+    accepted_geolocations = {}
+    languages = {}
+    locations = {}
+    for index, geolocation in enumerate(geolocations):
+        if (
+            geolocation.ip in taken_ips
+            or geolocation.url in taken_urls
+            or geolocation.network in taken_networks
+        ):
+            rejected[index] = DUPLICATE_ENTRY_ERROR
+            continue
+        # reserve values, so that duplicates within the batch are rejected too
+        if geolocation.ip:
+            taken_ips.add(geolocation.ip)
+        if geolocation.url:
+            taken_urls.add(geolocation.url)
+        if geolocation.network:
+            taken_networks.add(geolocation.network)
 
+        accepted_geolocations[index] = geolocation
+        if geolocation.location:
+            locations.setdefault(geolocation.location.geoname_id, geolocation.location)
+            for language in geolocation.location.languages:
+                languages.setdefault(language.code, language)
 
-def check_geolocation_exists_in_db(
-    geolocation: IpGeolocationModel, db: Session
-) -> bool:
-    conditions = []
-    if geolocation.ip:
-        conditions.append(IpGeolocation.ip == geolocation.ip)
-    if geolocation.url:
-        conditions.append(IpGeolocation.url == geolocation.url)
+    language_ids = await resolve_language_ids(languages, db)
+    location_ids = await resolve_location_ids(locations, language_ids, db)
 
-    existing_entry = db.query(IpGeolocation).filter(*conditions).first()
+    if accepted_geolocations:
+        # entries stored concurrently since the check above are skipped
+        stored_values = set()
+        for row in await db.execute(
+            pg_insert(IpGeolocation)
+            .on_conflict_do_nothing()
+            .returning(IpGeolocation.ip, IpGeolocation.url, IpGeolocation.network),
+            [
+                {
+                    **geolocation.model_dump(exclude={"id", "location"}),
+                    "location_id": (
+                        location_ids[geolocation.location.geoname_id]
+                        if geolocation.location
+                        else None
+                    ),
+                }
+                for geolocation in accepted_geolocations.values()
+            ],
+        ):
+            stored_values.update(value for value in row if value)
+        for index, geolocation in accepted_geolocations.items():
+            if not stored_values.intersection(
+                (geolocation.ip, geolocation.url, geolocation.network)
+            ):
+                rejected[index] = DUPLICATE_ENTRY_ERROR
+    await db.commit()
 
-    return existing_entry is not None
+    return rejected
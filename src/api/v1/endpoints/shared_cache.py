@@ -0,0 +1,238 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from .cache import geolocation_cache_keys
+from .serializers import decode_compact_geolocation, encode_compact_geolocation
+
+SHARED_CACHE_KEY_PREFIX = "geolocation:"
+
+
+class SharedCache(ABC):
+    """
+    Cache shared by all application workers and hosts. Stores compact bytes
+    under string keys; errors of the backend are counted and treated as misses,
+    so that the cache can never fail a request.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            value = await self._get(key)
+        except Exception as e:
+            print(f"Shared cache get failed: {e}")
+            self.errors += 1
+            return None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        try:
+            await self._set(key, value, ttl)
+        except Exception as e:
+            print(f"Shared cache set failed: {e}")
+            self.errors += 1
+
+    async def delete(self, keys: List[str]) -> None:
+        try:
+            await self._delete(keys)
+        except Exception as e:
+            print(f"Shared cache delete failed: {e}")
+            self.errors += 1
+
+    async def clear(self, prefix: str) -> None:
+        try:
+            await self._clear(prefix)
+        except Exception as e:
+            print(f"Shared cache clear failed: {e}")
+            self.errors += 1
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def _set(self, key: str, value: bytes, ttl: int) -> None:
+        pass
+
+    @abstractmethod
+    async def _delete(self, keys: List[str]) -> None:
+        pass
+
+    @abstractmethod
+    async def _clear(self, prefix: str) -> None:
+        pass
+
+
+class InMemorySharedCache(SharedCache):
+    """
+    Process-local stand-in for the shared cache, for tests and local runs.
+    Entries expire after their ttl and the least recently used ones are
+    evicted above max_size, like in TTLCache.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        super().__init__()
+        self.max_size = max_size
+        self.evictions = 0
+        self._entries: OrderedDict[str, Tuple[float, bytes]] = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def _set(self, key: str, value: bytes, ttl: int) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _delete(self, keys: List[str]) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def _clear(self, prefix: str) -> None:
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+
+class RedisSharedCache(SharedCache):
+    """
+    Shared cache stored in Redis (or any server speaking Redis protocol).
+    """
+
+    def __init__(self, url: str, client=None):
+        super().__init__()
+        if client is None:
+            # imported only when Redis backend is configured
+            import redis.asyncio
+
+            timeout = float(os.getenv("GEOLOCATION_SHARED_CACHE_TIMEOUT", "0.5"))
+            client = redis.asyncio.from_url(
+                url, socket_timeout=timeout, socket_connect_timeout=timeout
+            )
+        self._client = client
+
+    async def _get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def _set(self, key: str, value: bytes, ttl: int) -> None:
+        await self._client.set(key, value, ex=ttl)
+
+    async def _delete(self, keys: List[str]) -> None:
+        if keys:
+            await self._client.delete(*keys)
+
+    async def _clear(self, prefix: str) -> None:
+        keys = [key async for key in self._client.scan_iter(match=f"{prefix}*")]
+        if keys:
+            await self._client.delete(*keys)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_shared_cache(url: Optional[str]) -> Optional[SharedCache]:
+    """
+    Creates shared cache from GEOLOCATION_SHARED_CACHE_URL: redis:// (rediss://)
+    URL for Redis backend, memory:// for in-process one or none to disable it.
+    """
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return InMemorySharedCache(
+            max_size=int(os.getenv("GEOLOCATION_SHARED_CACHE_MAX_SIZE", "10000"))
+        )
+    return RedisSharedCache(url)
+
+
+shared_geolocation_cache = create_shared_cache(
+    os.getenv("GEOLOCATION_SHARED_CACHE_URL")
+)
+
+
+def shared_cache_key(normalized_value: str, value_type: str) -> str:
+    return f"{SHARED_CACHE_KEY_PREFIX}{value_type}:{normalized_value}"
+
+
+async def get_shared_cached_geolocation(
+    normalized_value: str, value_type: str
+) -> Optional[dict]:
+    if shared_geolocation_cache is None:
+        return None
+    data = await shared_geolocation_cache.get(
+        shared_cache_key(normalized_value, value_type)
+    )
+    return decode_compact_geolocation(data) if data else None
+
+
+async def set_shared_cached_geolocation(
+    normalized_value: str, value_type: str, payload: dict
+) -> None:
+    if shared_geolocation_cache is None:
+        return
+    await shared_geolocation_cache.set(
+        shared_cache_key(normalized_value, value_type),
+        encode_compact_geolocation(payload),
+        ttl=int(os.getenv("GEOLOCATION_SHARED_CACHE_TTL", "3600")),
+    )
+
+
+async def invalidate_shared_cached_geolocations(
+    geolocations: Iterable[Tuple[Optional[str], Optional[str], Optional[str]]],
+) -> None:
+    """
+    Removes shared cache entries of geolocations given as (ip, url, network)
+    tuples, with a single request to the backend.
+    """
+    if shared_geolocation_cache is None:
+        return
+    keys = []
+    clear_ips = False
+    for ip, url, network in geolocations:
+        # any cached IP lookup may resolve to a network now
+        clear_ips = clear_ips or bool(network)
+        keys.extend(shared_cache_key(*key) for key in geolocation_cache_keys(ip, url))
+    if clear_ips:
+        ip_prefix = f"{SHARED_CACHE_KEY_PREFIX}ip:"
+        await shared_geolocation_cache.clear(ip_prefix)
+        keys = [key for key in keys if not key.startswith(ip_prefix)]
+    await shared_geolocation_cache.delete(keys)
+
+
+async def invalidate_shared_cached_geolocation(
+    ip: Optional[str], url: Optional[str], network: Optional[str] = None
+) -> None:
+    await invalidate_shared_cached_geolocations([(ip, url, network)])
@@ -1,8 +1,110 @@
+import os
+import threading
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-import os
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# the same database reached through asyncpg driver, used by request handlers
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+
+
+class CheckoutMonitorMixin:
+    """
+    Pool mixin which records how long requests wait to check out a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.checkout_wait_total += wait
+                self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+
+class MonitoredQueuePool(CheckoutMonitorMixin, QueuePool):
+    pass
 
-engine = create_engine(DATABASE_URL)
+
+class MonitoredAsyncQueuePool(CheckoutMonitorMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def database_engine_options(asynchronous: bool = False) -> dict:
+    """
+    Engine and pool options read from env variables. Connection arguments
+    differ between psycopg2 (sync) and asyncpg (asynchronous) drivers.
+    """
+    connect_args = {}
+    connect_timeout = os.getenv("DB_CONNECT_TIMEOUT")
+    statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+    if asynchronous:
+        if connect_timeout:
+            connect_args["timeout"] = int(connect_timeout)
+        if statement_timeout:
+            connect_args["server_settings"] = {
+                "statement_timeout": str(int(statement_timeout))
+            }
+    else:
+        if connect_timeout:
+            connect_args["connect_timeout"] = int(connect_timeout)
+        if statement_timeout:
+            connect_args["options"] = f"-c statement_timeout={int(statement_timeout)}"
+
+    return {
+        "poolclass": MonitoredAsyncQueuePool if asynchronous else MonitoredQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "-1")),
+        # detects connections broken e.g. by database restart before using them
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "connect_args": connect_args,
+    }
+
+
+def pool_stats(engine: Engine) -> dict:
+    pool = engine.pool
+    max_connections = pool.size() + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "max_connections": max_connections,
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "utilization": checked_out / max_connections if max_connections else 0.0,
+        "checkouts": pool.checkouts,
+        "checkout_wait_total": pool.checkout_wait_total,
+        "checkout_wait_avg": (
+            pool.checkout_wait_total / pool.checkouts if pool.checkouts else 0.0
+        ),
+        "checkout_wait_max": pool.checkout_wait_max,
+    }
+
+
+engine = create_engine(DATABASE_URL, **database_engine_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, **database_engine_options(asynchronous=True)
+)
+# objects stay loaded after commit, as AsyncSession cannot refresh them lazily
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
@@ -1,26 +1,214 @@
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.responses import Response
 
 from src.api.v1.endpoints import geolocations
+from src.api.v1.endpoints.cache import geolocation_cache, negative_geolocation_cache
+from src.api.v1.endpoints.circuit_breaker import CLOSED, HALF_OPEN, OPEN
+from src.api.v1.endpoints.ipstack_api import (
+    ip_stack_batcher,
+    ip_stack_circuit_breaker,
+    ip_stack_client,
+    ip_stack_single_flight,
+)
+from src.api.v1.endpoints.shared_cache import shared_geolocation_cache
 
-from .database import engine
+from .database import async_engine, engine, pool_stats
+from .metrics import REGISTRY, CallbackMetric
 from .models import Base
+from .server_timing import ServerTimingMiddleware
 
 APP_NAME = "Simple Geo API"
 
 Base.metadata.create_all(bind=engine)
 
+
+def cache_stats() -> dict:
+    stats = {
+        ("local",): geolocation_cache.stats(),
+        ("negative",): negative_geolocation_cache.stats(),
+    }
+    if shared_geolocation_cache is not None:
+        stats[("shared",)] = shared_geolocation_cache.stats()
+    return stats
+
+
+def register_metrics() -> None:
+    """
+    Exposes statistics of caches, IpStack API client and database pool
+    as metrics, read from their stats() when metrics are scraped.
+    """
+    cache_metrics = [
+        ("geolocation_cache_hits", "Geolocation cache hits.", "counter", "hits"),
+        ("geolocation_cache_misses", "Geolocation cache misses.", "counter", "misses"),
+        ("geolocation_cache_size", "Geolocation cache entries.", "gauge", "size"),
+    ]
+    for name, documentation, metric_type, stat in cache_metrics:
+        REGISTRY.register(
+            CallbackMetric(
+                name,
+                documentation,
+                lambda stat=stat: {
+                    key: stats[stat]
+                    for key, stats in cache_stats().items()
+                    if stat in stats
+                },
+                metric_type=metric_type,
+                labelnames=("cache",),
+            )
+        )
+
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_in_flight_requests",
+            "IpStack API requests in progress.",
+            lambda: ip_stack_single_flight.stats()["in_flight"],
+        )
+    )
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_requests",
+            "IpStack API requests started.",
+            lambda: ip_stack_single_flight.stats()["calls"],
+            metric_type="counter",
+        )
+    )
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_coalesced_requests",
+            "IpStack API calls answered by an already running request.",
+            lambda: ip_stack_single_flight.stats()["coalesced"],
+            metric_type="counter",
+        )
+    )
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_batch_requests",
+            "IpStack API bulk requests of batched lookups.",
+            lambda: ip_stack_batcher.batches,
+            metric_type="counter",
+        )
+    )
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_batched_values",
+            "Values looked up by IpStack API bulk requests.",
+            lambda: ip_stack_batcher.keys,
+            metric_type="counter",
+        )
+    )
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_circuit_breaker_state",
+            "Current state of IpStack API circuit breaker (1 for current state).",
+            lambda: {
+                (state,): int(ip_stack_circuit_breaker.state == state)
+                for state in (CLOSED, OPEN, HALF_OPEN)
+            },
+            labelnames=("state",),
+        )
+    )
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_circuit_breaker_transitions",
+            "Transitions of IpStack API circuit breaker to each state.",
+            lambda: {
+                (state,): count
+                for state, count in ip_stack_circuit_breaker.transitions.items()
+            },
+            metric_type="counter",
+            labelnames=("state",),
+        )
+    )
+    REGISTRY.register(
+        CallbackMetric(
+            "ip_stack_circuit_breaker_rejected",
+            "IpStack API calls rejected while the circuit was open.",
+            lambda: ip_stack_circuit_breaker.rejected,
+            metric_type="counter",
+        )
+    )
+
+    pool_metrics = [
+        ("db_pool_size", "Database pool size.", "gauge", "size"),
+        ("db_pool_checked_out", "Checked out connections.", "gauge", "checked_out"),
+        ("db_pool_utilization", "Checked out to maximum.", "gauge", "utilization"),
+        ("db_pool_checkouts", "Connection checkouts.", "counter", "checkouts"),
+        (
+            "db_pool_checkout_wait_seconds",
+            "Time spent waiting for connections.",
+            "counter",
+            "checkout_wait_total",
+        ),
+        (
+            "db_pool_checkout_wait_max_seconds",
+            "Longest wait for a connection.",
+            "gauge",
+            "checkout_wait_max",
+        ),
+    ]
+    for name, documentation, metric_type, stat in pool_metrics:
+        REGISTRY.register(
+            CallbackMetric(
+                name,
+                documentation,
+                lambda stat=stat: pool_stats(async_engine.sync_engine)[stat],
+                metric_type=metric_type,
+            )
+        )
+
+
+register_metrics()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ip_stack_client.start()
+    yield
+    await ip_stack_client.close()
+    if shared_geolocation_cache is not None:
+        await shared_geolocation_cache.close()
+    await async_engine.dispose()
+
+
 app = (
-    FastAPI(title=APP_NAME, docs_url=None, redoc_url=None)
+    FastAPI(title=APP_NAME, lifespan=lifespan, docs_url=None, redoc_url=None)
     if os.getenv("APP_ENV") == "production"
-    else FastAPI(title=APP_NAME)
+    else FastAPI(title=APP_NAME, lifespan=lifespan)
 )
 
+# adds per-stage durations of requests in Server-Timing response header
+if os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true":
+    app.add_middleware(ServerTimingMiddleware)
+
 app.include_router(geolocations.router, prefix="/geolocations", tags=["geolocations"])
 
 
 @app.get("/")
 def get_root():
     return Response(status_code=204)
+
+
+@app.get("/stats")
+def get_stats():
+    stats = {
+        "geolocation_cache": geolocation_cache.stats(),
+        "negative_geolocation_cache": negative_geolocation_cache.stats(),
+        "ip_stack_requests": ip_stack_single_flight.stats(),
+        "ip_stack_batches": ip_stack_batcher.stats(),
+        "ip_stack_circuit_breaker": ip_stack_circuit_breaker.stats(),
+        "database_pool": pool_stats(async_engine.sync_engine),
+    }
+    if shared_geolocation_cache is not None:
+        stats["shared_geolocation_cache"] = shared_geolocation_cache.stats()
+    return stats
+
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(
+        content=REGISTRY.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
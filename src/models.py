@@ -1,17 +1,52 @@
+import ipaddress
+
 from sqlalchemy import (
     Boolean,
     CheckConstraint,
     Column,
+    DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Table,
+    TypeDecorator,
+    func,
+    text,
 )
+from sqlalchemy.dialects.postgresql import CIDR, INET
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 
+
+class IpAddress(TypeDecorator):
+    """
+    IP address stored in compact INET column and read back as a normalized
+    string, regardless of database driver.
+    """
+
+    impl = INET
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return str(ipaddress.ip_interface(value).ip) if value is not None else None
+
+
+class Network(TypeDecorator):
+    """
+    CIDR column read back as a string, regardless of database driver
+    (asyncpg returns ipaddress network objects).
+    """
+
+    impl = CIDR
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return str(value) if value is not None else None
+
+
 location_language_association = Table(
     "location_language_association",
     Base.metadata,
@@ -24,7 +59,7 @@ class Language(Base):
     __tablename__ = "languages"
 
     id = Column(Integer, primary_key=True)
-    code = Column(String, nullable=False)
+    code = Column(String, nullable=False, unique=True)
     name = Column(String, nullable=False)
     native = Column(String, nullable=False)
 
@@ -40,7 +75,7 @@ class Location(Base):
     __tablename__ = "locations"
 
     id = Column(Integer, primary_key=True)
-    geoname_id = Column(Integer, nullable=False)
+    geoname_id = Column(Integer, nullable=False, unique=True)
     capital = Column(String, nullable=False)
     country_flag = Column(String, nullable=False)
     country_flag_emoji = Column(String, nullable=False)
@@ -66,9 +101,11 @@ class IpGeolocation(Base):
     __tablename__ = "ip_geolocations"
 
     id = Column(Integer, primary_key=True)
-    ip = Column(String, index=True)
+    ip = Column(IpAddress)
     type = Column(String)
-    url = Column(String, index=True)
+    url = Column(String)
+    # geolocation of the whole IP range, e.g. 162.158.0.0/16
+    network = Column(Network)
     continent_code = Column(String, nullable=False)
     continent_name = Column(String, nullable=False)
     country_code = Column(String, nullable=False)
@@ -85,12 +122,48 @@ class IpGeolocation(Base):
     ip_routing_type = Column(String)
     connection_type = Column(String)
 
+    # when data was fetched from external source (null for entries stored by users)
+    fetched_at = Column(DateTime(timezone=True))
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
+
     location_id = Column(Integer, ForeignKey("locations.id"))
     location = relationship("Location", backref="ip_geolocations", uselist=False)
 
     __table_args__ = (
         CheckConstraint(
-            "(ip IS NOT NULL OR url IS NOT NULL)", name="ip_or_url_not_null"
+            "(ip IS NOT NULL OR url IS NOT NULL OR network IS NOT NULL)",
+            name="ip_url_or_network_not_null",
+        ),
+        # partial unique indexes enforce uniqueness of values which are set
+        Index(
+            "ix_ip_geolocations_ip",
+            "ip",
+            unique=True,
+            postgresql_where=text("ip IS NOT NULL"),
+        ),
+        Index(
+            "ix_ip_geolocations_url",
+            "url",
+            unique=True,
+            postgresql_where=text("url IS NOT NULL"),
+        ),
+        Index(
+            "ix_ip_geolocations_network_unique",
+            "network",
+            unique=True,
+            postgresql_where=text("network IS NOT NULL"),
+        ),
+        # GiST index supports containment queries (network >>= ip)
+        Index(
+            "ix_ip_geolocations_network",
+            "network",
+            postgresql_using="gist",
+            postgresql_ops={"network": "inet_ops"},
         ),
     )
 
@@ -0,0 +1,105 @@
+import time
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import Histogram
+
+
+class ServerTimings:
+    """
+    Stage durations, source of the answer and outcome (e.g. whether database
+    failed before the source answered) collected for a single request.
+    """
+
+    __slots__ = ("entries", "source", "outcome")
+
+    def __init__(self):
+        self.entries: List[Tuple[str, float]] = []
+        self.source: Optional[str] = None
+        self.outcome: Optional[str] = None
+
+    def add(self, name: str, duration: float) -> None:
+        self.entries.append((name, duration))
+
+    def header(self, total: float) -> str:
+        # durations are given in milliseconds
+        parts = [f"{name};dur={duration * 1000:.3f}" for name, duration in self.entries]
+        if self.source:
+            parts.append(f'source;desc="{self.source}"')
+        if self.outcome:
+            parts.append(f'outcome;desc="{self.outcome}"')
+        parts.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(parts)
+
+
+# timings of the current request, None when ServerTimingMiddleware is not used
+server_timings: ContextVar[Optional[ServerTimings]] = ContextVar(
+    "server_timings", default=None
+)
+
+
+def set_response_source(source: Optional[str], outcome: Optional[str] = None) -> None:
+    timings = server_timings.get()
+    if timings is not None:
+        timings.source = source
+        timings.outcome = outcome
+
+
+class StageTimer:
+    """
+    Context manager observing duration of a request stage in histogram
+    and, when enabled, in Server-Timing header of the response.
+    """
+
+    __slots__ = ("histogram", "stage", "labels", "start")
+
+    def __init__(self, histogram: Histogram, stage: str, **labels: str):
+        self.histogram = histogram
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self) -> "StageTimer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        duration = time.perf_counter() - self.start
+        self.histogram.observe(duration, stage=self.stage, **self.labels)
+        timings = server_timings.get()
+        if timings is not None:
+            timings.add(self.stage, duration)
+
+
+class ServerTimingMiddleware:
+    """
+    Adds Server-Timing header with durations of stages recorded while
+    handling the request, the source which answered it and total time.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = ServerTimings()
+        token = server_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_server_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing", timings.header(time.perf_counter() - start)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            server_timings.reset(token)
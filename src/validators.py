@@ -1,16 +1,41 @@
 import ipaddress
-from typing import List, Optional
-from urllib.parse import urlparse
+from functools import lru_cache, wraps
+from typing import Callable, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
 
 from pydantic import BaseModel, Field, field_validator, model_validator
 
+# number of distinct input values whose normalized form is memoized
+NORMALIZATION_CACHE_SIZE = 16384
+# longer input values are normalized without being memoized, so arbitrary
+# long client input is not kept in memory
+NORMALIZATION_CACHE_MAX_VALUE_LENGTH = 2048
 
+T = TypeVar("T")
+
+
+def memoize_normalization(function: Callable[[str], T]) -> Callable[[str], T]:
+    cached_function = lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)(function)
+
+    @wraps(function)
+    def normalize(value: str) -> T:
+        if len(value) > NORMALIZATION_CACHE_MAX_VALUE_LENGTH:
+            return function(value)
+        return cached_function(value)
+
+    normalize.cache_info = cached_function.cache_info
+    normalize.cache_clear = cached_function.cache_clear
+    return normalize
+
+
+@memoize_normalization
 def normalize_url(url: str) -> str:
     try:
-        if not urlparse(url).scheme:
-            url = f"http://{url}"
+        parsed_url = urlsplit(url)
+        if not parsed_url.scheme:
+            # parsed as if prefixed with a scheme, e.g. http://
+            parsed_url = urlsplit(f"//{url}")
 
-        parsed_url = urlparse(url)
         if parsed_url.netloc and "." in parsed_url.netloc:
             return parsed_url.netloc
         return ""
@@ -18,6 +43,30 @@ def normalize_url(url: str) -> str:
         return ""
 
 
+@memoize_normalization
+def normalize_ip_or_url(value: str) -> Optional[Tuple[str, str]]:
+    """
+    Returns canonical form of IP or URL value with its type ("ip" or "url"),
+    used as lookup and cache key, or None if value is neither of them.
+    """
+    # IPv6 addresses contain a colon and IPv4 ones start with a digit, so
+    # each value is parsed only as the IP version it can be (hostnames as none)
+    ip_address_class = (
+        ipaddress.IPv6Address
+        if ":" in value
+        else ipaddress.IPv4Address if value[:1].isdigit() else None
+    )
+    if ip_address_class:
+        try:
+            return str(ip_address_class(value)), "ip"
+        except ValueError:
+            pass
+    normalized_url = normalize_url(value)
+    if normalized_url:
+        return normalized_url, "url"
+    return None
+
+
 class LanguageModel(BaseModel):
     id: Optional[int] = None
     code: str = Field(..., min_length=1, max_length=5)
@@ -60,6 +109,7 @@ class IpGeolocationModel(BaseModel):
     ip: Optional[str] = None
     type: Optional[str] = Field(None, pattern=r"^(ipv4|ipv6)$")
     url: Optional[str] = None
+    network: Optional[str] = None
     continent_code: str
     continent_name: str
     country_code: str
@@ -95,26 +145,40 @@ class IpGeolocationModel(BaseModel):
     def check_ip_or_url_required(cls, values):
         ip = values.get("ip")
         url = values.get("url")
+        network = values.get("network")
 
-        if ip is None and url is None:
-            raise ValueError("At least one of 'ip' or 'url' must not be null")
+        if ip is None and url is None and network is None:
+            raise ValueError(
+                "At least one of 'ip', 'url' or 'network' must not be null"
+            )
         return values
 
     @field_validator("ip")
     def check_ip_address_and_normalize(cls, ip_address):
         if ip_address is None:
             return None
+        normalized = normalize_ip_or_url(ip_address)
+        if normalized is None or normalized[1] != "ip":
+            raise ValueError("'ip' field must be either ipv4 or ipv6 standard")
+        return normalized[0]
+
+    @field_validator("network")
+    def check_network_and_normalize(cls, network):
+        if network is None:
+            return None
         try:
-            normalized_ip_address = ipaddress.ip_address(ip_address)
-            return str(normalized_ip_address)
+            return str(ipaddress.ip_network(network, strict=False))
         except ValueError:
-            raise ValueError("'ip' field must be either ipv4 or ipv6 standard")
+            raise ValueError("'network' field must be ipv4 or ipv6 network in CIDR")
 
     @field_validator("url")
     def check_url_and_normalize(cls, url):
-        if url and not normalize_url(url):
+        if url is None:
+            return None
+        normalized_url = normalize_url(url)
+        if url and not normalized_url:
             raise ValueError("'url' field must be a correct url address")
-        return normalize_url(url)
+        return normalized_url
 
     @field_validator("latitude")
     def validate_latitude(cls, v):
@@ -167,3 +231,28 @@ class IpGeolocationModel(BaseModel):
             ]
         }
     }
+
+
+GEOLOCATION_LOOKUP_MAX_VALUES = 5000
+
+
+class GeolocationLookupRequest(BaseModel):
+    values: List[str] = Field(
+        ..., min_length=1, max_length=GEOLOCATION_LOOKUP_MAX_VALUES
+    )
+
+
+class GeolocationLookupResult(BaseModel):
+    value: str
+    geolocation: Optional[IpGeolocationModel] = None
+    error: Optional[str] = None
+
+
+class BulkIngestReject(BaseModel):
+    line: int
+    error: str
+
+
+class BulkIngestResult(BaseModel):
+    inserted: int
+    rejected: List[BulkIngestReject]
@@ -4,9 +4,14 @@ from unittest.mock import patch
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
-from src.api.v1.endpoints.geolocations import get_db
+from src.api.v1.endpoints.cache import geolocation_cache, negative_geolocation_cache
+from src.api.v1.endpoints.geolocations import get_db, pending_geolocation_refreshes
+from src.api.v1.endpoints.ipstack_api import ip_stack_circuit_breaker
+from src.database import ASYNC_DATABASE_URL
 from src.main import app
 from src.models import Base
 
@@ -31,10 +36,31 @@ def session(engine):
     Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture(autouse=True)
+def async_session_factory():
+    # TestClient runs each request in a new event loop, so asyncpg connections
+    # cannot be pooled between requests
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+    with patch(
+        "src.api.v1.endpoints.geolocations.AsyncSessionLocal", AsyncSessionLocal
+    ):
+        yield AsyncSessionLocal
+
+
 @pytest.fixture(scope="function")
-def client(session):
-    def override_get_db():
-        yield session
+async def async_session(session, async_session_factory):
+    async with async_session_factory() as async_session:
+        yield async_session
+
+
+@pytest.fixture(scope="function")
+def client(session, async_session_factory):
+    async def override_get_db():
+        async with async_session_factory() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
     return TestClient(app)
@@ -44,3 +70,31 @@ def client(session):
 def mock_db_session():
     with patch("src.api.v1.endpoints.geolocations.get_geolocation_from_db") as mock_db:
         yield mock_db
+
+
+@pytest.fixture(autouse=True)
+def clear_geolocation_cache():
+    geolocation_cache.clear()
+    negative_geolocation_cache.clear()
+    yield
+    geolocation_cache.clear()
+    negative_geolocation_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_pending_geolocation_refreshes():
+    pending_geolocation_refreshes.clear()
+    yield
+    pending_geolocation_refreshes.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_ip_stack_circuit_breaker():
+    ip_stack_circuit_breaker.reset()
+    yield
+    ip_stack_circuit_breaker.reset()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
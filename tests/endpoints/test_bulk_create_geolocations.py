@@ -0,0 +1,202 @@
+import json
+
+import pytest
+
+from src.models import IpGeolocation, Language, Location
+
+
+def geolocation_row(ip=None, url=None, geoname_id=756135, languages=("pl",)):
+    return {
+        "ip": ip,
+        "url": url,
+        "continent_code": "EU",
+        "continent_name": "Europe",
+        "country_code": "PL",
+        "country_name": "Poland",
+        "region_code": "MZ",
+        "region_name": "Mazovia",
+        "city": "Warsaw",
+        "latitude": 52.2317,
+        "longitude": 21.0183,
+        "location": {
+            "geoname_id": geoname_id,
+            "capital": "Warsaw",
+            "country_flag": "https://assets.ipstack.com/flags/pl.svg",
+            "country_flag_emoji": "🇵🇱",
+            "country_flag_emoji_unicode": "U+1F1F5 U+1F1F1",
+            "calling_code": "48",
+            "is_eu": True,
+            "languages": [
+                {"code": code, "name": code.upper(), "native": code.upper()}
+                for code in languages
+            ],
+        },
+    }
+
+
+def to_ndjson(rows):
+    return "\n".join(
+        row if isinstance(row, str) else json.dumps(row) for row in rows
+    ).encode()
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setenv("GEOLOCATION_BULK_BATCH_SIZE", "2")
+
+
+def test_bulk_create_geolocations(client, session, small_batches):
+    rows = [
+        geolocation_row(ip="162.158.103.87"),
+        geolocation_row(ip="162.158.103.88", languages=("pl", "en")),
+        geolocation_row(url="https://example.com/path", geoname_id=2982681),
+        geolocation_row(ip="162.158.103.89", url="other.com"),
+    ]
+
+    response = client.post("/geolocations/bulk", content=to_ndjson(rows))
+
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 4, "rejected": []}
+    assert session.query(IpGeolocation).count() == 4
+    assert session.query(Location).count() == 2
+    assert sorted(language.code for language in session.query(Language)) == [
+        "en",
+        "pl",
+    ]
+    stored_geolocation = (
+        session.query(IpGeolocation).filter(IpGeolocation.url == "example.com").one()
+    )
+    assert stored_geolocation.location.geoname_id == 2982681
+    assert [language.code for language in stored_geolocation.location.languages] == [
+        "pl"
+    ]
+
+
+def test_bulk_create_geolocations_reuses_stored_location(client, session):
+    session.add(
+        Location(
+            geoname_id=756135,
+            capital="Warsaw",
+            country_flag="https://assets.ipstack.com/flags/pl.svg",
+            country_flag_emoji="🇵🇱",
+            country_flag_emoji_unicode="U+1F1F5 U+1F1F1",
+            calling_code="48",
+            is_eu=True,
+            languages=[Language(code="pl", name="Polish", native="Polski")],
+        )
+    )
+    session.commit()
+
+    response = client.post(
+        "/geolocations/bulk",
+        content=to_ndjson([geolocation_row(ip="162.158.103.87")]),
+    )
+
+    assert response.json() == {"inserted": 1, "rejected": []}
+    assert session.query(Location).count() == 1
+    assert session.query(Language).count() == 1
+
+
+def test_bulk_create_geolocations_reports_rejected_rows(client, session, small_batches):
+    session.add(
+        IpGeolocation(
+            ip="162.158.103.87",
+            continent_code="EU",
+            continent_name="Europe",
+            country_code="PL",
+            country_name="Poland",
+            region_code="MZ",
+            region_name="Mazovia",
+            city="Warsaw",
+            latitude=52.2317,
+            longitude=21.0183,
+        )
+    )
+    session.commit()
+
+    rows = [
+        geolocation_row(ip="162.158.103.87"),
+        "not a json",
+        geolocation_row(ip="162.158.103.88"),
+        "",
+        '["not", "an", "object"]',
+        {**geolocation_row(ip="162.158.103.89"), "latitude": 100},
+        geolocation_row(ip="162.158.103.88"),
+    ]
+
+    response = client.post("/geolocations/bulk", content=to_ndjson(rows))
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["inserted"] == 1
+    assert [reject["line"] for reject in result["rejected"]] == [1, 2, 5, 6, 7]
+    assert result["rejected"][0]["error"] == (
+        "An entry with the same IP or URL already exists."
+    )
+    assert result["rejected"][1]["error"] == "Row is not a valid JSON"
+    assert result["rejected"][2]["error"] == "Row must be a JSON object"
+    assert result["rejected"][3]["error"].startswith("latitude:")
+    assert session.query(IpGeolocation).count() == 2
+
+
+def test_bulk_create_geolocations_streamed_in_chunks(client, session, small_batches):
+    payload = to_ndjson(
+        [geolocation_row(ip=f"10.0.0.{number}") for number in range(1, 6)]
+    )
+
+    def stream():
+        chunk_size = 7
+        for start in range(0, len(payload), chunk_size):
+            yield payload[start:][:chunk_size]
+
+    response = client.post("/geolocations/bulk", content=stream())
+
+    assert response.json() == {"inserted": 5, "rejected": []}
+    assert session.query(IpGeolocation).count() == 5
+
+
+def test_bulk_create_geolocations_batch_above_bind_parameter_limit(
+    client, session, monkeypatch
+):
+    # one multi-row insert of so many rows would exceed 32767 bind parameters
+    monkeypatch.setenv("GEOLOCATION_BULK_BATCH_SIZE", "2000")
+    rows = [
+        geolocation_row(ip=f"10.0.{number // 256}.{number % 256}")
+        for number in range(2000)
+    ]
+
+    response = client.post("/geolocations/bulk", content=to_ndjson(rows))
+
+    assert response.json() == {"inserted": 2000, "rejected": []}
+    assert session.query(IpGeolocation).count() == 2000
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100000])
+def test_bulk_create_geolocations_rejects_too_long_rows(
+    client, session, monkeypatch, chunk_size
+):
+    monkeypatch.setattr(
+        "src.api.v1.endpoints.geolocations.GEOLOCATION_BULK_MAX_LINE_LENGTH", 1000
+    )
+    rows = [
+        geolocation_row(ip="10.0.0.1"),
+        json.dumps([geolocation_row(ip=f"10.0.1.{number}") for number in range(5)]),
+        geolocation_row(ip="10.0.0.2"),
+        "x" * 5000,
+    ]
+    payload = to_ndjson(rows)
+
+    def stream():
+        for start in range(0, len(payload), chunk_size):
+            yield payload[start:][:chunk_size]
+
+    response = client.post("/geolocations/bulk", content=stream())
+
+    assert response.json() == {
+        "inserted": 2,
+        "rejected": [
+            {"line": 2, "error": "Row is longer than 1000 bytes"},
+            {"line": 4, "error": "Row is longer than 1000 bytes"},
+        ],
+    }
+    assert session.query(IpGeolocation).count() == 2
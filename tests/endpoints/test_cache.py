@@ -0,0 +1,103 @@
+from unittest.mock import patch
+
+from src.api.v1.endpoints.cache import (
+    NOT_FOUND,
+    UPSTREAM_ERROR,
+    TTLCache,
+    geolocation_cache_keys,
+    invalidate_cached_geolocation,
+    negative_geolocation_cache,
+    remember_missing_geolocation,
+)
+
+
+def test_cache_get_and_set():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set(("8.8.8.8", "ip"), "geolocation")
+
+    assert cache.get(("8.8.8.8", "ip")) == "geolocation"
+    assert cache.get(("example.com", "url")) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_expires_entries_after_ttl():
+    cache = TTLCache(max_size=10, ttl=60)
+    with patch("src.api.v1.endpoints.cache.time.monotonic", return_value=1000.0):
+        cache.set("a", 1)
+    with patch("src.api.v1.endpoints.cache.time.monotonic", return_value=1059.0):
+        assert cache.get("a") == 1
+    with patch("src.api.v1.endpoints.cache.time.monotonic", return_value=1060.0):
+        assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_cache_entry_with_own_ttl():
+    cache = TTLCache(max_size=10, ttl=60)
+    with patch("src.api.v1.endpoints.cache.time.monotonic", return_value=1000.0):
+        cache.set("a", 1, ttl=5)
+    with patch("src.api.v1.endpoints.cache.time.monotonic", return_value=1005.0):
+        assert cache.get("a") is None
+
+
+def test_upstream_errors_remembered_shorter_than_not_found(monkeypatch):
+    monkeypatch.setattr("src.api.v1.endpoints.cache.UPSTREAM_ERROR_TTL", 10.0)
+    monkeypatch.setattr(negative_geolocation_cache, "ttl", 60.0)
+    with patch("src.api.v1.endpoints.cache.time.monotonic", return_value=1000.0):
+        remember_missing_geolocation("10.0.0.1", NOT_FOUND)
+        remember_missing_geolocation("10.0.0.2", UPSTREAM_ERROR)
+    with patch("src.api.v1.endpoints.cache.time.monotonic", return_value=1010.0):
+        assert negative_geolocation_cache.get("10.0.0.1") == NOT_FOUND
+        assert negative_geolocation_cache.get("10.0.0.2") is None
+
+
+def test_invalidate_cached_geolocation_forgets_missing_values():
+    remember_missing_geolocation("10.0.0.1", NOT_FOUND)
+    remember_missing_geolocation("example.com", NOT_FOUND)
+    remember_missing_geolocation("10.0.0.2", NOT_FOUND)
+
+    invalidate_cached_geolocation("10.0.0.1", "example.com")
+    assert negative_geolocation_cache.get("10.0.0.1") is None
+    assert negative_geolocation_cache.get("example.com") is None
+    assert negative_geolocation_cache.get("10.0.0.2") == NOT_FOUND
+
+    invalidate_cached_geolocation(None, None, "10.0.0.0/8")
+    assert negative_geolocation_cache.get("10.0.0.2") is None
+
+
+def test_cache_disabled_with_zero_max_size():
+    cache = TTLCache(max_size=0, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+
+
+def test_cache_delete():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    cache.delete("a")
+    cache.delete("missing")
+
+    assert cache.get("a") is None
+
+
+def test_geolocation_cache_keys():
+    assert geolocation_cache_keys("8.8.8.8", None) == [("8.8.8.8", "ip")]
+    assert geolocation_cache_keys(None, "example.com") == [("example.com", "url")]
+    assert geolocation_cache_keys("8.8.8.8", "example.com") == [
+        ("8.8.8.8", "ip"),
+        ("example.com", "url"),
+    ]
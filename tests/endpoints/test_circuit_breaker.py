@@ -0,0 +1,122 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from src.api.v1.endpoints.circuit_breaker import CircuitBreaker, CircuitOpenException
+
+
+async def succeed():
+    return "result"
+
+
+async def fail():
+    raise ConnectionError("Connection refused")
+
+
+async def fail_times(circuit_breaker, times):
+    for _ in range(times):
+        with pytest.raises(ConnectionError):
+            await circuit_breaker.call(fail)
+
+
+@pytest.mark.anyio
+async def test_circuit_opens_after_consecutive_failures():
+    circuit_breaker = CircuitBreaker(failure_threshold=3, open_duration=30)
+
+    await fail_times(circuit_breaker, 2)
+    assert await circuit_breaker.call(succeed) == "result"
+    await fail_times(circuit_breaker, 2)
+    assert circuit_breaker.state == "closed"
+
+    await fail_times(circuit_breaker, 1)
+    assert circuit_breaker.state == "open"
+
+    executions = []
+
+    async def func():
+        executions.append(1)
+
+    with pytest.raises(CircuitOpenException):
+        await circuit_breaker.call(func)
+    assert executions == []
+    assert circuit_breaker.stats()["rejected"] == 1
+    assert circuit_breaker.stats()["transitions"]["open"] == 1
+
+
+@pytest.mark.anyio
+async def test_ignored_exceptions_are_not_failures():
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=1, open_duration=30, ignored_exceptions=(ValueError,)
+    )
+
+    async def invalid():
+        raise ValueError("Invalid data")
+
+    with pytest.raises(ValueError):
+        await circuit_breaker.call(invalid)
+    assert circuit_breaker.state == "closed"
+
+
+@pytest.mark.anyio
+async def test_successful_probe_closes_circuit():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, open_duration=30)
+    with patch("src.api.v1.endpoints.circuit_breaker.time.monotonic", return_value=0):
+        await fail_times(circuit_breaker, 1)
+
+    with patch("src.api.v1.endpoints.circuit_breaker.time.monotonic", return_value=29):
+        with pytest.raises(CircuitOpenException):
+            await circuit_breaker.call(succeed)
+
+    with patch("src.api.v1.endpoints.circuit_breaker.time.monotonic", return_value=30):
+        assert await circuit_breaker.call(succeed) == "result"
+    assert circuit_breaker.state == "closed"
+    assert circuit_breaker.stats()["transitions"] == {
+        "closed": 1,
+        "open": 1,
+        "half_open": 1,
+    }
+
+
+@pytest.mark.anyio
+async def test_failed_probe_opens_circuit_again():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, open_duration=30)
+    with patch("src.api.v1.endpoints.circuit_breaker.time.monotonic", return_value=0):
+        await fail_times(circuit_breaker, 1)
+
+    with patch("src.api.v1.endpoints.circuit_breaker.time.monotonic", return_value=30):
+        await fail_times(circuit_breaker, 1)
+        assert circuit_breaker.state == "open"
+
+    with patch("src.api.v1.endpoints.circuit_breaker.time.monotonic", return_value=59):
+        with pytest.raises(CircuitOpenException):
+            await circuit_breaker.call(succeed)
+
+
+@pytest.mark.anyio
+async def test_half_open_circuit_limits_probes():
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=1, open_duration=0, half_open_probes=2
+    )
+    await fail_times(circuit_breaker, 1)
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return "result"
+
+    probes = [asyncio.ensure_future(circuit_breaker.call(slow)) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert circuit_breaker.state == "half_open"
+    with pytest.raises(CircuitOpenException):
+        await circuit_breaker.call(succeed)
+
+    # cancelled probe frees its slot
+    probes[0].cancel()
+    await asyncio.sleep(0)
+    assert await circuit_breaker.call(succeed) == "result"
+    assert circuit_breaker.state == "half_open"
+
+    release.set()
+    assert await probes[1] == "result"
+    assert circuit_breaker.state == "closed"
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 import pytest
 
 from src.models import IpGeolocation
@@ -53,3 +55,41 @@ def test_delete_geolocation_bad_request(client):
     response = client.delete("/geolocations/malformed_value")
     assert response.status_code == 400
     assert response.json() == {"detail": "Parameter must be Ipv4, Ipv6 or URL value"}
+
+
+def test_delete_geolocation_invalidates_cache(client, session, sample_geolocation):
+    ip_or_url_value = sample_geolocation.ip
+
+    assert client.get(f"/geolocations/{ip_or_url_value}").status_code == 200
+
+    response = client.delete(f"/geolocations/{ip_or_url_value}")
+    assert response.status_code == 204
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ):
+        response = client.get(f"/geolocations/{ip_or_url_value}")
+    assert response.status_code == 404
+
+
+def test_delete_geolocation_does_not_delete_containing_network(client, session):
+    session.add(
+        IpGeolocation(
+            network="162.158.0.0/16",
+            continent_code="EU",
+            continent_name="Europe",
+            country_code="PL",
+            country_name="Poland",
+            region_code="MZ",
+            region_name="Mazovia",
+            city="Warsaw",
+            latitude=52.2317,
+            longitude=21.0183,
+        )
+    )
+    session.commit()
+
+    response = client.delete("/geolocations/162.158.103.87")
+    assert response.status_code == 404
+    assert session.query(IpGeolocation).count() == 1
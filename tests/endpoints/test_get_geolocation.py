@@ -1,5 +1,15 @@
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch
 
+import pytest
+from fastapi import BackgroundTasks
+
+from src.api.v1.endpoints.cache import geolocation_cache
+from src.api.v1.endpoints.geolocations import schedule_stale_refresh
+from src.api.v1.endpoints.ipstack_api import (
+    IpStackCircuitOpenException,
+    IpStackUnavailableException,
+)
 from src.models import IpGeolocation, Language, Location
 from src.validators import IpGeolocationModel
 
@@ -206,3 +216,358 @@ def test_get_geolocation_with_external_source_database_connection_error(
         response = client.get("/geolocations/8.8.8.8")
         assert response.status_code == 500
         assert response.json()["detail"] == "Database connection error"
+
+
+def test_repeated_lookup_served_from_cache(mock_db_session, client):
+    mock_db_session.return_value = IpGeolocation(
+        **{
+            "id": 123,
+            "ip": "160.158.103.87",
+            "type": "ipv4",
+            "continent_code": "EU",
+            "continent_name": "Europe",
+            "country_code": "PL",
+            "country_name": "Poland",
+            "region_code": "MZ",
+            "region_name": "Mazovia",
+            "city": "Warsaw",
+            "latitude": 52.2317,
+            "longitude": 21.0183,
+        }
+    )
+
+    first_response = client.get("/geolocations/160.158.103.87")
+    second_response = client.get("/geolocations/160.158.103.87")
+
+    assert first_response.status_code == 200
+    assert second_response.status_code == 200
+    assert second_response.json() == first_response.json()
+    assert mock_db_session.call_count == 1
+
+
+EXTERNAL_GEOLOCATION_DATA = {
+    "ip": "8.8.8.8",
+    "type": "ipv4",
+    "continent_code": "NA",
+    "continent_name": "North America",
+    "country_code": "US",
+    "country_name": "United States",
+    "region_code": "CA",
+    "region_name": "California",
+    "city": "Mountain View",
+    "latitude": 37.3861,
+    "longitude": -122.0839,
+    "location": {
+        "geoname_id": 5375480,
+        "capital": "Washington D.C.",
+        "country_flag": "https://assets.ipstack.com/flags/us.svg",
+        "country_flag_emoji": "🇺🇸",
+        "country_flag_emoji_unicode": "U+1F1FA U+1F1F8",
+        "calling_code": "1",
+        "is_eu": False,
+        "languages": [{"code": "en", "name": "English", "native": "English"}],
+    },
+}
+
+
+def test_get_geolocation_read_through_stores_external_result(
+    session, client, monkeypatch
+):
+    monkeypatch.setenv("GEOLOCATION_READ_THROUGH", "true")
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**EXTERNAL_GEOLOCATION_DATA),
+    ) as mock_fetch:
+        response = client.get("/geolocations/8.8.8.8")
+        assert response.status_code == 200
+
+        stored_geolocation = (
+            session.query(IpGeolocation).filter(IpGeolocation.ip == "8.8.8.8").one()
+        )
+        assert stored_geolocation.city == "Mountain View"
+        assert stored_geolocation.location.languages[0].code == "en"
+        assert stored_geolocation.fetched_at is not None
+
+        # next lookup is served from database
+        response = client.get("/geolocations/8.8.8.8")
+        assert response.status_code == 200
+        assert response.json()["location"]["geoname_id"] == 5375480
+        assert mock_fetch.call_count == 1
+
+
+def test_get_geolocation_read_through_stores_searched_url(session, client, monkeypatch):
+    monkeypatch.setenv("GEOLOCATION_READ_THROUGH", "true")
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**EXTERNAL_GEOLOCATION_DATA),
+    ):
+        response = client.get("/geolocations/dns.google")
+        assert response.status_code == 200
+        assert response.json()["url"] is None
+
+    stored_geolocation = session.query(IpGeolocation).one()
+    assert stored_geolocation.ip == "8.8.8.8"
+    assert stored_geolocation.url == "dns.google"
+
+
+def test_get_geolocation_read_through_stores_url_of_stored_ip(
+    session, client, monkeypatch
+):
+    monkeypatch.setenv("GEOLOCATION_READ_THROUGH", "true")
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**EXTERNAL_GEOLOCATION_DATA),
+    ) as mock_fetch:
+        assert client.get("/geolocations/8.8.8.8").status_code == 200
+        assert client.get("/geolocations/dns.google").status_code == 200
+
+        stored_geolocation = (
+            session.query(IpGeolocation).filter(IpGeolocation.url == "dns.google").one()
+        )
+        assert stored_geolocation.ip is None
+        assert stored_geolocation.city == "Mountain View"
+
+        # next lookup of the URL is served from database
+        geolocation_cache.clear()
+        response = client.get("/geolocations/dns.google")
+        assert response.status_code == 200
+        assert response.json()["url"] == "dns.google"
+        assert mock_fetch.call_count == 2
+    assert session.query(IpGeolocation).count() == 2
+
+
+def test_get_geolocation_read_through_disabled_by_default(session, client):
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**EXTERNAL_GEOLOCATION_DATA),
+    ):
+        response = client.get("/geolocations/8.8.8.8")
+        assert response.status_code == 200
+
+    assert session.query(IpGeolocation).count() == 0
+
+
+def test_get_geolocation_from_containing_network(session, client):
+    session.add(
+        IpGeolocation(
+            network="162.158.0.0/16",
+            continent_code="EU",
+            continent_name="Europe",
+            country_code="PL",
+            country_name="Poland",
+            region_code="MZ",
+            region_name="Mazovia",
+            city="Warsaw",
+            latitude=52.2317,
+            longitude=21.0183,
+        )
+    )
+    session.commit()
+
+    response = client.get("/geolocations/162.158.103.87")
+    assert response.status_code == 200
+    assert response.json()["network"] == "162.158.0.0/16"
+    assert response.json()["city"] == "Warsaw"
+
+    # more specific network created later takes precedence over cached one
+    response = client.post(
+        "/geolocations",
+        json={
+            "network": "162.158.103.0/24",
+            "continent_code": "EU",
+            "continent_name": "Europe",
+            "country_code": "PL",
+            "country_name": "Poland",
+            "region_code": "MA",
+            "region_name": "Lesser Poland",
+            "city": "Krakow",
+            "latitude": 50.0647,
+            "longitude": 19.945,
+        },
+    )
+    assert response.status_code == 201
+
+    response = client.get("/geolocations/162.158.103.87")
+    assert response.json()["network"] == "162.158.103.0/24"
+    assert response.json()["city"] == "Krakow"
+
+
+def test_not_found_value_answered_from_negative_cache(mock_db_session, client):
+    mock_db_session.return_value = None
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ) as mock_fetch:
+        for _ in range(3):
+            response = client.get("/geolocations/10.0.0.1")
+            assert response.status_code == 404
+            assert response.json()["detail"] == "Geolocation not found"
+
+    assert mock_db_session.call_count == 1
+    assert mock_fetch.call_count == 1
+
+
+def test_upstream_error_answered_from_negative_cache(mock_db_session, client):
+    mock_db_session.return_value = None
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        side_effect=IpStackUnavailableException("Timed out"),
+    ) as mock_fetch:
+        for _ in range(2):
+            response = client.get("/geolocations/8.8.8.8")
+            assert response.status_code == 404
+
+    assert mock_fetch.call_count == 1
+
+
+def test_database_error_not_remembered_as_missing(mock_db_session, client):
+    mock_db_session.side_effect = RuntimeError("Database connection error")
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ) as mock_fetch:
+        for _ in range(2):
+            response = client.get("/geolocations/8.8.8.8")
+            assert response.status_code == 500
+
+    assert mock_fetch.call_count == 2
+
+
+def test_created_geolocation_replaces_negative_cache_entry(client, session):
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ):
+        response = client.get("/geolocations/example.com")
+        assert response.status_code == 404
+
+        response = client.post(
+            "/geolocations",
+            json={
+                "url": "example.com",
+                "continent_code": "EU",
+                "continent_name": "Europe",
+                "country_code": "PL",
+                "country_name": "Poland",
+                "region_code": "MZ",
+                "region_name": "Mazovia",
+                "city": "Warsaw",
+                "latitude": 52.2317,
+                "longitude": 21.0183,
+            },
+        )
+        assert response.status_code == 201
+
+        response = client.get("/geolocations/example.com")
+        assert response.status_code == 200
+        assert response.json()["city"] == "Warsaw"
+
+
+@pytest.mark.parametrize(
+    "status_code,detail",
+    [
+        ("404", "Geolocation not found"),
+        ("503", "Geolocation external source unavailable"),
+    ],
+)
+def test_open_circuit_fails_fast_with_configured_status(
+    mock_db_session, client, monkeypatch, status_code, detail
+):
+    monkeypatch.setenv("IP_STACK_CIRCUIT_OPEN_STATUS_CODE", status_code)
+    mock_db_session.return_value = None
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        side_effect=IpStackCircuitOpenException("Circuit is open"),
+    ) as mock_fetch:
+        for _ in range(2):
+            response = client.get("/geolocations/8.8.8.8")
+            assert response.status_code == int(status_code)
+            assert response.json()["detail"] == detail
+
+    # circuit state is checked again on every request
+    assert mock_fetch.call_count == 2
+
+
+def stored_geolocation_fetched(session, fetched_at):
+    geolocation = IpGeolocation(
+        ip="8.8.8.8",
+        type="ipv4",
+        continent_code="NA",
+        continent_name="North America",
+        country_code="US",
+        country_name="United States",
+        region_code="CA",
+        region_name="California",
+        city="Los Angeles",
+        latitude=34.0522,
+        longitude=-118.2437,
+        fetched_at=fetched_at,
+    )
+    session.add(geolocation)
+    session.commit()
+    return geolocation
+
+
+def test_stale_geolocation_served_and_refreshed(session, client, monkeypatch):
+    monkeypatch.setenv("GEOLOCATION_MAX_AGE", "3600")
+    fetched_at = datetime.now(timezone.utc) - timedelta(hours=2)
+    geolocation = stored_geolocation_fetched(session, fetched_at)
+    updated_at = geolocation.updated_at
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**EXTERNAL_GEOLOCATION_DATA),
+    ) as mock_fetch:
+        # stored geolocation is served, refresh runs after the response
+        response = client.get("/geolocations/8.8.8.8")
+        assert response.status_code == 200
+        assert response.json()["city"] == "Los Angeles"
+        assert mock_fetch.call_count == 1
+
+        response = client.get("/geolocations/8.8.8.8")
+        assert response.json()["city"] == "Mountain View"
+        assert response.json()["location"]["geoname_id"] == 5375480
+        assert mock_fetch.call_count == 1
+
+    session.refresh(geolocation)
+    assert geolocation.city == "Mountain View"
+    assert geolocation.fetched_at > fetched_at
+    assert geolocation.updated_at > updated_at
+
+
+@pytest.mark.parametrize(
+    "fetched_at",
+    [datetime.now(timezone.utc) - timedelta(minutes=30), None],
+)
+def test_fresh_or_user_stored_geolocation_not_refreshed(
+    session, client, monkeypatch, fetched_at
+):
+    monkeypatch.setenv("GEOLOCATION_MAX_AGE", "3600")
+    stored_geolocation_fetched(session, fetched_at)
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+    ) as mock_fetch:
+        response = client.get("/geolocations/8.8.8.8")
+        assert response.status_code == 200
+
+    mock_fetch.assert_not_called()
+
+
+def test_concurrent_stale_refreshes_are_deduplicated(session):
+    geolocation = stored_geolocation_fetched(
+        session, datetime.now(timezone.utc) - timedelta(days=60)
+    )
+    background_tasks = BackgroundTasks()
+
+    for _ in range(3):
+        schedule_stale_refresh(background_tasks, geolocation, "8.8.8.8", "ip")
+
+    assert len(background_tasks.tasks) == 1
@@ -1,13 +1,38 @@
+import asyncio
+
+import httpx
 import pytest
-import requests
-import responses
+from fastapi.testclient import TestClient
 
 from src.api.v1.endpoints.ipstack_api import (
     IP_STACK_API_URL,
+    IpStackCircuitOpenException,
+    IpStackUnavailableException,
+    create_ip_stack_http_client,
     fetch_geolocation_from_external_source,
+    ip_stack_batch_size,
+    ip_stack_batcher,
+    ip_stack_circuit_breaker,
+    ip_stack_client,
+    ip_stack_single_flight,
 )
+from src.main import app
 from src.validators import IpGeolocationModel
 
+IP_STACK_RESPONSE = {
+    "ip": "8.8.8.8",
+    "type": "ipv4",
+    "continent_code": "NA",
+    "continent_name": "North America",
+    "country_code": "US",
+    "country_name": "United States",
+    "region_code": "CA",
+    "region_name": "California",
+    "city": "Mountain View",
+    "latitude": 37.386,
+    "longitude": -122.084,
+}
+
 
 @pytest.fixture
 def set_ip_stack_key(monkeypatch):
@@ -19,96 +44,330 @@ def clear_ip_stack_key(monkeypatch):
     monkeypatch.delenv("IP_STACK_API_ACCESS_KEY", raising=False)
 
 
-@responses.activate
-def test_fetch_geolocation_success(set_ip_stack_key):
-    normalized_value = "8.8.8.8"
-    api_url = IP_STACK_API_URL.format(search_value=normalized_value)
+@pytest.fixture
+async def mock_ip_stack():
+    requests = []
+    handlers = []
 
-    mock_response = {
-        "ip": "8.8.8.8",
-        "type": "ipv4",
-        "continent_code": "NA",
-        "continent_name": "North America",
-        "country_code": "US",
-        "country_name": "United States",
-        "region_code": "CA",
-        "region_name": "California",
-        "city": "Mountain View",
-        "latitude": 37.386,
-        "longitude": -122.084,
-    }
+    def dispatch(request):
+        requests.append(request)
+        return handlers[0](request)
 
-    responses.add(
-        responses.GET,
-        api_url,
-        json=mock_response,
-        status=200,
-    )
+    await ip_stack_client.start(transport=httpx.MockTransport(dispatch))
+    yield handlers, requests
+    await ip_stack_client.close()
 
-    geolocation = fetch_geolocation_from_external_source(normalized_value)
+
+@pytest.mark.anyio
+async def test_fetch_geolocation_success(set_ip_stack_key, mock_ip_stack):
+    handlers, requests = mock_ip_stack
+    normalized_value = "8.8.8.8"
+    handlers.append(lambda request: httpx.Response(200, json=IP_STACK_RESPONSE))
+
+    geolocation = await fetch_geolocation_from_external_source(normalized_value)
 
     assert geolocation is not None
     assert isinstance(geolocation, IpGeolocationModel)
     assert geolocation.ip == "8.8.8.8"
     assert geolocation.country_name == "United States"
+    assert str(requests[0].url).startswith(
+        IP_STACK_API_URL.format(search_value=normalized_value)
+    )
+    assert requests[0].url.params["access_key"] == "test_key"
 
 
-def test_fetch_geolocation_missing_access_key(clear_ip_stack_key):
+@pytest.mark.anyio
+async def test_fetch_geolocation_missing_access_key(clear_ip_stack_key, mock_ip_stack):
+    handlers, requests = mock_ip_stack
     normalized_value = "8.8.8.8"
 
-    geolocation = fetch_geolocation_from_external_source(normalized_value)
-    assert geolocation is None
+    with pytest.raises(IpStackUnavailableException):
+        await fetch_geolocation_from_external_source(normalized_value)
+    assert requests == []
 
 
-@responses.activate
-def test_fetch_geolocation_api_error(set_ip_stack_key):
+@pytest.mark.anyio
+async def test_fetch_geolocation_api_error(set_ip_stack_key, mock_ip_stack):
+    handlers, _ = mock_ip_stack
     normalized_value = "8.8.8.8"
-    api_url = IP_STACK_API_URL.format(search_value=normalized_value)
-
-    responses.add(
-        responses.GET,
-        api_url,
-        status=500,
-    )
+    handlers.append(lambda request: httpx.Response(500))
 
-    geolocation = fetch_geolocation_from_external_source(normalized_value)
-
-    assert geolocation is None
+    with pytest.raises(IpStackUnavailableException):
+        await fetch_geolocation_from_external_source(normalized_value)
 
 
-@responses.activate
-def test_fetch_geolocation_invalid_data(set_ip_stack_key):
+@pytest.mark.anyio
+async def test_fetch_geolocation_invalid_data(set_ip_stack_key, mock_ip_stack):
+    handlers, _ = mock_ip_stack
     normalized_value = "8.8.8.8"
-    api_url = IP_STACK_API_URL.format(search_value=normalized_value)
 
     mock_response = {
         "ip": "8.8.8.8",
         "type": "ipv4",
     }
+    handlers.append(lambda request: httpx.Response(200, json=mock_response))
 
-    responses.add(
-        responses.GET,
-        api_url,
-        json=mock_response,
-        status=200,
-    )
-
-    geolocation = fetch_geolocation_from_external_source(normalized_value)
+    geolocation = await fetch_geolocation_from_external_source(normalized_value)
 
     assert geolocation is None
 
 
-@responses.activate
-def test_fetch_geolocation_timeout(set_ip_stack_key):
+@pytest.mark.anyio
+async def test_fetch_geolocation_timeout(set_ip_stack_key, mock_ip_stack):
+    handlers, _ = mock_ip_stack
     normalized_value = "8.8.8.8"
-    api_url = IP_STACK_API_URL.format(search_value=normalized_value)
 
-    responses.add(
-        responses.GET,
-        api_url,
-        body=requests.exceptions.Timeout(),
+    def raise_timeout(request):
+        raise httpx.ReadTimeout("Timed out", request=request)
+
+    handlers.append(raise_timeout)
+
+    with pytest.raises(IpStackUnavailableException):
+        await fetch_geolocation_from_external_source(normalized_value)
+
+
+@pytest.mark.anyio
+async def test_ip_stack_http_client_configuration(monkeypatch):
+    monkeypatch.setenv("IP_STACK_TIMEOUT", "2")
+    monkeypatch.setenv("IP_STACK_CONNECT_TIMEOUT", "0.5")
+
+    http_client = create_ip_stack_http_client()
+
+    assert http_client.timeout.read == 2
+    assert http_client.timeout.connect == 0.5
+    await http_client.aclose()
+
+
+@pytest.mark.anyio
+async def test_ip_stack_client_reuses_http_client():
+    await ip_stack_client.start()
+    http_client = ip_stack_client.http_client
+    await ip_stack_client.start()
+
+    assert ip_stack_client.http_client is http_client
+
+    await ip_stack_client.close()
+    assert http_client.is_closed
+
+
+def test_ip_stack_client_lifecycle_tied_to_app():
+    with TestClient(app):
+        assert ip_stack_client._http_client is not None
+    assert ip_stack_client._http_client is None
+
+
+@pytest.mark.anyio
+async def test_concurrent_fetches_share_one_request(set_ip_stack_key, mock_ip_stack):
+    handlers, requests = mock_ip_stack
+
+    async def delayed_response(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=IP_STACK_RESPONSE)
+
+    handlers.append(delayed_response)
+    coalesced_before = ip_stack_single_flight.coalesced
+
+    geolocations = await asyncio.gather(
+        *[fetch_geolocation_from_external_source("8.8.8.8") for _ in range(3)]
     )
 
-    geolocation = fetch_geolocation_from_external_source(normalized_value)
+    assert [geolocation.ip for geolocation in geolocations] == ["8.8.8.8"] * 3
+    assert len(requests) == 1
+    assert ip_stack_single_flight.coalesced - coalesced_before == 2
 
-    assert geolocation is None
+
+@pytest.mark.anyio
+async def test_failing_ip_stack_is_not_called_while_circuit_is_open(
+    set_ip_stack_key, mock_ip_stack, monkeypatch
+):
+    handlers, requests = mock_ip_stack
+    handlers.append(lambda request: httpx.Response(503))
+    monkeypatch.setattr(ip_stack_circuit_breaker, "failure_threshold", 2)
+
+    for _ in range(2):
+        with pytest.raises(IpStackUnavailableException):
+            await fetch_geolocation_from_external_source("8.8.8.8")
+    with pytest.raises(IpStackCircuitOpenException):
+        await fetch_geolocation_from_external_source("8.8.8.8")
+
+    assert len(requests) == 2
+    assert ip_stack_circuit_breaker.stats()["state"] == "open"
+
+
+@pytest.mark.anyio
+async def test_response_without_geolocation_does_not_open_circuit(
+    set_ip_stack_key, mock_ip_stack, monkeypatch
+):
+    handlers, _ = mock_ip_stack
+    handlers.append(lambda request: httpx.Response(200, json={"ip": "10.0.0.1"}))
+    monkeypatch.setattr(ip_stack_circuit_breaker, "failure_threshold", 1)
+
+    for _ in range(2):
+        assert await fetch_geolocation_from_external_source("10.0.0.1") is None
+    assert ip_stack_circuit_breaker.stats()["state"] == "closed"
+
+
+@pytest.mark.anyio
+async def test_concurrent_ip_fetches_are_sent_in_one_bulk_request(
+    set_ip_stack_key, mock_ip_stack, monkeypatch
+):
+    handlers, requests = mock_ip_stack
+    monkeypatch.setattr(ip_stack_batcher, "max_batch_size", 50)
+
+    def bulk_response(request):
+        values = request.url.path.lstrip("/").split(",")
+        return httpx.Response(
+            200,
+            json=[
+                (
+                    {**IP_STACK_RESPONSE, "ip": value}
+                    if value != "10.0.0.1"
+                    else {"ip": value}
+                )
+                for value in values
+            ],
+        )
+
+    handlers.append(bulk_response)
+    values = ["8.8.8.8", "8.8.4.4", "10.0.0.1", "2001:4860:4860::8888"]
+
+    geolocations = await asyncio.gather(
+        *[fetch_geolocation_from_external_source(value) for value in values]
+    )
+
+    assert len(requests) == 1
+    assert requests[0].url.path == "/" + ",".join(values)
+    assert [geolocation and geolocation.ip for geolocation in geolocations] == [
+        "8.8.8.8",
+        "8.8.4.4",
+        None,
+        "2001:4860:4860::8888",
+    ]
+
+
+@pytest.mark.anyio
+async def test_bulk_results_are_matched_by_ip(
+    set_ip_stack_key, mock_ip_stack, monkeypatch
+):
+    handlers, _ = mock_ip_stack
+    monkeypatch.setattr(ip_stack_batcher, "max_batch_size", 50)
+    # results in other order than requested, without one of the values
+    handlers.append(
+        lambda request: httpx.Response(
+            200,
+            json=[
+                {**IP_STACK_RESPONSE, "ip": "8.8.4.4", "city": "Other"},
+                {**IP_STACK_RESPONSE, "ip": "8.8.8.8"},
+            ],
+        )
+    )
+
+    results = await asyncio.gather(
+        fetch_geolocation_from_external_source("8.8.8.8"),
+        fetch_geolocation_from_external_source("1.1.1.1"),
+        fetch_geolocation_from_external_source("8.8.4.4"),
+        return_exceptions=True,
+    )
+
+    assert results[0].city == "Mountain View"
+    assert isinstance(results[1], IpStackUnavailableException)
+    assert results[2].city == "Other"
+
+
+@pytest.mark.anyio
+async def test_batched_fetches_fail_together(
+    set_ip_stack_key, mock_ip_stack, monkeypatch
+):
+    handlers, requests = mock_ip_stack
+    monkeypatch.setattr(ip_stack_batcher, "max_batch_size", 50)
+    # e.g. plan without bulk lookups
+    handlers.append(
+        lambda request: httpx.Response(
+            200, json={"success": False, "error": {"code": 303}}
+        )
+    )
+
+    results = await asyncio.gather(
+        fetch_geolocation_from_external_source("8.8.8.8"),
+        fetch_geolocation_from_external_source("8.8.4.4"),
+        return_exceptions=True,
+    )
+
+    assert len(requests) == 1
+    assert all(isinstance(result, IpStackUnavailableException) for result in results)
+
+
+@pytest.mark.anyio
+async def test_urls_are_not_batched(set_ip_stack_key, mock_ip_stack, monkeypatch):
+    handlers, requests = mock_ip_stack
+    monkeypatch.setattr(ip_stack_batcher, "max_batch_size", 50)
+    handlers.append(lambda request: httpx.Response(200, json=IP_STACK_RESPONSE))
+
+    await asyncio.gather(
+        fetch_geolocation_from_external_source("example.com"),
+        fetch_geolocation_from_external_source("8.8.8.8"),
+    )
+
+    assert sorted(request.url.path for request in requests) == [
+        "/8.8.8.8",
+        "/example.com",
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "error",
+    [
+        {"code": 101, "type": "invalid_access_key"},
+        {"code": 104, "type": "usage_limit_reached"},
+    ],
+)
+async def test_fetch_geolocation_ip_stack_error(set_ip_stack_key, mock_ip_stack, error):
+    handlers, _ = mock_ip_stack
+    handlers.append(
+        lambda request: httpx.Response(200, json={"success": False, "error": error})
+    )
+
+    with pytest.raises(IpStackUnavailableException, match=str(error["code"])):
+        await fetch_geolocation_from_external_source("8.8.8.8")
+
+
+@pytest.mark.anyio
+async def test_fetch_geolocation_invalid_ip_error(set_ip_stack_key, mock_ip_stack):
+    handlers, _ = mock_ip_stack
+    handlers.append(
+        lambda request: httpx.Response(
+            200, json={"success": False, "error": {"code": 106, "type": "invalid_ip"}}
+        )
+    )
+
+    assert await fetch_geolocation_from_external_source("8.8.8.8") is None
+
+
+@pytest.mark.anyio
+async def test_ip_stack_error_responses_open_circuit(
+    set_ip_stack_key, mock_ip_stack, monkeypatch
+):
+    handlers, requests = mock_ip_stack
+    handlers.append(
+        lambda request: httpx.Response(
+            200,
+            json={"success": False, "error": {"code": 104, "type": "usage_limit"}},
+        )
+    )
+    monkeypatch.setattr(ip_stack_circuit_breaker, "failure_threshold", 2)
+
+    for _ in range(2):
+        with pytest.raises(IpStackUnavailableException):
+            await fetch_geolocation_from_external_source("8.8.8.8")
+    with pytest.raises(IpStackCircuitOpenException):
+        await fetch_geolocation_from_external_source("8.8.8.8")
+
+    assert len(requests) == 2
+    assert ip_stack_circuit_breaker.stats()["state"] == "open"
+
+
+@pytest.mark.parametrize("value, batch_size", [("20", 20), ("500", 50), ("0", 1)])
+def test_ip_stack_batch_size_is_limited(monkeypatch, value, batch_size):
+    monkeypatch.setenv("IP_STACK_BATCH_SIZE", value)
+    assert ip_stack_batch_size() == batch_size
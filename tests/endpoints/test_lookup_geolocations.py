@@ -0,0 +1,188 @@
+from unittest.mock import patch
+
+import pytest
+
+from src.models import IpGeolocation
+from src.validators import IpGeolocationModel
+
+EXTERNAL_GEOLOCATION_DATA = {
+    "ip": "8.8.8.8",
+    "type": "ipv4",
+    "continent_code": "NA",
+    "continent_name": "North America",
+    "country_code": "US",
+    "country_name": "United States",
+    "region_code": "CA",
+    "region_name": "California",
+    "city": "Mountain View",
+    "latitude": 37.3861,
+    "longitude": -122.0839,
+}
+
+
+@pytest.fixture
+def stored_geolocations(session):
+    session.add_all(
+        [
+            IpGeolocation(
+                ip="162.158.103.87",
+                type="ipv4",
+                continent_code="EU",
+                continent_name="Europe",
+                country_code="PL",
+                country_name="Poland",
+                region_code="MZ",
+                region_name="Mazovia",
+                city="Warsaw",
+                latitude=52.2317,
+                longitude=21.0183,
+            ),
+            IpGeolocation(
+                url="example.com",
+                continent_code="EU",
+                continent_name="Europe",
+                country_code="FR",
+                country_name="France",
+                region_code="HDF",
+                region_name="Hauts-de-France",
+                city="Roubaix",
+                latitude=50.6912,
+                longitude=3.1732,
+            ),
+        ]
+    )
+    session.commit()
+
+
+def test_lookup_geolocations_in_input_order(client, stored_geolocations):
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**EXTERNAL_GEOLOCATION_DATA),
+    ) as mock_fetch:
+        response = client.post(
+            "/geolocations/lookup",
+            json={
+                "values": [
+                    "https://example.com/path",
+                    "malformed_value",
+                    "8.8.8.8",
+                    "162.158.103.87",
+                ]
+            },
+        )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["value"] for result in results] == [
+        "https://example.com/path",
+        "malformed_value",
+        "8.8.8.8",
+        "162.158.103.87",
+    ]
+    assert results[0]["geolocation"]["city"] == "Roubaix"
+    assert results[1]["geolocation"] is None
+    assert results[1]["error"] == "Parameter must be Ipv4, Ipv6 or URL value"
+    assert results[2]["geolocation"]["city"] == "Mountain View"
+    assert results[3]["geolocation"]["city"] == "Warsaw"
+    # only the value missing in database is fetched from external source
+    mock_fetch.assert_called_once_with("8.8.8.8")
+
+
+def test_lookup_geolocations_fetches_duplicates_once(client, session):
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**EXTERNAL_GEOLOCATION_DATA),
+    ) as mock_fetch:
+        response = client.post(
+            "/geolocations/lookup", json={"values": ["8.8.8.8", "8.8.8.8"]}
+        )
+
+    assert response.status_code == 200
+    assert [result["geolocation"]["ip"] for result in response.json()] == [
+        "8.8.8.8",
+        "8.8.8.8",
+    ]
+    assert mock_fetch.call_count == 1
+
+
+def test_lookup_geolocations_not_found(client, session):
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ):
+        response = client.post("/geolocations/lookup", json={"values": ["10.0.0.1"]})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"value": "10.0.0.1", "geolocation": None, "error": "Geolocation not found"}
+    ]
+
+
+def test_lookup_geolocations_database_error(client):
+    with patch(
+        "src.api.v1.endpoints.geolocations.get_geolocations_from_db",
+        side_effect=RuntimeError("Database connection error"),
+    ), patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ):
+        response = client.post("/geolocations/lookup", json={"values": ["8.8.8.8"]})
+
+    assert response.status_code == 200
+    assert response.json()[0]["error"] == "Database connection error"
+
+
+@pytest.mark.parametrize("values", [[], ["8.8.8.8"] * 5001])
+def test_lookup_geolocations_invalid_number_of_values(client, values):
+    response = client.post("/geolocations/lookup", json={"values": values})
+    assert response.status_code == 422
+
+
+def test_lookup_geolocations_from_containing_network(client, session):
+    session.add(
+        IpGeolocation(
+            network="10.0.0.0/8",
+            continent_code="EU",
+            continent_name="Europe",
+            country_code="PL",
+            country_name="Poland",
+            region_code="MZ",
+            region_name="Mazovia",
+            city="Warsaw",
+            latitude=52.2317,
+            longitude=21.0183,
+        )
+    )
+    session.commit()
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ) as mock_fetch:
+        response = client.post(
+            "/geolocations/lookup", json={"values": ["10.1.2.3", "10.0.0.1"]}
+        )
+
+    assert [result["geolocation"]["network"] for result in response.json()] == [
+        "10.0.0.0/8",
+        "10.0.0.0/8",
+    ]
+    mock_fetch.assert_not_called()
+
+
+def test_lookup_skips_values_remembered_as_missing(client, stored_geolocations):
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ) as mock_fetch:
+        for _ in range(2):
+            response = client.post(
+                "/geolocations/lookup", json={"values": ["10.0.0.1", "example.com"]}
+            )
+            assert response.status_code == 200
+            assert [item["error"] for item in response.json()] == [
+                "Geolocation not found",
+                None,
+            ]
+
+    assert mock_fetch.call_count == 1
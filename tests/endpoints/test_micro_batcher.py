@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from src.api.v1.endpoints.micro_batcher import MicroBatcher
+
+
+def create_batcher(max_batch_size=10, flush_interval=0.01):
+    batches = []
+
+    async def func(keys):
+        batches.append(keys)
+        await asyncio.sleep(0.01)
+        return {key: key.upper() for key in keys if key != "missing"}
+
+    return MicroBatcher(func, max_batch_size, flush_interval), batches
+
+
+@pytest.mark.anyio
+async def test_concurrent_keys_are_resolved_with_one_batch():
+    batcher, batches = create_batcher()
+
+    results = await asyncio.gather(*[batcher.submit(key) for key in "abca"])
+
+    assert results == ["A", "B", "C", "A"]
+    assert batches == [["a", "b", "c"]]
+    assert batcher.stats() == {"pending": 0, "batches": 1, "keys": 3}
+
+
+@pytest.mark.anyio
+async def test_full_batch_is_flushed_before_interval():
+    batcher, batches = create_batcher(max_batch_size=2, flush_interval=10)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*[batcher.submit(key) for key in "abcd"]), timeout=1
+    )
+
+    assert results == ["A", "B", "C", "D"]
+    assert batches == [["a", "b"], ["c", "d"]]
+
+
+@pytest.mark.anyio
+async def test_batch_exception_is_raised_to_every_caller():
+    async def func(keys):
+        raise RuntimeError("Upstream error")
+
+    batcher = MicroBatcher(func, max_batch_size=10, flush_interval=0.01)
+
+    results = await asyncio.gather(
+        batcher.submit("a"), batcher.submit("b"), return_exceptions=True
+    )
+
+    assert [str(result) for result in results] == ["Upstream error"] * 2
+
+
+@pytest.mark.anyio
+async def test_key_missing_in_batch_results():
+    batcher, _ = create_batcher()
+
+    results = await asyncio.gather(
+        batcher.submit("a"), batcher.submit("missing"), return_exceptions=True
+    )
+
+    assert results[0] == "A"
+    assert isinstance(results[1], KeyError)
+
+
+@pytest.mark.anyio
+async def test_cancelled_caller_does_not_cancel_batch():
+    batcher, _ = create_batcher()
+
+    cancelled = asyncio.ensure_future(batcher.submit("a"))
+    other = asyncio.ensure_future(batcher.submit("a"))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert await other == "A"
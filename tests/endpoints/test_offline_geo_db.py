@@ -0,0 +1,191 @@
+import csv
+from unittest.mock import patch
+
+import pytest
+
+from src.api.v1.endpoints.offline_geo_db import (
+    OfflineGeoDatabase,
+    OfflineGeoDatabaseException,
+    build_offline_geo_database,
+)
+
+FIELDS = [
+    "network",
+    "start_ip",
+    "end_ip",
+    "continent_code",
+    "continent_name",
+    "country_code",
+    "country_name",
+    "region_code",
+    "region_name",
+    "city",
+    "latitude",
+    "longitude",
+]
+POLAND = {
+    "continent_code": "EU",
+    "continent_name": "Europe",
+    "country_code": "PL",
+    "country_name": "Poland",
+    "region_code": "MZ",
+    "region_name": "Mazovia",
+    "city": "Warsaw",
+    "latitude": "52.2317",
+    "longitude": "21.0183",
+}
+USA = {
+    "continent_code": "NA",
+    "continent_name": "North America",
+    "country_code": "US",
+    "country_name": "United States",
+    "region_code": "CA",
+    "region_name": "California",
+    "city": "Mountain View",
+    "latitude": "37.386",
+    "longitude": "-122.0838",
+}
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def offline_database(tmp_path):
+    csv_path = tmp_path / "ranges.csv"
+    write_csv(
+        csv_path,
+        [
+            {"network": "8.8.8.0/24", **USA},
+            {"start_ip": "1.0.0.0", "end_ip": "1.0.0.255", **POLAND},
+            {"network": "160.158.0.0/16", **POLAND},
+            {"network": "2001:db8::/32", **POLAND},
+        ],
+    )
+    database_path = tmp_path / "geo.db"
+    stats = build_offline_geo_database(str(csv_path), str(database_path))
+    assert stats == {"ipv4_ranges": 3, "ipv6_ranges": 1, "records": 2}
+
+    database = OfflineGeoDatabase(str(database_path))
+    yield database
+    database.close()
+
+
+@pytest.mark.parametrize(
+    "ip, city",
+    [
+        ("1.0.0.0", "Warsaw"),
+        ("1.0.0.255", "Warsaw"),
+        ("1.0.1.0", None),
+        ("0.255.255.255", None),
+        ("8.8.8.8", "Mountain View"),
+        ("160.158.103.87", "Warsaw"),
+        ("255.255.255.255", None),
+        ("2001:db8:85a3::8a2e:370:7334", "Warsaw"),
+        ("2001:db9::1", None),
+        ("::1", None),
+    ],
+)
+def test_find_record(offline_database, ip, city):
+    record = offline_database.find_record(ip)
+    assert (record["city"] if record else None) == city
+
+
+def test_find_geolocation(offline_database):
+    geolocation = offline_database.find_geolocation("2001:db8::1")
+
+    assert geolocation.ip == "2001:db8::1"
+    assert geolocation.type == "ipv6"
+    assert geolocation.latitude == 52.2317
+
+
+def test_build_rejects_overlapping_ranges(tmp_path):
+    csv_path = tmp_path / "ranges.csv"
+    write_csv(
+        csv_path,
+        [
+            {"network": "8.8.0.0/16", **USA},
+            {"start_ip": "8.8.8.0", "end_ip": "8.9.0.0", **USA},
+        ],
+    )
+
+    with pytest.raises(OfflineGeoDatabaseException, match="Overlapping IPv4"):
+        build_offline_geo_database(str(csv_path), str(tmp_path / "geo.db"))
+
+
+def test_build_rejects_invalid_row(tmp_path):
+    csv_path = tmp_path / "ranges.csv"
+    write_csv(csv_path, [{"network": "8.8.8.0/24", **USA, "latitude": "123"}])
+
+    with pytest.raises(OfflineGeoDatabaseException, match="Line 2"):
+        build_offline_geo_database(str(csv_path), str(tmp_path / "geo.db"))
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "geo.db"
+    path.write_bytes(b"not a database file")
+
+    with pytest.raises(OfflineGeoDatabaseException):
+        OfflineGeoDatabase(str(path))
+
+
+@pytest.mark.parametrize("mode", ["before", "instead"])
+def test_get_geolocation_from_offline_database(
+    mock_db_session, client, offline_database, mode, monkeypatch
+):
+    mock_db_session.return_value = None
+    monkeypatch.setenv("OFFLINE_GEO_DB_MODE", mode)
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.offline_geo_database", offline_database
+    ), patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ) as fetch_geolocation:
+        response = client.get("/geolocations/8.8.8.8")
+        assert response.status_code == 200
+        assert response.json()["city"] == "Mountain View"
+        fetch_geolocation.assert_not_called()
+
+        response = client.get("/geolocations/9.9.9.9")
+        assert response.status_code == 404
+        assert fetch_geolocation.called == (mode == "before")
+
+
+def test_get_geolocation_from_offline_database_on_database_error(
+    mock_db_session, client, offline_database
+):
+    mock_db_session.side_effect = RuntimeError("Database connection error")
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.offline_geo_database", offline_database
+    ):
+        response = client.get("/geolocations/160.158.103.87")
+    assert response.status_code == 200
+    assert response.json()["country_name"] == "Poland"
+
+
+def test_lookup_geolocations_offline_only(
+    client, offline_database, session, monkeypatch
+):
+    monkeypatch.setenv("OFFLINE_GEO_DB_MODE", "instead")
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.offline_geo_database", offline_database
+    ), patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+    ) as fetch_geolocation:
+        response = client.post(
+            "/geolocations/lookup",
+            json={"values": ["1.0.0.1", "9.9.9.9", "example.com"]},
+        )
+    fetch_geolocation.assert_not_called()
+    assert response.status_code == 200
+    results = response.json()
+    assert results[0]["geolocation"]["city"] == "Warsaw"
+    assert results[1]["error"] == "Geolocation not found"
+    assert results[2]["error"] == "Geolocation not found"
@@ -1,5 +1,6 @@
 import pytest
 
+from src.api.v1.endpoints.cache import geolocation_cache
 from src.models import IpGeolocation, Language, Location
 
 
@@ -56,6 +57,19 @@ def test_post_ip_geolocation_duplicate_ip(client, session, sample_ip_geolocation
     assert response.status_code == 400
 
 
+def test_post_ip_geolocation_duplicate_url(client, session, sample_ip_geolocation):
+    sample_ip_geolocation["url"] = "example.com"
+    response = client.post("/geolocations", json=sample_ip_geolocation)
+    assert response.status_code == 201
+
+    sample_ip_geolocation["ip"] = "192.168.1.2"
+    response = client.post("/geolocations", json=sample_ip_geolocation)
+    assert response.status_code == 400
+    assert response.json()["detail"] == (
+        "An entry with the same IP or URL already exists."
+    )
+
+
 def test_post_ip_geolocation_invalid_data(client, session):
     invalid_data = {
         "ip": "192.168.1.1",
@@ -84,3 +98,12 @@ def test_post_ip_geolocation_missing_location(client, session, sample_ip_geoloca
 
     assert data["ip"] == "192.168.1.1"
     assert data["location"] is None
+
+
+def test_post_ip_geolocation_invalidates_cache(client, session, sample_ip_geolocation):
+    geolocation_cache.set(("192.168.1.1", "ip"), "stale geolocation")
+
+    response = client.post("/geolocations", json=sample_ip_geolocation)
+    assert response.status_code == 201
+
+    assert geolocation_cache.get(("192.168.1.1", "ip")) is None
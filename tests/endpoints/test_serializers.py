@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from src.api.v1.endpoints.serializers import (
+    decode_compact_geolocation,
+    encode_compact_geolocation,
+    json_response,
+    serialize_geolocation,
+)
+from src.models import IpGeolocation, Language, Location
+from src.validators import IpGeolocationModel
+
+
+@pytest.mark.parametrize(
+    "location",
+    [
+        None,
+        Location(
+            geoname_id=756135,
+            capital="Warsaw",
+            country_flag="https://assets.ipstack.com/flags/pl.svg",
+            country_flag_emoji="🇵🇱",
+            country_flag_emoji_unicode="U+1F1F5 U+1F1F1",
+            calling_code="48",
+            is_eu=True,
+            languages=[],
+        ),
+        Location(
+            geoname_id=756135,
+            capital="Warsaw",
+            country_flag="https://assets.ipstack.com/flags/pl.svg",
+            country_flag_emoji="🇵🇱",
+            country_flag_emoji_unicode="U+1F1F5 U+1F1F1",
+            calling_code="48",
+            is_eu=True,
+            languages=[
+                Language(code="pl", name="Polish", native="Polski"),
+                Language(code="de", name="German", native="Deutsch"),
+            ],
+        ),
+    ],
+)
+def test_serialize_geolocation_matches_response_model(location):
+    geolocation = IpGeolocation(
+        id=123,
+        ip="162.158.103.87",
+        type="ipv4",
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        zip="00-025",
+        latitude=52.2317,
+        longitude=21.0183,
+        location=location,
+    )
+
+    expected = IpGeolocationModel(**geolocation.as_dict()).model_dump(mode="json")
+
+    assert serialize_geolocation(geolocation) == expected
+    assert list(serialize_geolocation(geolocation)) == list(expected)
+
+
+def test_json_response():
+    response = json_response({"city": "Kraków", "latitude": 50.0647})
+
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == {"city": "Kraków", "latitude": 50.0647}
+
+
+@pytest.mark.parametrize("languages", [None, [], [("pl", "Polish", "Polski")]])
+def test_compact_geolocation_round_trip(languages):
+    location = None
+    if languages is not None:
+        location = Location(
+            geoname_id=756135,
+            capital="Warsaw",
+            calling_code="48",
+            is_eu=True,
+            languages=[
+                Language(code=code, name=name, native=native)
+                for code, name, native in languages
+            ],
+        )
+    geolocation = IpGeolocation(
+        id=123,
+        ip="162.158.103.87",
+        type="ipv4",
+        country_name="Poland",
+        city="Kraków",
+        latitude=50.0647,
+        longitude=19.945,
+        location=location,
+    )
+    payload = serialize_geolocation(geolocation)
+
+    data = encode_compact_geolocation(payload)
+
+    assert b"null" not in data
+    assert decode_compact_geolocation(data) == payload
+    assert list(decode_compact_geolocation(data)) == list(payload)
@@ -1,12 +1,24 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import event, func, select
+
 from src.api.v1.endpoints.services import (
-    check_geolocation_exists_in_db,
+    DuplicateGeolocationException,
     get_geolocation_from_db,
+    get_geolocations_from_db,
+    get_network_geolocations_from_db,
+    insert_missing_rows,
+    refresh_geolocation_in_db,
+    save_geolocation_in_db,
 )
-from src.models import IpGeolocation
+from src.models import IpGeolocation, Language, Location
 from src.validators import IpGeolocationModel
 
 
-def test_get_geolocation_from_db_ip(session):
+@pytest.mark.anyio
+async def test_get_geolocation_from_db_ip(session, async_session):
     geolocation = IpGeolocation(
         ip="162.158.103.87",
         type="ipv4",
@@ -24,13 +36,37 @@ def test_get_geolocation_from_db_ip(session):
     session.add(geolocation)
     session.commit()
 
-    result = get_geolocation_from_db("162.158.103.87", "ip", session)
+    result = await get_geolocation_from_db("162.158.103.87", "ip", async_session)
     assert result is not None
     assert result.ip == "162.158.103.87"
     assert result.country_name == "Poland"
 
 
-def test_get_geolocation_from_db_url(session):
+@pytest.mark.anyio
+async def test_get_geolocation_from_db_ip_stored_as_inet(session, async_session):
+    geolocation = IpGeolocation(
+        ip="2001:0db8:0000:0000:0000:0000:0000:0001",
+        type="ipv6",
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        latitude=52.2317,
+        longitude=21.0183,
+    )
+    session.add(geolocation)
+    session.commit()
+
+    result = await get_geolocation_from_db("2001:db8::1", "ip", async_session)
+    assert result is not None
+    assert result.ip == "2001:db8::1"
+
+
+@pytest.mark.anyio
+async def test_get_geolocation_from_db_url(session, async_session):
     geolocation = IpGeolocation(
         ip=None,
         type="url",
@@ -48,156 +84,406 @@ def test_get_geolocation_from_db_url(session):
     session.add(geolocation)
     session.commit()
 
-    result = get_geolocation_from_db("example.com", "url", session)
+    result = await get_geolocation_from_db("example.com", "url", async_session)
     assert result is not None
     assert result.url == "example.com"
     assert result.country_name == "Poland"
 
 
-def test_get_geolocation_from_db_not_found(session):
-    result = get_geolocation_from_db("nonexistent.com", "url", session)
+@pytest.mark.anyio
+async def test_get_geolocation_from_db_not_found(async_session):
+    result = await get_geolocation_from_db("nonexistent.com", "url", async_session)
     assert result is None
 
 
-def test_geolocation_exists_with_matching_ip_and_url(session):
-    session.add(
-        IpGeolocation(
-            ip="192.168.1.1",
-            url="example.com",
-            continent_code="NA",
-            continent_name="North America",
-            country_code="US",
-            country_name="United States",
-            region_code="CA",
-            region_name="California",
-            city="Los Angeles",
-            latitude=34.0522,
-            longitude=-118.2437,
-        )
+@pytest.mark.anyio
+async def test_get_geolocations_from_db(session, async_session):
+    session.add_all(
+        [
+            IpGeolocation(
+                ip=ip,
+                continent_code="EU",
+                continent_name="Europe",
+                country_code="PL",
+                country_name="Poland",
+                region_code="MZ",
+                region_name="Mazovia",
+                city="Warsaw",
+                latitude=52.2317,
+                longitude=21.0183,
+            )
+            for ip in ("162.158.103.87", "162.158.103.88")
+        ]
     )
     session.commit()
 
-    geolocation = IpGeolocationModel(
-        ip="192.168.1.1",
-        url="example.com",
-        continent_code="NA",
-        continent_name="North America",
-        country_code="US",
-        country_name="United States",
-        region_code="CA",
-        region_name="California",
-        city="Los Angeles",
-        latitude=34.0522,
-        longitude=-118.2437,
+    result = await get_geolocations_from_db(
+        ["162.158.103.87", "162.158.103.88", "10.0.0.1"], "ip", async_session
     )
+    assert sorted(geolocation.ip for geolocation in result) == [
+        "162.158.103.87",
+        "162.158.103.88",
+    ]
+    assert await get_geolocations_from_db(["example.com"], "url", async_session) == []
 
-    result = check_geolocation_exists_in_db(geolocation, session)
-    assert result is True
 
+def network_geolocation(network, city):
+    return IpGeolocation(
+        network=network,
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city=city,
+        latitude=52.2317,
+        longitude=21.0183,
+    )
+
+
+@pytest.mark.anyio
+async def test_get_geolocation_from_db_most_specific_network(session, async_session):
+    session.add_all(
+        [
+            network_geolocation("162.158.0.0/16", "Warsaw"),
+            network_geolocation("162.158.103.0/24", "Krakow"),
+            network_geolocation("2001:db8::/32", "Gdansk"),
+        ]
+    )
+    session.commit()
+
+    assert (
+        await get_geolocation_from_db("162.158.103.87", "ip", async_session)
+    ).city == "Krakow"
+    assert (
+        await get_geolocation_from_db("162.158.1.1", "ip", async_session)
+    ).city == "Warsaw"
+    assert (
+        await get_geolocation_from_db("2001:db8::1", "ip", async_session)
+    ).city == "Gdansk"
+    assert await get_geolocation_from_db("10.0.0.1", "ip", async_session) is None
+    assert (
+        await get_geolocation_from_db(
+            "162.158.1.1", "ip", async_session, match_networks=False
+        )
+        is None
+    )
 
-def test_geolocation_not_exists_with_different_ip_and_url(session):
+
+@pytest.mark.anyio
+async def test_get_geolocation_from_db_prefers_exact_ip(session, async_session):
+    session.add(network_geolocation("162.158.103.0/24", "Krakow"))
     session.add(
         IpGeolocation(
-            ip="192.168.1.2",
-            url="other.com",
-            continent_code="NA",
-            continent_name="North America",
-            country_code="US",
-            country_name="United States",
-            region_code="CA",
-            region_name="California",
-            city="Los Angeles",
-            latitude=34.0522,
-            longitude=-118.2437,
+            ip="162.158.103.87",
+            continent_code="EU",
+            continent_name="Europe",
+            country_code="PL",
+            country_name="Poland",
+            region_code="MZ",
+            region_name="Mazovia",
+            city="Warsaw",
+            latitude=52.2317,
+            longitude=21.0183,
         )
     )
     session.commit()
 
-    geolocation = IpGeolocationModel(
-        ip="192.168.1.1",
-        url="example.com",
-        continent_code="NA",
-        continent_name="North America",
-        country_code="US",
-        country_name="United States",
-        region_code="CA",
-        region_name="California",
-        city="Los Angeles",
-        latitude=34.0522,
-        longitude=-118.2437,
+    assert (
+        await get_geolocation_from_db("162.158.103.87", "ip", async_session)
+    ).city == "Warsaw"
+
+
+@pytest.mark.anyio
+async def test_get_network_geolocations_from_db(session, async_session):
+    session.add_all(
+        [
+            network_geolocation("162.158.0.0/16", "Warsaw"),
+            network_geolocation("162.158.103.0/24", "Krakow"),
+        ]
     )
+    session.commit()
 
-    result = check_geolocation_exists_in_db(geolocation, session)
-    assert result is False
+    result = await get_network_geolocations_from_db(
+        ["162.158.103.87", "162.158.1.1", "10.0.0.1"], async_session
+    )
+    assert {ip: geolocation.city for ip, geolocation in result.items()} == {
+        "162.158.103.87": "Krakow",
+        "162.158.1.1": "Warsaw",
+    }
 
 
-def test_geolocation_exists_with_null_ip_or_url(session):
-    session.add(
-        IpGeolocation(
-            ip=None,
-            url="example.com",
-            continent_code="NA",
-            continent_name="North America",
-            country_code="US",
-            country_name="United States",
-            region_code="CA",
-            region_name="California",
-            city="Los Angeles",
-            latitude=34.0522,
-            longitude=-118.2437,
+@pytest.fixture
+async def executed_statements(async_session):
+    # connects first, so that dialect initialization queries are not counted
+    await async_session.connection()
+    engine = async_session.bind.sync_engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def geolocations_with_languages(session):
+    location = Location(
+        geoname_id=756135,
+        capital="Warsaw",
+        country_flag="https://assets.ipstack.com/flags/pl.svg",
+        country_flag_emoji="🇵🇱",
+        country_flag_emoji_unicode="U+1F1F5 U+1F1F1",
+        calling_code="48",
+        is_eu=True,
+        languages=[
+            Language(code="pl", name="Polish", native="Polski"),
+            Language(code="de", name="German", native="Deutsch"),
+        ],
+    )
+    for ip, network in (("162.158.103.87", None), (None, "10.0.0.0/8")):
+        session.add(
+            IpGeolocation(
+                ip=ip,
+                network=network,
+                continent_code="EU",
+                continent_name="Europe",
+                country_code="PL",
+                country_name="Poland",
+                region_code="MZ",
+                region_name="Mazovia",
+                city="Warsaw",
+                latitude=52.2317,
+                longitude=21.0183,
+                location=location,
+            )
         )
+    session.commit()
+    session.expunge_all()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "loading_strategy,expected_statements",
+    [("joined", 1), ("selectin", 2)],
+)
+async def test_get_geolocation_from_db_statement_count(
+    async_session,
+    geolocations_with_languages,
+    executed_statements,
+    monkeypatch,
+    loading_strategy,
+    expected_statements,
+):
+    monkeypatch.setenv("GEOLOCATION_LOADING_STRATEGY", loading_strategy)
+
+    geolocation = await get_geolocation_from_db("162.158.103.87", "ip", async_session)
+    data = geolocation.as_dict()
+
+    assert len(data["location"]["languages"]) == 2
+    assert len(executed_statements) == expected_statements
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "loading_strategy,expected_statements", [("joined", 1), ("selectin", 2)]
+)
+async def test_get_network_geolocations_from_db_statement_count(
+    async_session,
+    geolocations_with_languages,
+    executed_statements,
+    monkeypatch,
+    loading_strategy,
+    expected_statements,
+):
+    monkeypatch.setenv("GEOLOCATION_LOADING_STRATEGY", loading_strategy)
+
+    result = await get_network_geolocations_from_db(
+        ["10.0.0.1", "10.0.0.2"], async_session
     )
+    data = [geolocation.as_dict() for geolocation in result.values()]
+
+    assert [len(item["location"]["languages"]) for item in data] == [2, 2]
+    assert len(executed_statements) == expected_statements
+
+
+def geolocation_with_location(ip, languages):
+    return IpGeolocationModel(
+        ip=ip,
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        latitude=52.2317,
+        longitude=21.0183,
+        location={
+            "geoname_id": 756135,
+            "capital": "Warsaw",
+            "country_flag": "https://assets.ipstack.com/flags/pl.svg",
+            "country_flag_emoji": "🇵🇱",
+            "country_flag_emoji_unicode": "U+1F1F5 U+1F1F1",
+            "calling_code": "48",
+            "is_eu": True,
+            "languages": languages,
+        },
+    )
+
+
+@pytest.mark.anyio
+async def test_save_geolocation_in_db_reuses_languages_and_location(
+    session, async_session
+):
+    session.add(Language(code="pl", name="Polish", native="Polski"))
     session.commit()
+    languages = [
+        {"code": "pl", "name": "Polish", "native": "Polski"},
+        {"code": "de", "name": "German", "native": "Deutsch"},
+    ]
 
-    geolocation = IpGeolocationModel(
-        ip=None,
-        url="example.com",
-        continent_code="NA",
-        continent_name="North America",
-        country_code="US",
-        country_name="United States",
-        region_code="CA",
-        region_name="California",
-        city="Los Angeles",
-        latitude=34.0522,
-        longitude=-118.2437,
+    first = await save_geolocation_in_db(
+        geolocation_with_location("162.158.103.87", languages), async_session
+    )
+    second = await save_geolocation_in_db(
+        geolocation_with_location("162.158.103.88", languages[:1]), async_session
     )
 
-    result = check_geolocation_exists_in_db(geolocation, session)
-    assert result is True
+    assert first.location_id == second.location_id
+    # languages of existing location are kept
+    assert [
+        language["code"] for language in second.as_dict()["location"]["languages"]
+    ] == ["pl", "de"]
+    assert await async_session.scalar(select(func.count(Language.id))) == 2
+    assert await async_session.scalar(select(func.count(Location.id))) == 1
 
 
-def test_geolocation_not_exists_with_null_ip_or_url(session):
-    session.add(
-        IpGeolocation(
-            ip=None,
-            url="example.com",
-            continent_code="NA",
-            continent_name="North America",
-            country_code="US",
-            country_name="United States",
-            region_code="CA",
-            region_name="California",
-            city="Los Angeles",
-            latitude=34.0522,
-            longitude=-118.2437,
+@pytest.mark.anyio
+async def test_save_geolocation_in_db_concurrently(session, async_session_factory):
+    languages = [
+        {"code": "pl", "name": "Polish", "native": "Polski"},
+        {"code": "de", "name": "German", "native": "Deutsch"},
+    ]
+
+    async def save(ip):
+        async with async_session_factory() as db:
+            return await save_geolocation_in_db(
+                geolocation_with_location(ip, languages), db
+            )
+
+    saved = await asyncio.gather(*[save(f"162.158.103.{i}") for i in range(5)])
+
+    assert len({geolocation.location_id for geolocation in saved}) == 1
+    assert session.scalar(select(func.count(Language.id))) == 2
+    assert session.scalar(select(func.count(Location.id))) == 1
+    for geolocation in saved:
+        assert len(geolocation.as_dict()["location"]["languages"]) == 2
+
+
+@pytest.mark.anyio
+async def test_save_geolocation_in_db_statement_count(
+    async_session, executed_statements
+):
+    languages = [
+        {"code": "pl", "name": "Polish", "native": "Polski"},
+        {"code": "de", "name": "German", "native": "Deutsch"},
+    ]
+
+    await save_geolocation_in_db(
+        geolocation_with_location("162.158.103.87", languages), async_session
+    )
+
+    # languages upsert, location upsert, its languages, geolocation and read back
+    assert len([s for s in executed_statements if "INSERT" in s]) == 4
+    assert len(executed_statements) == 5
+
+
+@pytest.mark.anyio
+async def test_save_geolocation_in_db_duplicate(session, async_session):
+    languages = [{"code": "pl", "name": "Polish", "native": "Polski"}]
+    await save_geolocation_in_db(
+        geolocation_with_location("162.158.103.87", languages), async_session
+    )
+
+    with pytest.raises(DuplicateGeolocationException):
+        await save_geolocation_in_db(
+            geolocation_with_location("162.158.103.87", languages), async_session
         )
+    assert session.scalar(select(func.count(IpGeolocation.id))) == 1
+
+
+@pytest.mark.anyio
+async def test_save_geolocation_in_db_same_ip_concurrently(
+    session, async_session_factory
+):
+    async def save():
+        async with async_session_factory() as db:
+            return await save_geolocation_in_db(
+                geolocation_with_location("162.158.103.87", []), db
+            )
+
+    results = await asyncio.gather(*[save() for _ in range(5)], return_exceptions=True)
+
+    assert len([r for r in results if isinstance(r, IpGeolocation)]) == 1
+    assert all(
+        isinstance(r, (IpGeolocation, DuplicateGeolocationException)) for r in results
+    )
+    assert session.scalar(select(func.count(IpGeolocation.id))) == 1
+
+
+@pytest.mark.anyio
+async def test_refresh_geolocation_in_db_keeps_ip_and_url(session, async_session):
+    geolocation = IpGeolocation(
+        ip="162.158.103.87",
+        url="example.com",
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        latitude=52.2317,
+        longitude=21.0183,
     )
+    session.add(geolocation)
     session.commit()
+    fetched_at = datetime.now(timezone.utc)
 
-    geolocation = IpGeolocationModel(
-        ip=None,
-        url="notfound.com",
-        continent_code="NA",
-        continent_name="North America",
-        country_code="US",
-        country_name="United States",
-        region_code="CA",
-        region_name="California",
-        city="Los Angeles",
-        latitude=34.0522,
-        longitude=-118.2437,
-    )
-
-    result = check_geolocation_exists_in_db(geolocation, session)
-    assert result is False
+    await refresh_geolocation_in_db(
+        geolocation.id,
+        geolocation_with_location(
+            "162.158.103.88", [{"code": "pl", "name": "Polish", "native": "Polski"}]
+        ).model_copy(update={"city": "Krakow"}),
+        async_session,
+        fetched_at=fetched_at,
+    )
+
+    session.refresh(geolocation)
+    assert geolocation.ip == "162.158.103.87"
+    assert geolocation.url == "example.com"
+    assert geolocation.city == "Krakow"
+    assert geolocation.location.geoname_id == 756135
+    assert geolocation.fetched_at == fetched_at
+
+
+@pytest.mark.anyio
+async def test_insert_missing_rows_above_bind_parameter_limit(session, async_session):
+    # a single statement of so many rows would exceed 32767 bind parameters
+    rows = [
+        {"code": f"l{number}", "name": f"Language {number}", "native": "Native"}
+        for number in range(10000)
+    ]
+
+    ids = await insert_missing_rows(Language, "code", rows, async_session)
+    await async_session.commit()
+    assert len(ids) == 10000
+    assert all(inserted for _, inserted in ids.values())
+
+    stored_ids = await insert_missing_rows(Language, "code", rows, async_session)
+    assert stored_ids == {code: (row_id, False) for code, (row_id, _) in ids.items()}
+    assert session.query(Language).count() == 10000
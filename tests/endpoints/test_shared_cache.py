@@ -0,0 +1,234 @@
+from unittest.mock import patch
+
+import pytest
+
+from src.api.v1.endpoints.cache import geolocation_cache
+from src.api.v1.endpoints.shared_cache import (
+    InMemorySharedCache,
+    RedisSharedCache,
+    SharedCache,
+    create_shared_cache,
+    get_shared_cached_geolocation,
+    invalidate_shared_cached_geolocations,
+    set_shared_cached_geolocation,
+    shared_cache_key,
+)
+from src.models import IpGeolocation
+
+
+class FakeRedisClient:
+    """
+    Implements the subset of redis.asyncio.Redis used by RedisSharedCache.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.entries = {}
+
+    async def get(self, key):
+        if self.fail:
+            raise ConnectionError("Redis unavailable")
+        return self.entries.get(key)
+
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("Redis unavailable")
+        self.entries[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    async def scan_iter(self, match):
+        for key in list(self.entries):
+            if key.startswith(match.rstrip("*")):
+                yield key
+
+    async def aclose(self):
+        pass
+
+
+GEOLOCATION_DATA = {
+    "continent_code": "NA",
+    "continent_name": "North America",
+    "country_code": "US",
+    "country_name": "United States",
+    "region_code": "CA",
+    "region_name": "California",
+    "city": "Mountain View",
+    "latitude": 37.386,
+    "longitude": -122.0838,
+}
+
+
+@pytest.fixture
+def shared_cache():
+    cache = InMemorySharedCache()
+    with patch("src.api.v1.endpoints.shared_cache.shared_geolocation_cache", cache):
+        yield cache
+
+
+@pytest.fixture
+def sample_geolocation(session):
+    geolocation = IpGeolocation(
+        ip="162.158.103.87",
+        type="ipv4",
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        latitude=52.2317,
+        longitude=21.0183,
+    )
+    session.add(geolocation)
+    session.commit()
+    return geolocation
+
+
+def test_create_shared_cache():
+    assert create_shared_cache(None) is None
+    assert isinstance(create_shared_cache("memory://"), InMemorySharedCache)
+    assert isinstance(create_shared_cache("redis://localhost:6379/0"), RedisSharedCache)
+
+
+def test_shared_cache_backends_must_implement_storage():
+    with pytest.raises(TypeError):
+        SharedCache()
+
+
+@pytest.mark.anyio
+async def test_in_memory_shared_cache_evicts_least_recently_used():
+    cache = InMemorySharedCache(max_size=2)
+
+    await cache.set("geolocation:ip:1.1.1.1", b"a", ttl=60)
+    await cache.set("geolocation:ip:8.8.8.8", b"b", ttl=60)
+    assert await cache.get("geolocation:ip:1.1.1.1") == b"a"
+    await cache.set("geolocation:ip:9.9.9.9", b"c", ttl=60)
+
+    assert await cache.get("geolocation:ip:8.8.8.8") is None
+    assert await cache.get("geolocation:ip:1.1.1.1") == b"a"
+    assert await cache.get("geolocation:ip:9.9.9.9") == b"c"
+    assert cache.evictions == 1
+
+
+@pytest.mark.anyio
+async def test_in_memory_shared_cache():
+    cache = InMemorySharedCache()
+
+    await cache.set("geolocation:ip:1.1.1.1", b"a", ttl=60)
+    await cache.set("geolocation:ip:8.8.8.8", b"b", ttl=0)
+    await cache.set("geolocation:url:example.com", b"c", ttl=60)
+
+    assert await cache.get("geolocation:ip:1.1.1.1") == b"a"
+    # expired entry
+    assert await cache.get("geolocation:ip:8.8.8.8") is None
+
+    await cache.clear("geolocation:ip:")
+    assert await cache.get("geolocation:ip:1.1.1.1") is None
+    assert await cache.get("geolocation:url:example.com") == b"c"
+
+    await cache.delete(["geolocation:url:example.com"])
+    assert await cache.get("geolocation:url:example.com") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+
+
+@pytest.mark.anyio
+async def test_redis_shared_cache():
+    client = FakeRedisClient()
+    cache = RedisSharedCache("redis://localhost", client=client)
+
+    await cache.set("geolocation:ip:1.1.1.1", b"a", ttl=60)
+    await cache.set("geolocation:url:example.com", b"c", ttl=60)
+    assert await cache.get("geolocation:ip:1.1.1.1") == b"a"
+
+    await cache.clear("geolocation:ip:")
+    assert list(client.entries) == ["geolocation:url:example.com"]
+
+
+@pytest.mark.anyio
+async def test_redis_shared_cache_errors_are_misses():
+    cache = RedisSharedCache("redis://localhost", client=FakeRedisClient(fail=True))
+
+    await cache.set("geolocation:ip:1.1.1.1", b"a", ttl=60)
+    assert await cache.get("geolocation:ip:1.1.1.1") is None
+    assert cache.stats()["errors"] == 2
+
+
+@pytest.mark.anyio
+async def test_shared_cached_geolocation_disabled():
+    with patch("src.api.v1.endpoints.shared_cache.shared_geolocation_cache", None):
+        await set_shared_cached_geolocation("1.1.1.1", "ip", {"ip": "1.1.1.1"})
+        assert await get_shared_cached_geolocation("1.1.1.1", "ip") is None
+
+
+def test_get_geolocation_stores_in_shared_cache(
+    client, shared_cache, sample_geolocation
+):
+    response = client.get("/geolocations/162.158.103.87")
+    assert response.status_code == 200
+
+    # another worker has an empty local cache, but finds geolocation shared
+    geolocation_cache.clear()
+    with patch(
+        "src.api.v1.endpoints.geolocations.get_geolocation_from_db"
+    ) as get_geolocation_from_db:
+        shared_response = client.get("/geolocations/162.158.103.87")
+    get_geolocation_from_db.assert_not_called()
+    assert shared_response.status_code == 200
+    assert shared_response.json() == response.json()
+
+
+def test_create_geolocation_invalidates_shared_cache(client, shared_cache):
+    key = shared_cache_key("8.8.8.8", "ip")
+    shared_cache._entries[key] = (float("inf"), b'{"ip":"8.8.8.8"}')
+
+    response = client.post(
+        "/geolocations",
+        json={**GEOLOCATION_DATA, "ip": "8.8.8.8", "type": "ipv4"},
+    )
+    assert response.status_code == 201
+    assert key not in shared_cache._entries
+
+
+def test_create_network_geolocation_clears_shared_ip_entries(client, shared_cache):
+    ip_key = shared_cache_key("8.8.8.8", "ip")
+    url_key = shared_cache_key("example.com", "url")
+    shared_cache._entries[ip_key] = (float("inf"), b"{}")
+    shared_cache._entries[url_key] = (float("inf"), b"{}")
+
+    response = client.post(
+        "/geolocations",
+        json={**GEOLOCATION_DATA, "network": "8.8.0.0/16"},
+    )
+    assert response.status_code == 201
+    assert list(shared_cache._entries) == [url_key]
+
+
+@pytest.mark.anyio
+async def test_invalidate_network_with_urls_deletes_url_entries(shared_cache):
+    ip_key = shared_cache_key("8.8.8.8", "ip")
+    url_key = shared_cache_key("example.com", "url")
+    other_url_key = shared_cache_key("other.com", "url")
+    for key in (ip_key, url_key, other_url_key):
+        shared_cache._entries[key] = (float("inf"), b"{}")
+
+    await invalidate_shared_cached_geolocations(
+        [(None, "example.com", None), (None, None, "8.8.0.0/16")]
+    )
+
+    assert list(shared_cache._entries) == [other_url_key]
+
+
+def test_delete_geolocation_invalidates_shared_cache(
+    client, shared_cache, sample_geolocation
+):
+    assert client.get("/geolocations/162.158.103.87").status_code == 200
+    assert shared_cache_key("162.158.103.87", "ip") in shared_cache._entries
+
+    response = client.delete("/geolocations/162.158.103.87")
+    assert response.status_code == 204
+    assert shared_cache._entries == {}
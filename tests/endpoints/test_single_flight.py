@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from src.api.v1.endpoints.single_flight import SingleFlight
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_with_same_key_are_coalesced():
+    single_flight = SingleFlight()
+    executions = []
+
+    async def func():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(
+        *[single_flight.run("8.8.8.8", func) for _ in range(5)]
+    )
+
+    assert results == ["result"] * 5
+    assert len(executions) == 1
+    assert single_flight.stats() == {"in_flight": 0, "calls": 1, "coalesced": 4}
+
+
+@pytest.mark.anyio
+async def test_calls_with_different_keys_are_not_coalesced():
+    single_flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.01)
+        return "result"
+
+    await asyncio.gather(
+        single_flight.run("8.8.8.8", func), single_flight.run("example.com", func)
+    )
+
+    assert single_flight.stats()["calls"] == 2
+    assert single_flight.stats()["coalesced"] == 0
+
+
+@pytest.mark.anyio
+async def test_exception_is_shared_with_all_callers():
+    single_flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream error")
+
+    results = await asyncio.gather(
+        *[single_flight.run("8.8.8.8", func) for _ in range(3)],
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.stats()["calls"] == 1
+
+
+@pytest.mark.anyio
+async def test_sequential_calls_are_executed_separately():
+    single_flight = SingleFlight()
+
+    async def func():
+        return "result"
+
+    await single_flight.run("8.8.8.8", func)
+    await single_flight.run("8.8.8.8", func)
+
+    assert single_flight.stats()["calls"] == 2
+
+
+@pytest.mark.anyio
+async def test_cancelled_caller_does_not_cancel_shared_call():
+    single_flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    first_caller = asyncio.ensure_future(single_flight.run("8.8.8.8", func))
+    second_caller = asyncio.ensure_future(single_flight.run("8.8.8.8", func))
+    await asyncio.sleep(0)
+    first_caller.cancel()
+
+    assert await second_caller == "result"
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database import (
+    ASYNC_DATABASE_URL,
+    MonitoredAsyncQueuePool,
+    MonitoredQueuePool,
+    database_engine_options,
+    pool_stats,
+)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+def test_database_engine_options_defaults(monkeypatch):
+    for name in (
+        "DB_POOL_SIZE",
+        "DB_MAX_OVERFLOW",
+        "DB_POOL_PRE_PING",
+        "DB_CONNECT_TIMEOUT",
+        "DB_STATEMENT_TIMEOUT_MS",
+    ):
+        monkeypatch.delenv(name, raising=False)
+
+    options = database_engine_options()
+
+    assert options["poolclass"] is MonitoredQueuePool
+    assert options["pool_size"] == 5
+    assert options["max_overflow"] == 10
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"] == {}
+
+
+def test_database_engine_options_from_env(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "2.5")
+    monkeypatch.setenv("DB_POOL_RECYCLE", "1800")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    monkeypatch.setenv("DB_CONNECT_TIMEOUT", "3")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "1500")
+
+    options = database_engine_options()
+
+    assert options["pool_size"] == 20
+    assert options["max_overflow"] == 0
+    assert options["pool_timeout"] == 2.5
+    assert options["pool_recycle"] == 1800
+    assert options["pool_pre_ping"] is False
+    assert options["connect_args"] == {
+        "connect_timeout": 3,
+        "options": "-c statement_timeout=1500",
+    }
+
+
+def test_async_database_engine_options_from_env(monkeypatch):
+    monkeypatch.setenv("DB_CONNECT_TIMEOUT", "3")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "1500")
+
+    options = database_engine_options(asynchronous=True)
+
+    assert options["poolclass"] is MonitoredAsyncQueuePool
+    assert options["connect_args"] == {
+        "timeout": 3,
+        "server_settings": {"statement_timeout": "1500"},
+    }
+
+
+def test_statement_timeout_is_applied(monkeypatch):
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "1500")
+    engine = create_engine(DATABASE_URL, **database_engine_options())
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SHOW statement_timeout")).scalar() == "1500ms"
+    engine.dispose()
+
+
+def test_pool_stats(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "2")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "2")
+    engine = create_engine(DATABASE_URL, **database_engine_options())
+
+    with engine.connect():
+        stats = pool_stats(engine)
+        assert stats["checked_out"] == 1
+        assert stats["max_connections"] == 4
+        assert stats["utilization"] == 0.25
+        assert stats["checkouts"] == 1
+
+    stats = pool_stats(engine)
+    assert stats["checked_out"] == 0
+    assert stats["checked_in"] == 1
+    assert stats["checkout_wait_max"] >= stats["checkout_wait_avg"] > 0
+    engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_async_statement_timeout_is_applied(monkeypatch):
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "1500")
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, **database_engine_options(asynchronous=True)
+    )
+
+    async with async_engine.connect() as connection:
+        result = await connection.execute(text("SHOW statement_timeout"))
+        assert result.scalar() == "1500ms"
+        assert pool_stats(async_engine.sync_engine)["checked_out"] == 1
+    await async_engine.dispose()
@@ -0,0 +1,13 @@
+from fastapi.testclient import TestClient
+
+from src.main import app
+
+client = TestClient(app)
+
+
+def test_get_stats():
+    response = client.get("/stats")
+    assert response.status_code == 200
+    assert "hits" in response.json()["geolocation_cache"]
+    assert "misses" in response.json()["geolocation_cache"]
+    assert "utilization" in response.json()["database_pool"]
@@ -0,0 +1,115 @@
+import pytest
+
+from src.metrics import (
+    CallbackMetric,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    geolocation_lookups,
+    geolocation_stage_duration,
+)
+from src.models import IpGeolocation
+
+
+def test_counter():
+    counter = Counter("requests", "Requests.", labelnames=("outcome",))
+
+    counter.inc(outcome="hit")
+    counter.inc(2, outcome="hit")
+    counter.inc(outcome="miss")
+
+    assert counter.value(outcome="hit") == 3
+    assert counter.value(outcome="error") == 0
+
+
+def test_histogram():
+    histogram = Histogram("duration_seconds", "Duration.", buckets=(0.1, 1.0))
+
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5)
+
+    assert histogram.count() == 3
+    assert list(histogram.samples()) == [
+        ("duration_seconds_bucket", {"le": "0.1"}, 2),
+        ("duration_seconds_bucket", {"le": "1.0"}, 2),
+        ("duration_seconds_bucket", {"le": "+Inf"}, 3),
+        ("duration_seconds_sum", {}, 5.15),
+        ("duration_seconds_count", {}, 3),
+    ]
+
+
+def test_registry_render():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("lookups", "Lookups.", labelnames=("outcome",)))
+    registry.register(
+        CallbackMetric(
+            "state",
+            "State.",
+            lambda: {("open",): 0, ("closed",): 1},
+            labelnames=("state",),
+        )
+    )
+    registry.register(
+        CallbackMetric("rejected", "Rejected.", lambda: 2, metric_type="counter")
+    )
+    counter.inc(outcome='say "hi"')
+
+    assert registry.render() == (
+        "# HELP lookups_total Lookups.\n"
+        "# TYPE lookups_total counter\n"
+        'lookups_total{outcome="say \\"hi\\""} 1\n'
+        "# HELP state State.\n"
+        "# TYPE state gauge\n"
+        'state{state="open"} 0\n'
+        'state{state="closed"} 1\n'
+        "# HELP rejected_total Rejected.\n"
+        "# TYPE rejected_total counter\n"
+        "rejected_total 2\n"
+    )
+    with pytest.raises(ValueError):
+        registry.register(Counter("lookups", "Lookups."))
+
+
+def test_get_metrics(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE geolocation_stage_duration_seconds histogram" in response.text
+    assert 'ip_stack_circuit_breaker_state{state="closed"} 1' in response.text
+    assert 'ip_stack_circuit_breaker_transitions_total{state="open"} ' in (
+        response.text
+    )
+    assert 'geolocation_lookups_total{outcome="db_error"} ' in response.text
+    assert "db_pool_checked_out " in response.text
+
+
+def test_get_geolocation_records_metrics(mock_db_session, client):
+    mock_db_session.return_value = IpGeolocation(
+        ip="160.158.103.87",
+        type="ipv4",
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        latitude=52.2317,
+        longitude=21.0183,
+    )
+    db_hits = geolocation_lookups.value(outcome="db_hit")
+    cache_hits = geolocation_lookups.value(outcome="cache_hit")
+    db_queries = geolocation_stage_duration.count(endpoint="get", stage="db_query")
+
+    assert client.get("/geolocations/160.158.103.87").status_code == 200
+    assert client.get("/geolocations/160.158.103.87").status_code == 200
+
+    assert geolocation_lookups.value(outcome="db_hit") == db_hits + 1
+    assert geolocation_lookups.value(outcome="cache_hit") == cache_hits + 1
+    assert (
+        geolocation_stage_duration.count(endpoint="get", stage="db_query")
+        == db_queries + 1
+    )
+    response = client.get("/metrics")
+    assert 'geolocation_lookups_total{outcome="db_hit"}' in response.text
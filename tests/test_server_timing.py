@@ -0,0 +1,130 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api.v1.endpoints import geolocations
+from src.metrics import Histogram
+from src.models import IpGeolocation
+from src.server_timing import (
+    ServerTimingMiddleware,
+    ServerTimings,
+    StageTimer,
+    server_timings,
+)
+from src.validators import IpGeolocationModel
+
+GEOLOCATION_DATA = {
+    "ip": "160.158.103.87",
+    "type": "ipv4",
+    "continent_code": "EU",
+    "continent_name": "Europe",
+    "country_code": "PL",
+    "country_name": "Poland",
+    "region_code": "MZ",
+    "region_name": "Mazovia",
+    "city": "Warsaw",
+    "latitude": 52.2317,
+    "longitude": 21.0183,
+}
+
+
+@pytest.fixture
+def timed_client():
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware)
+    app.include_router(geolocations.router, prefix="/geolocations")
+    return TestClient(app)
+
+
+def parse_server_timing(header: str) -> dict:
+    entries = {}
+    for entry in header.split(", "):
+        name, _, param = entry.partition(";")
+        entries[name] = param.split("=", 1)[1].strip('"')
+    return entries
+
+
+def test_server_timings_header():
+    timings = ServerTimings()
+    timings.add("db_query", 0.0021)
+    timings.source = "db"
+
+    assert timings.header(0.003) == (
+        'db_query;dur=2.100, source;desc="db", total;dur=3.000'
+    )
+
+
+def test_stage_timer_observes_when_block_raises():
+    histogram = Histogram("duration_seconds", "Duration.", labelnames=("stage",))
+    timings = ServerTimings()
+    token = server_timings.set(timings)
+
+    try:
+        with pytest.raises(RuntimeError):
+            with StageTimer(histogram, "db_query"):
+                raise RuntimeError("Database connection error")
+    finally:
+        server_timings.reset(token)
+
+    assert histogram.count(stage="db_query") == 1
+    assert [name for name, _ in timings.entries] == ["db_query"]
+
+
+def test_server_timing_db_hit(mock_db_session, timed_client):
+    mock_db_session.return_value = IpGeolocation(**GEOLOCATION_DATA)
+
+    response = timed_client.get("/geolocations/160.158.103.87")
+    assert response.status_code == 200
+    timing = parse_server_timing(response.headers["Server-Timing"])
+    assert list(timing) == [
+        "validation",
+        "db_query",
+        "serialization",
+        "source",
+        "outcome",
+        "total",
+    ]
+    assert timing["source"] == "db"
+
+    response = timed_client.get("/geolocations/160.158.103.87")
+    timing = parse_server_timing(response.headers["Server-Timing"])
+    assert timing["source"] == "cache"
+    assert "db_query" not in timing
+
+
+def test_server_timing_database_error_fallback(mock_db_session, timed_client):
+    mock_db_session.side_effect = RuntimeError("Database connection error")
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=IpGeolocationModel(**GEOLOCATION_DATA),
+    ):
+        response = timed_client.get("/geolocations/160.158.103.87")
+    assert response.status_code == 200
+    timing = parse_server_timing(response.headers["Server-Timing"])
+    assert timing["source"] == "ipstack"
+    assert timing["outcome"] == "db_error_fallback"
+    assert "db_query" in timing and "ipstack" in timing
+
+
+def test_server_timing_not_found(mock_db_session, timed_client):
+    mock_db_session.return_value = None
+
+    with patch(
+        "src.api.v1.endpoints.geolocations.fetch_geolocation_from_external_source",
+        return_value=None,
+    ):
+        response = timed_client.get("/geolocations/160.158.103.87")
+    assert response.status_code == 404
+    assert "total;dur=" in response.headers["Server-Timing"]
+
+
+def test_server_timing_disabled(mock_db_session, client):
+    mock_db_session.return_value = IpGeolocation(**GEOLOCATION_DATA)
+
+    response = client.get("/geolocations/160.158.103.87")
+    assert response.status_code == 200
+    assert "Server-Timing" not in response.headers
+    assert server_timings.get() is None
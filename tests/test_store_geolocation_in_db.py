@@ -53,7 +53,7 @@ def test_create_and_store_ip_geolocation_full(session, languages):
     assert new_ip_geolocation == ip_geolocation
 
 
-def test_error_when_neither_ip_nor_url_field(session):
+def test_error_when_neither_ip_nor_url_nor_network_field(session):
     location = Location(
         geoname_id=756135,
         capital="Warsaw",
@@ -85,4 +85,53 @@ def test_error_when_neither_ip_nor_url_field(session):
 
     with pytest.raises(exc.IntegrityError) as e:
         session.commit()
-        assert 'violates check constraint "ip_or_url_not_null"' in e.msg
+        assert 'violates check constraint "ip_url_or_network_not_null"' in e.msg
+
+
+def test_error_when_language_code_is_duplicated(session):
+    session.add(Language(code="pl", name="Polish", native="Polski"))
+    session.commit()
+
+    session.add(Language(code="pl", name="Polish", native="Polski"))
+
+    with pytest.raises(exc.IntegrityError, match="languages_code_key"):
+        session.commit()
+
+
+def test_error_when_location_geoname_id_is_duplicated(session):
+    for _ in range(2):
+        session.add(
+            Location(
+                geoname_id=756135,
+                capital="Warsaw",
+                country_flag="https://assets.ipstack.com/flags/pl.svg",
+                country_flag_emoji="🇵🇱",
+                country_flag_emoji_unicode="U+1F1F5 U+1F1F1",
+                calling_code="48",
+                is_eu=True,
+            )
+        )
+
+    with pytest.raises(exc.IntegrityError, match="locations_geoname_id_key"):
+        session.commit()
+
+
+def test_error_when_ip_is_duplicated(session):
+    for _ in range(2):
+        session.add(
+            IpGeolocation(
+                ip="162.158.103.87",
+                continent_code="EU",
+                continent_name="Europe",
+                country_code="PL",
+                country_name="Poland",
+                region_code="MZ",
+                region_name="Mazovia",
+                city="Warsaw",
+                latitude=52.2317008972168,
+                longitude=21.0183391571045,
+            )
+        )
+
+    with pytest.raises(exc.IntegrityError, match="ix_ip_geolocations_ip"):
+        session.commit()
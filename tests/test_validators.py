@@ -1,3 +1,5 @@
+import ipaddress
+
 import pytest
 from pydantic import ValidationError
 
@@ -5,6 +7,7 @@ from src.validators import (
     IpGeolocationModel,
     LanguageModel,
     LocationModel,
+    normalize_ip_or_url,
     normalize_url,
 )
 
@@ -26,6 +29,40 @@ def test_normalize_url(url, expected_output):
     assert normalize_url(url) == expected_output
 
 
+@pytest.mark.parametrize(
+    "value,expected_output",
+    [
+        ("162.158.103.87", ("162.158.103.87", "ip")),
+        ("2001:0db8:0000::0001", ("2001:db8::1", "ip")),
+        ("::ffff:1.2.3.4", (str(ipaddress.ip_address("::ffff:1.2.3.4")), "ip")),
+        ("https://example.com/path?query=123", ("example.com", "url")),
+        ("example.com", ("example.com", "url")),
+        ("1.2.3", ("1.2.3", "url")),
+        ("not_a_url", None),
+        ("", None),
+    ],
+)
+def test_normalize_ip_or_url(value, expected_output):
+    assert normalize_ip_or_url(value) == expected_output
+
+
+def test_normalize_ip_or_url_is_memoized():
+    normalize_ip_or_url.cache_clear()
+    normalize_ip_or_url("162.158.103.87")
+    normalize_ip_or_url("162.158.103.87")
+    assert normalize_ip_or_url.cache_info().hits == 1
+
+
+def test_long_values_are_not_memoized():
+    normalize_ip_or_url.cache_clear()
+    normalize_url.cache_clear()
+    value = "https://example.com/?q=" + "x" * 5000
+
+    assert normalize_ip_or_url(value) == ("example.com", "url")
+    assert normalize_ip_or_url.cache_info().currsize == 0
+    assert normalize_url.cache_info().currsize == 0
+
+
 def test_valid_latitude_and_longitude():
     geolocation = IpGeolocationModel(
         ip="162.158.103.87",
@@ -176,3 +213,51 @@ def test_non_empty_fields():
             type="ipv4",
             url=None,
         )
+
+
+def test_network_is_normalized():
+    geolocation = IpGeolocationModel(
+        network="162.158.103.87/24",
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        latitude=52.2317,
+        longitude=21.0183,
+    )
+    assert geolocation.network == "162.158.103.0/24"
+
+
+def test_invalid_network():
+    with pytest.raises(ValidationError):
+        IpGeolocationModel(
+            network="162.158.103.0/33",
+            continent_code="EU",
+            continent_name="Europe",
+            country_code="PL",
+            country_name="Poland",
+            region_code="MZ",
+            region_name="Mazovia",
+            city="Warsaw",
+            latitude=52.2317,
+            longitude=21.0183,
+        )
+
+
+def test_missing_url_stays_null():
+    geolocation = IpGeolocationModel(
+        ip="162.158.103.87",
+        continent_code="EU",
+        continent_name="Europe",
+        country_code="PL",
+        country_name="Poland",
+        region_code="MZ",
+        region_name="Mazovia",
+        city="Warsaw",
+        latitude=52.2317,
+        longitude=21.0183,
+    )
+    assert geolocation.url is None